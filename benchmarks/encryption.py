@@ -0,0 +1,76 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fileship.settings")
+
+import django
+
+django.setup()
+
+from buckets.encryption import decrypt_chunk, encrypt_chunk
+from buckets.utils import generate_random_uuid
+
+
+def measure(chunks, fn, workers):
+    started_at = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fn, chunks))
+    elapsed = time.perf_counter() - started_at
+
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="MiB to process")
+    parser.add_argument("--chunk-size", type=int, default=8, help="MiB per chunk")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_size * 1024 * 1024
+    chunk = os.urandom(chunk_size)
+    chunks = [
+        (generate_random_uuid(), chunk) for _ in range(args.size // args.chunk_size)
+    ]
+    total = len(chunks) * chunk_size
+
+    # The plain pass only slices the bytes the way the download stream does,
+    # which is the baseline encryption has to be compared against.
+    _, plain_elapsed = measure(
+        chunks, lambda chunk: bytes(memoryview(chunk[1])), args.workers
+    )
+    encrypted, encrypt_elapsed = measure(
+        chunks,
+        lambda chunk: (chunk[0], *encrypt_chunk(chunk[0], chunk[1])),
+        args.workers,
+    )
+    _, decrypt_elapsed = measure(
+        encrypted,
+        lambda chunk: decrypt_chunk(chunk[0], chunk[2], chunk[1]),
+        args.workers,
+    )
+
+    print(
+        json.dumps(
+            {
+                "bytes": total,
+                "chunkSize": chunk_size,
+                "workers": args.workers,
+                "plainMBps": total / plain_elapsed / 1e6,
+                "encryptMBps": total / encrypt_elapsed / 1e6,
+                "decryptMBps": total / decrypt_elapsed / 1e6,
+                "encryptOverhead": encrypt_elapsed / plain_elapsed,
+                "decryptOverhead": decrypt_elapsed / plain_elapsed,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from run import get_commit, setup_django
+
+LEGACY_ALLOWED_HOSTS = [
+    "localhost",
+    "127.0.0.1",
+    *["192.168.{}.{}".format(i, j) for i in range(256) for j in range(256)],
+    ".zpaceway.local",
+    ".zpaceway.com",
+]
+
+HOSTS = ["localhost", "192.168.200.17", "files.zpaceway.com", "evil.example.com"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", default=None)
+
+    return parser.parse_args()
+
+
+def time_per_call(func, iterations: int) -> float:
+    func()
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        func()
+
+    return (time.perf_counter() - started_at) / iterations
+
+
+def benchmark_hosts(iterations: int):
+    from django.http.request import validate_host
+    from fileship.hosts import HostMatcher
+
+    matcher = HostMatcher(
+        ["localhost", "127.0.0.1", "192.168.0.0/16", ".zpaceway.local", ".zpaceway.com"]
+    )
+
+    return {
+        host: {
+            "legacySeconds": time_per_call(
+                lambda: validate_host(host, LEGACY_ALLOWED_HOSTS), iterations // 10
+            ),
+            "compiledSeconds": time_per_call(lambda: matcher.match(host), iterations),
+            "cachedSeconds": time_per_call(
+                lambda: matcher.is_allowed(host), iterations
+            ),
+        }
+        for host in HOSTS
+    }
+
+
+def benchmark_chains(iterations: int):
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory
+    from rest_framework.authtoken.models import Token
+    from buckets.models import Bucket
+    from buckets.utils import generate_random_uuid
+    from core.models import FileshipUser
+    from fileship.handlers import ApiWSGIHandler
+
+    fuser = FileshipUser.get_from_email("benchmark@fileship.local")
+    token = Token.objects.get(user=fuser.user)
+    bucket = Bucket.objects.create(id=generate_random_uuid(), name="benchmark")
+    bucket.users.add(fuser.user)
+
+    factory = RequestFactory(
+        HTTP_AUTHORIZATION=f"Token {token.key}", HTTP_HOST="localhost"
+    )
+    paths = {
+        "listing": f"/srv/api/buckets/{bucket.id}/nodes/",
+        "buckets": "/srv/api/buckets/",
+    }
+    handlers = {"full": WSGIHandler(), "api": ApiWSGIHandler()}
+
+    results = {}
+    for name, path in paths.items():
+        results[name] = {}
+        for handler_name, handler in handlers.items():
+
+            def call():
+                response = handler.get_response(factory.get(path))
+                if response.status_code != 200:
+                    raise Exception(f"{path} returned {response.status_code}")
+
+            results[name][f"{handler_name}Seconds"] = time_per_call(call, iterations)
+
+    return {
+        "middleware": {
+            "full": settings.MIDDLEWARE,
+            "api": settings.API_MIDDLEWARE,
+        },
+        "requests": results,
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fileship.settings")
+    os.environ.setdefault("PROFILING_SAMPLE_RATE", "0")
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, "benchmark.sqlite3"))
+        results = {
+            "commit": get_commit(),
+            "parameters": vars(args),
+            "hosts": benchmark_hosts(args.iterations),
+            "chains": benchmark_chains(args.iterations),
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
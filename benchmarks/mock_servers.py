@@ -0,0 +1,213 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class MockUpstream:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.1,
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.files: Dict[str, bytes] = {}
+        self.requests = 0
+        self.throttled = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def should_throttle(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            throttle = (
+                self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            )
+            self.throttled += 1 if throttle else 0
+
+        return bool(throttle)
+
+    def transfer_delay(self, size: int) -> None:
+        time.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+    def store(self, data: bytes) -> str:
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = data
+
+        return file_id
+
+    def start(self) -> "MockUpstream":
+        upstream = self
+
+        class Handler(MockHandler):
+            pass
+
+        Handler.upstream = upstream
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "files": len(self.files),
+        }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    upstream: MockUpstream
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def read_upload(self, body: bytes) -> bytes:
+        message = BytesParser(policy=default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        for part in message.iter_parts():
+            if part.get_filename():
+                return part.get_payload(decode=True)
+
+        return b""
+
+    def send_json(self, status: int, body: dict, headers: Dict[str, str] = {}):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_file(self, file_id: str):
+        data = self.upstream.files.get(file_id)
+
+        if data is None:
+            return self.send_json(404, {"ok": False, "description": "Not Found"})
+
+        self.upstream.transfer_delay(len(data))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def throttle(self) -> bool:
+        if not self.upstream.should_throttle():
+            return False
+
+        retry_after = self.upstream.retry_after
+        self.send_json(
+            429,
+            {
+                "ok": False,
+                "description": "Too Many Requests",
+                "parameters": {"retry_after": retry_after},
+                "retry_after": retry_after,
+            },
+            {"Retry-After": str(retry_after)},
+        )
+
+        return True
+
+    # Telegram sends documents with a GET request carrying a multipart body,
+    # which is what the connector does, so both verbs are routed the same.
+    def do_GET(self):
+        self.route(self.read_body())
+
+    def do_POST(self):
+        self.route(self.read_body())
+
+    def route(self, body: bytes):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "file" or parts[0] == "attachments":
+            return self.send_file(parts[-1])
+
+        if self.throttle():
+            return
+
+        if parts[-1] == "sendDocument":
+            data = self.read_upload(body)
+            self.upstream.transfer_delay(len(data))
+            file_id = self.upstream.store(data)
+            return self.send_json(
+                200,
+                {"ok": True, "result": {"document": {"file_id": file_id}}},
+            )
+
+        if parts[-1] == "getFile":
+            self.upstream.transfer_delay(0)
+            file_id = parse_qs(url.query)["file_id"][0]
+            return self.send_json(
+                200,
+                {"ok": True, "result": {"file_path": f"documents/{file_id}"}},
+            )
+
+        if parts[0] == "channels" and parts[-1] == "messages":
+            data = self.read_upload(body)
+            self.upstream.transfer_delay(len(data))
+            file_id = self.upstream.store(data)
+            return self.send_json(
+                200,
+                {
+                    "attachments": [
+                        {"url": f"{self.upstream.url}/attachments/{file_id}"}
+                    ]
+                },
+            )
+
+        self.send_json(404, {"ok": False, "description": "Not Found"})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes/s")
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(args.latency, args.bandwidth, args.rate_limit_every)
+    upstream.start()
+    print(f"TELEGRAM_API_URL={upstream.url}")
+    print(f"DISCORD_API_URL={upstream.url}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_servers import MockUpstream
+
+MiB = 1024 * 1024
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connectors", default="telegram,discord,local")
+    parser.add_argument("--file-size", type=int, default=32, help="MiB per file")
+    parser.add_argument("--chunk-size", type=int, default=4, help="MiB per chunk")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--bandwidth", type=float, default=None, help="MiB/s")
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--listing-sizes", default="10,100,1000,5000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None)
+
+    return parser.parse_args()
+
+
+def configure_environment(args, telegram: MockUpstream, discord: MockUpstream):
+    chunk_size = str(args.chunk_size * MiB)
+    os.environ.update(
+        {
+            "DJANGO_SETTINGS_MODULE": "fileship.settings",
+            "TELEGRAM_API_URL": telegram.url,
+            "TELEGRAM_BOT_TOKEN": "100000:benchmark",
+            "TELEGRAM_ADMIN_CHAT_ID": "1",
+            "DISCORD_API_URL": discord.url,
+            "DISCORD_BOT_TOKEN": "benchmark.token",
+            "DISCORD_CHANNEL_ID": "1",
+            "TELEGRAM_CHUNK_SIZE": chunk_size,
+            "DISCORD_CHUNK_SIZE": chunk_size,
+            "LOCAL_CHUNK_SIZE": chunk_size,
+            # The client side rate limits would otherwise dominate every
+            # number; the stand-ins' own 429s still exercise that path.
+            "TELEGRAM_UPLOAD_RATE": "1000",
+            "TELEGRAM_UPLOAD_BURST": "1000",
+            "DISCORD_UPLOAD_RATE": "1000",
+            "DISCORD_UPLOAD_BURST": "1000",
+            "TELEGRAM_API_RATE": "1000",
+            "TELEGRAM_API_BURST": "1000",
+        }
+    )
+
+
+def setup_django(database_path: str):
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.DATABASES["default"]["TEST"]["NAME"] = database_path
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def get_client():
+    from django.test import Client
+    from core.models import FileshipUser
+    from rest_framework.authtoken.models import Token
+
+    fuser = FileshipUser.get_from_email("benchmark@fileship.local")
+    token = Token.objects.get(user=fuser.user)
+
+    return Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+
+def drain_upload_jobs(workers: int):
+    from django.db import connection
+    from buckets import jobs
+
+    def work():
+        while True:
+            job = jobs.claim_job()
+            if job is None:
+                break
+            jobs.process_job(job)
+        connection.close()
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def post_file(client, bucket_id: str, connector: str, data: bytes):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    return client.post(
+        f"/srv/api/buckets/{bucket_id}/nodes/",
+        {
+            "file": SimpleUploadedFile(f"{time.time_ns()}.bin", data),
+            "connector": connector,
+        },
+    )
+
+
+def upload(client, bucket_id: str, connector: str, data: bytes, workers: int):
+    from buckets.models import UploadJob
+
+    started_at = time.perf_counter()
+    response = post_file(client, bucket_id, connector, data)
+    accepted_at = time.perf_counter()
+    drain_upload_jobs(workers)
+    finished_at = time.perf_counter()
+
+    if response.status_code != 200 or UploadJob.objects.exists():
+        raise Exception(f"Upload to {connector} did not complete")
+
+    return response.json()["result"]["id"], {
+        "requestSeconds": accepted_at - started_at,
+        "totalSeconds": finished_at - started_at,
+        "MBps": len(data) / (finished_at - started_at) / 1e6,
+    }
+
+
+def download(client, bucket_id: str, node_id: str, size: int):
+    started_at = time.perf_counter()
+    response = client.get(f"/srv/api/buckets/{bucket_id}/nodes/{node_id}/download/")
+    first_byte_at = None
+    received = 0
+
+    for piece in response.streaming_content:
+        if piece and first_byte_at is None:
+            first_byte_at = time.perf_counter()
+        received += len(piece)
+
+    finished_at = time.perf_counter()
+
+    if received != size:
+        raise Exception(f"Downloaded {received} bytes instead of {size}")
+
+    return {
+        "ttfbSeconds": first_byte_at - started_at,
+        "totalSeconds": finished_at - started_at,
+        "MBps": size / (finished_at - started_at) / 1e6,
+    }
+
+
+def measure_peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, peak
+
+
+def benchmark_connector(client, bucket_id: str, connector: str, args):
+    data = os.urandom(args.file_size * MiB)
+
+    node_id, upload_result = upload(client, bucket_id, connector, data, args.workers)
+    download_result = download(client, bucket_id, node_id, len(data))
+
+    # tracemalloc slows allocation heavily, so memory is measured in a
+    # separate pass from the one the throughput numbers come from.
+    response, upload_peak = measure_peak_memory(
+        post_file, client, bucket_id, connector, data
+    )
+    drain_upload_jobs(args.workers)
+    _, download_peak = measure_peak_memory(
+        download, client, bucket_id, response.json()["result"]["id"], len(data)
+    )
+
+    return {
+        "upload": {**upload_result, "peakMemoryBytes": upload_peak},
+        "download": {**download_result, "peakMemoryBytes": download_peak},
+    }
+
+
+def benchmark_listing(client, bucket_id: str, sizes, repeat: int):
+    from buckets.models import Node
+    from buckets.utils import generate_random_uuid
+
+    results = {}
+    for size in sizes:
+        folder = Node.objects.create(
+            id=generate_random_uuid(),
+            name=f"folder-{size}",
+            bucket_id=bucket_id,
+            size=0,
+        )
+        Node.objects.bulk_create(
+            [
+                Node(
+                    id=generate_random_uuid(),
+                    name=f"file-{index}",
+                    parent=folder,
+                    bucket_id=bucket_id,
+                    size=0,
+                )
+                for index in range(size)
+            ],
+            batch_size=1000,
+        )
+
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            response = client.get(f"/srv/api/buckets/{bucket_id}/nodes/{folder.id}/")
+            timings.append(time.perf_counter() - started_at)
+
+            if response.status_code != 200:
+                raise Exception(f"Listing {size} entries failed")
+
+        results[str(size)] = {
+            "medianSeconds": statistics.median(timings),
+            "minSeconds": min(timings),
+        }
+
+    return results
+
+
+def get_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    bandwidth = args.bandwidth * MiB if args.bandwidth else None
+    telegram = MockUpstream(args.latency, bandwidth, args.rate_limit_every).start()
+    discord = MockUpstream(args.latency, bandwidth, args.rate_limit_every).start()
+    configure_environment(args, telegram, discord)
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, "benchmark.sqlite3"))
+        client = get_client()
+        bucket_id = client.post(
+            "/srv/api/buckets/",
+            {"name": "benchmark"},
+            content_type="application/json",
+        ).json()["result"]["id"]
+
+        results = {
+            "commit": get_commit(),
+            "parameters": vars(args),
+            "connectors": {
+                connector: benchmark_connector(client, bucket_id, connector, args)
+                for connector in args.connectors.split(",")
+            },
+            "listing": benchmark_listing(
+                client,
+                bucket_id,
+                [int(size) for size in args.listing_sizes.split(",")],
+                args.repeat,
+            ),
+            "upstreams": {
+                "telegram": telegram.stats(),
+                "discord": discord.stats(),
+            },
+        }
+
+    telegram.stop()
+    discord.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
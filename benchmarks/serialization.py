@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from run import get_client, get_commit, setup_django
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--chunks", type=int, default=2, help="chunks per file")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None)
+
+    return parser.parse_args()
+
+
+def create_folder(bucket_id: str, entries: int, chunks: int):
+    from buckets.models import Chunk, Node
+    from buckets.utils import generate_random_uuid
+
+    folder = Node.objects.create(
+        id=generate_random_uuid(),
+        name="folder",
+        bucket_id=bucket_id,
+        size=0,
+    )
+    nodes = Node.objects.bulk_create(
+        [
+            Node(
+                id=generate_random_uuid(),
+                name=f"file-{index}",
+                parent=folder,
+                bucket_id=bucket_id,
+                size=chunks * 1024,
+                chunk_size=1024,
+            )
+            for index in range(entries)
+        ],
+        batch_size=1000,
+    )
+    Chunk.objects.bulk_create(
+        [
+            Chunk(
+                id=generate_random_uuid(),
+                node=node,
+                index=index,
+                data=json.dumps({"url": "https://example.com/chunk"}),
+                connector="telegram",
+            )
+            for node in nodes
+            for index in range(chunks)
+        ],
+        batch_size=1000,
+    )
+
+    return folder
+
+
+def measure(func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+
+    return {
+        "medianSeconds": statistics.median(timings),
+        "minSeconds": min(timings),
+    }
+
+
+def benchmark(client, bucket_id: str, folder, repeat: int):
+    from rest_framework.renderers import JSONRenderer
+    from buckets.models import Node
+    from fileship.renderers import FastJSONRenderer
+
+    nodes = Node.objects.filter(parent=folder, bucket_id=bucket_id).order_by("name")
+    instance_rows = [node.representation() for node in nodes.prefetch_related("chunks")]
+    value_rows = Node.representations(nodes)
+
+    if instance_rows != value_rows:
+        raise Exception("Listings built from instances and values differ")
+
+    return {
+        "build": {
+            "instances": measure(
+                lambda: [
+                    node.representation() for node in nodes.prefetch_related("chunks")
+                ],
+                repeat,
+            ),
+            "values": measure(lambda: Node.representations(nodes), repeat),
+        },
+        "render": {
+            "json": measure(
+                lambda: JSONRenderer().render({"result": value_rows}), repeat
+            ),
+            "fast": measure(
+                lambda: FastJSONRenderer().render({"result": value_rows}), repeat
+            ),
+        },
+        "request": measure(
+            lambda: client.get(f"/srv/api/buckets/{bucket_id}/nodes/{folder.id}/"),
+            repeat,
+        ),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fileship.settings")
+    os.environ.setdefault("PROFILING_SAMPLE_RATE", "0")
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, "benchmark.sqlite3"))
+        client = get_client()
+        bucket_id = client.post(
+            "/srv/api/buckets/",
+            {"name": "benchmark"},
+            content_type="application/json",
+        ).json()["result"]["id"]
+        folder = create_folder(bucket_id, args.entries, args.chunks)
+
+        results = {
+            "commit": get_commit(),
+            "parameters": vars(args),
+            **benchmark(client, bucket_id, folder, args.repeat),
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BucketsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "buckets"
+
+    def ready(self):
+        from buckets import metrics, signals
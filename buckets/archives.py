@@ -0,0 +1,432 @@
+import contextvars
+import struct
+import tarfile
+import zlib
+from typing import Dict, Iterator, List, Optional
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from buckets.compression import decode_chunk
+from buckets.models import Chunk, Node
+from buckets.scheduler import current_owner
+from buckets.storage import prefetch_chunk_payloads
+from fileship.logs import log_context
+
+ZIP64_LIMIT = 0xFFFFFFFF
+
+ZIP_UTF8_FLAG = 0x0800
+
+ZIP_DATA_DESCRIPTOR_FLAG = 0x0008
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+QUERY_BATCH_SIZE = 500
+
+ENTRY_FIELDS = (
+    "id",
+    "parent_id",
+    "name",
+    "updated_at",
+    "pack_id",
+    "pack_offset",
+    "pack_length",
+)
+
+
+class ArchiveEntry:
+    def __init__(
+        self,
+        path: str,
+        modified_at,
+        chunks: Optional[List[Chunk]] = None,
+        pack_offset: Optional[int] = None,
+        pack_length: Optional[int] = None,
+    ) -> None:
+        self.path = path
+        self.modified_at = modified_at
+        self.chunks = chunks
+        self.pack_offset = pack_offset
+        self.is_dir = chunks is None
+        self.size = (
+            pack_length
+            if pack_offset is not None
+            else sum(chunk.size or 0 for chunk in chunks or [])
+        )
+        self.uploaded = all(chunk.size is not None for chunk in chunks or [])
+
+
+def get_chunks_by_id(chunk_ids: List[str]) -> Dict[str, Chunk]:
+    chunks = {}
+    for offset in range(0, len(chunk_ids), QUERY_BATCH_SIZE):
+        for chunk in Chunk.objects.filter(
+            id__in=chunk_ids[offset : offset + QUERY_BATCH_SIZE]
+        ):
+            chunks[chunk.id] = chunk
+
+    return chunks
+
+
+def collect_entries(bucket_id: str, node_ids: List[str]) -> List[ArchiveEntry]:
+    # Subtrees are walked one depth level per query, and every chunk is
+    # loaded up front because entry sizes have to be known before the first
+    # byte is sent.
+    paths: Dict[str, str] = {}
+    nodes = []
+
+    level = list(
+        Node.objects.filter(id__in=node_ids, bucket_id=bucket_id).values_list(
+            *ENTRY_FIELDS
+        )
+    )
+    while level:
+        parent_ids = []
+        for node in level:
+            id, parent_id, name = node[:3]
+            if id in paths:
+                continue
+            paths[id] = f"{paths[parent_id]}/{name}" if parent_id in paths else name
+            nodes.append(node)
+            parent_ids.append(id)
+
+        level = []
+        for offset in range(0, len(parent_ids), QUERY_BATCH_SIZE):
+            level.extend(
+                Node.objects.filter(
+                    parent_id__in=parent_ids[offset : offset + QUERY_BATCH_SIZE],
+                    bucket_id=bucket_id,
+                ).values_list(*ENTRY_FIELDS)
+            )
+
+    chunks: Dict[str, List[Chunk]] = {}
+    ids = [node[0] for node in nodes]
+    for offset in range(0, len(ids), QUERY_BATCH_SIZE):
+        for chunk in Chunk.objects.filter(
+            node_id__in=ids[offset : offset + QUERY_BATCH_SIZE]
+        ).order_by("node_id", "index"):
+            chunks.setdefault(chunk.node_id, []).append(chunk)
+
+    packs = get_chunks_by_id(list({node[4] for node in nodes if node[4]}))
+
+    entries = []
+    for id, _, _, updated_at, pack_id, pack_offset, pack_length in nodes:
+        if pack_id:
+            entries.append(
+                ArchiveEntry(
+                    paths[id],
+                    updated_at,
+                    [packs[pack_id]],
+                    pack_offset,
+                    pack_length,
+                )
+            )
+        else:
+            entries.append(ArchiveEntry(paths[id], updated_at, chunks.get(id)))
+    entries.sort(key=lambda entry: entry.path)
+
+    return entries
+
+
+def mark_entries_accessed(entries: List[ArchiveEntry]) -> None:
+    chunk_ids = list(
+        {chunk.id for entry in entries for chunk in entry.chunks or []},
+    )
+    accessed_at = timezone.now()
+
+    for offset in range(0, len(chunk_ids), QUERY_BATCH_SIZE):
+        Chunk.objects.filter(
+            id__in=chunk_ids[offset : offset + QUERY_BATCH_SIZE],
+        ).update(
+            access_count=F("access_count") + 1,
+            accessed_at=accessed_at,
+        )
+
+
+class EntryPayloads:
+    def __init__(self, bucket_id: str, entries: List[ArchiveEntry]) -> None:
+        context = contextvars.copy_context()
+        context.run(current_owner.set, bucket_id)
+        context.run(log_context.set, {**log_context.get(), "bucket": bucket_id})
+
+        # Entries are sorted by path, so files packed together usually follow
+        # each other and their pack is only fetched and decoded once.
+        chunks = []
+        self.pack_id = None
+        for entry in entries:
+            if entry.is_dir:
+                continue
+            if entry.pack_offset is None:
+                chunks.extend(entry.chunks)
+            elif entry.chunks[0].id != self.pack_id:
+                self.pack_id = entry.chunks[0].id
+                chunks.append(entry.chunks[0])
+
+        self.pack_id = None
+        self.pack = b""
+        self.payloads = prefetch_chunk_payloads(
+            context,
+            chunks,
+            settings.ARCHIVE_PREFETCH_CHUNKS,
+        )
+
+    def read(self) -> bytes:
+        return next(self.payloads)
+
+    def get_pack(self, chunk: Chunk) -> bytes:
+        if chunk.id != self.pack_id:
+            self.pack_id = chunk.id
+            self.pack = b"".join(decode_chunk(self.read(), chunk.codec))
+
+        return self.pack
+
+
+def get_entry_data(entry: ArchiveEntry, payloads: EntryPayloads) -> Iterator[bytes]:
+    if entry.pack_offset is not None:
+        pack = payloads.get_pack(entry.chunks[0])
+        yield pack[entry.pack_offset : entry.pack_offset + entry.size]
+        return
+
+    for chunk in entry.chunks:
+        yield from decode_chunk(payloads.read(), chunk.codec)
+
+
+class ZipArchive:
+    content_type = "application/zip"
+
+    @classmethod
+    def get_dos_datetime(cls, entry: ArchiveEntry):
+        value = entry.modified_at
+        if value.year < 1980:
+            return 0, (1 << 5) | 1
+
+        return (
+            (value.hour << 11) | (value.minute << 5) | (value.second // 2),
+            ((value.year - 1980) << 9) | (value.month << 5) | value.day,
+        )
+
+    @classmethod
+    def get_name(cls, entry: ArchiveEntry) -> bytes:
+        return (f"{entry.path}/" if entry.is_dir else entry.path).encode()
+
+    @classmethod
+    def get_flags(cls, entry: ArchiveEntry) -> int:
+        if entry.is_dir:
+            return ZIP_UTF8_FLAG
+
+        return ZIP_UTF8_FLAG | ZIP_DATA_DESCRIPTOR_FLAG
+
+    @classmethod
+    def local_header(cls, entry: ArchiveEntry) -> bytes:
+        # The CRC is only known once the data has been streamed, so it goes
+        # into a data descriptor after it and the header leaves it blank.
+        name = cls.get_name(entry)
+        zip64 = entry.size >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+
+        return (
+            struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                45 if zip64 else 20,
+                cls.get_flags(entry),
+                0,
+                *cls.get_dos_datetime(entry),
+                0,
+                ZIP64_LIMIT if zip64 else 0,
+                ZIP64_LIMIT if zip64 else 0,
+                len(name),
+                len(extra),
+            )
+            + name
+            + extra
+        )
+
+    @classmethod
+    def data_descriptor(cls, entry: ArchiveEntry, crc: int) -> bytes:
+        if entry.size >= ZIP64_LIMIT:
+            return struct.pack("<IIQQ", 0x08074B50, crc, entry.size, entry.size)
+
+        return struct.pack("<IIII", 0x08074B50, crc, entry.size, entry.size)
+
+    @classmethod
+    def central_header(cls, entry: ArchiveEntry, crc: int, offset: int) -> bytes:
+        name = cls.get_name(entry)
+        size, zip64_fields = entry.size, []
+
+        if entry.size >= ZIP64_LIMIT:
+            size = ZIP64_LIMIT
+            zip64_fields += [entry.size, entry.size]
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = ZIP64_LIMIT
+
+        extra = b""
+        if zip64_fields:
+            extra = struct.pack(
+                f"<HH{len(zip64_fields)}Q",
+                1,
+                8 * len(zip64_fields),
+                *zip64_fields,
+            )
+
+        version = 45 if zip64_fields else 20
+        mode = 0o40755 if entry.is_dir else 0o100644
+
+        return (
+            struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                (3 << 8) | version,
+                version,
+                cls.get_flags(entry),
+                0,
+                *cls.get_dos_datetime(entry),
+                crc,
+                size,
+                size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                (mode << 16) | (0x10 if entry.is_dir else 0),
+                offset,
+            )
+            + name
+            + extra
+        )
+
+    @classmethod
+    def end_records(cls, count: int, offset: int, size: int) -> bytes:
+        if count < 0xFFFF and offset < ZIP64_LIMIT and size < ZIP64_LIMIT:
+            return struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, count, count, size, offset, 0
+            )
+
+        return (
+            struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50,
+                44,
+                (3 << 8) | 45,
+                45,
+                0,
+                0,
+                count,
+                count,
+                size,
+                offset,
+            )
+            + struct.pack("<IIQI", 0x07064B50, 0, offset + size, 1)
+            + struct.pack(
+                "<IHHHHIIH",
+                0x06054B50,
+                0,
+                0,
+                0xFFFF,
+                0xFFFF,
+                ZIP64_LIMIT,
+                ZIP64_LIMIT,
+                0,
+            )
+        )
+
+    @classmethod
+    def get_entry_size(cls, entry: ArchiveEntry) -> int:
+        size = len(cls.local_header(entry)) + entry.size
+        if not entry.is_dir:
+            size += len(cls.data_descriptor(entry, 0))
+
+        return size
+
+    @classmethod
+    def get_size(cls, entries: List[ArchiveEntry]) -> int:
+        offset, directory_size = 0, 0
+        for entry in entries:
+            directory_size += len(cls.central_header(entry, 0, offset))
+            offset += cls.get_entry_size(entry)
+
+        return (
+            offset
+            + directory_size
+            + len(cls.end_records(len(entries), offset, directory_size))
+        )
+
+    @classmethod
+    def stream(
+        cls,
+        entries: List[ArchiveEntry],
+        payloads: EntryPayloads,
+    ) -> Iterator[bytes]:
+        offset, directory = 0, []
+        for entry in entries:
+            yield cls.local_header(entry)
+
+            crc = 0
+            if not entry.is_dir:
+                for piece in get_entry_data(entry, payloads):
+                    crc = zlib.crc32(piece, crc)
+                    yield piece
+                yield cls.data_descriptor(entry, crc)
+
+            directory.append(cls.central_header(entry, crc, offset))
+            offset += cls.get_entry_size(entry)
+
+        directory_size = sum(len(header) for header in directory)
+        yield from directory
+        yield cls.end_records(len(entries), offset, directory_size)
+
+
+class TarArchive:
+    content_type = "application/x-tar"
+
+    @classmethod
+    def header(cls, entry: ArchiveEntry) -> bytes:
+        info = tarfile.TarInfo(entry.path)
+        info.mtime = int(entry.modified_at.timestamp())
+        if entry.is_dir:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            info.size = entry.size
+            info.mode = 0o644
+
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    @classmethod
+    def get_padding(cls, entry: ArchiveEntry) -> int:
+        return -entry.size % TAR_BLOCK_SIZE
+
+    @classmethod
+    def get_size(cls, entries: List[ArchiveEntry]) -> int:
+        return (
+            sum(
+                len(cls.header(entry)) + entry.size + cls.get_padding(entry)
+                for entry in entries
+            )
+            + 2 * TAR_BLOCK_SIZE
+        )
+
+    @classmethod
+    def stream(
+        cls,
+        entries: List[ArchiveEntry],
+        payloads: EntryPayloads,
+    ) -> Iterator[bytes]:
+        for entry in entries:
+            yield cls.header(entry)
+
+            if not entry.is_dir:
+                yield from get_entry_data(entry, payloads)
+                yield b"\0" * cls.get_padding(entry)
+
+        yield b"\0" * (2 * TAR_BLOCK_SIZE)
+
+
+AVAILABLE_ARCHIVE_FORMATS = {
+    "zip": {
+        "cls": ZipArchive,
+    },
+    "tar": {
+        "cls": TarArchive,
+    },
+}
@@ -0,0 +1,363 @@
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from buckets.chunking import get_chunk_size
+from buckets.connectors import AVAILABLE_CONNECTORS
+from buckets.models import Bucket, Chunk, Node
+from buckets.utils import generate_random_uuid
+
+QUERY_BATCH_SIZE = 500
+
+
+def get_id(operation: dict, key: str) -> Optional[str]:
+    value = operation.get(key)
+
+    return value if isinstance(value, str) and value else None
+
+
+def in_batches(ids: Iterable[str]) -> Iterable[List[str]]:
+    ids = list(ids)
+    for offset in range(0, len(ids), QUERY_BATCH_SIZE):
+        yield ids[offset : offset + QUERY_BATCH_SIZE]
+
+
+class NodeBatch:
+    def __init__(self, bucket: Bucket, user: User) -> None:
+        self.bucket = bucket
+        self.user = user
+        self.nodes: Dict[str, dict] = {}
+        self.original: Dict[str, Tuple[Optional[str], str]] = {}
+        self.children: Dict[Optional[str], Dict[str, str]] = {}
+        self.created: Dict[str, Node] = {}
+        self.chunks: List[Chunk] = []
+        self.updated: Set[str] = set()
+        self.deleted: Set[str] = set()
+
+    def load_nodes(self, ids: Iterable[str]) -> None:
+        # Referenced nodes are loaded together with all of their ancestors so
+        # cycle and trash checks never have to go back to the database.
+        ids = {id for id in ids if id and id not in self.nodes}
+        queried = set()
+        while ids:
+            queried |= ids
+            for batch in in_batches(ids):
+                for id, parent_id, name, pack_id, has_chunks in (
+                    Node.objects.filter(id__in=batch, bucket=self.bucket)
+                    .annotate(
+                        has_chunks=Exists(Chunk.objects.filter(node=OuterRef("pk")))
+                    )
+                    .values_list("id", "parent_id", "name", "pack_id", "has_chunks")
+                ):
+                    self.nodes[id] = {
+                        "parent": parent_id,
+                        "name": name,
+                        "folder": not pack_id and not has_chunks,
+                    }
+                    self.original[id] = (parent_id, name)
+            ids = {
+                node["parent"]
+                for node in self.nodes.values()
+                if node["parent"] and node["parent"] not in self.nodes
+            } - queried
+
+    def load_children(self, parent_ids: Iterable[Optional[str]]) -> None:
+        parent_ids = {id for id in parent_ids if id not in self.children}
+        for id in parent_ids:
+            self.children[id] = {}
+
+        if None in parent_ids:
+            for id, name in Node.objects.filter(
+                parent=None,
+                bucket=self.bucket,
+            ).values_list("id", "name"):
+                self.children[None][name] = id
+
+        for batch in in_batches(parent_ids - {None}):
+            for id, parent_id, name in Node.objects.filter(
+                parent_id__in=batch,
+                bucket=self.bucket,
+            ).values_list("id", "parent_id", "name"):
+                self.children[parent_id][name] = id
+
+    def load(self, operations: List[dict]) -> None:
+        self.load_nodes(
+            get_id(operation, key)
+            for operation in operations
+            for key in ("id", "node", "parent")
+        )
+        self.load_children(
+            [
+                get_id(operation, "parent")
+                for operation in operations
+                if operation.get("op") in ("createFolder", "createFile", "move")
+            ]
+            + [
+                self.nodes[get_id(operation, "node")]["parent"]
+                for operation in operations
+                if get_id(operation, "node") in self.nodes
+            ]
+        )
+
+    def is_deleted(self, id: Optional[str]) -> bool:
+        while id:
+            if id in self.deleted:
+                return True
+            id = self.nodes[id]["parent"] if id in self.nodes else None
+
+        return False
+
+    def get_node_error(self, id: Optional[str]) -> Optional[str]:
+        if id not in self.nodes or self.is_deleted(id):
+            return "Node not found"
+
+        return None
+
+    def get_parent_error(self, parent_id: Optional[str]) -> Optional[str]:
+        if parent_id is None:
+            return None
+
+        if parent_id not in self.nodes or self.is_deleted(parent_id):
+            return "Parent not found"
+
+        if not self.nodes[parent_id]["folder"]:
+            return "Parent is not a folder"
+
+        return None
+
+    def get_name_error(self, name, parent_id: Optional[str]) -> Optional[str]:
+        if not isinstance(name, str) or not name or len(name) > 256:
+            return "Invalid name"
+
+        self.load_children([parent_id])
+        if name in self.children[parent_id]:
+            return "A node with this name already exists"
+
+        return None
+
+    def set_parent(self, id: str, parent_id: Optional[str], name: str) -> None:
+        node = self.nodes[id]
+        self.load_children([node["parent"], parent_id])
+        self.children[node["parent"]].pop(node["name"], None)
+        self.children[parent_id][name] = id
+        node["parent"] = parent_id
+        node["name"] = name
+
+    def create(self, operation: dict, folder: bool) -> Tuple[Optional[str], str]:
+        id = operation.get("id") or generate_random_uuid()
+        name = operation.get("name")
+        parent_id = get_id(operation, "parent")
+
+        if not isinstance(id, str) or len(id) < 64:
+            return None, "NodeId must have at least 64 characters"
+
+        if id in self.nodes:
+            return None, "Node already exists"
+
+        error = self.get_parent_error(parent_id) or self.get_name_error(name, parent_id)
+        if error:
+            return None, error
+
+        node = Node(
+            id=id,
+            name=name,
+            parent_id=parent_id,
+            bucket=self.bucket,
+            size=0,
+        )
+
+        if not folder:
+            connector = operation.get("connector")
+            try:
+                node.size = int(operation.get("size") or 0)
+                chunks = int(operation.get("chunks") or 0)
+            except (TypeError, ValueError):
+                return None, "Invalid size"
+
+            if connector and connector not in AVAILABLE_CONNECTORS:
+                return None, "Connector not found"
+
+            if connector and node.size and not chunks:
+                node.chunk_size = get_chunk_size(connector, node.size)
+                chunks = math.ceil(node.size / node.chunk_size)
+            elif chunks:
+                node.chunk_size = math.ceil(node.size / chunks)
+
+            self.chunks.extend(
+                Chunk(
+                    id=generate_random_uuid(),
+                    node=node,
+                    index=index,
+                )
+                for index in range(chunks)
+            )
+
+        self.nodes[id] = {
+            "parent": parent_id,
+            "name": name,
+            "folder": folder,
+        }
+        self.children[parent_id][name] = id
+        self.children[id] = {}
+        self.created[id] = node
+
+        return id, None
+
+    def move(self, operation: dict) -> Tuple[Optional[str], Optional[str]]:
+        id = get_id(operation, "node")
+        parent_id = get_id(operation, "parent")
+
+        error = self.get_node_error(id) or self.get_parent_error(parent_id)
+        if error:
+            return id, error
+
+        ancestor_id = parent_id
+        while ancestor_id:
+            if ancestor_id == id:
+                return id, "A node cannot be moved into itself"
+            ancestor_id = self.nodes[ancestor_id]["parent"]
+
+        name = self.nodes[id]["name"]
+        if self.nodes[id]["parent"] != parent_id:
+            error = self.get_name_error(name, parent_id)
+            if error:
+                return id, error
+
+        self.set_parent(id, parent_id, name)
+        self.updated.add(id)
+
+        return id, None
+
+    def rename(self, operation: dict) -> Tuple[Optional[str], Optional[str]]:
+        id = get_id(operation, "node")
+        name = operation.get("name")
+
+        error = self.get_node_error(id)
+        if error:
+            return id, error
+
+        parent_id = self.nodes[id]["parent"]
+        if name != self.nodes[id]["name"]:
+            error = self.get_name_error(name, parent_id)
+            if error:
+                return id, error
+
+        self.set_parent(id, parent_id, name)
+        self.updated.add(id)
+
+        return id, None
+
+    def delete(self, operation: dict) -> Tuple[Optional[str], Optional[str]]:
+        id = get_id(operation, "node")
+
+        error = self.get_node_error(id)
+        if error:
+            return id, error
+
+        node = self.nodes[id]
+        self.load_children([node["parent"]])
+        self.children[node["parent"]].pop(node["name"], None)
+        self.deleted.add(id)
+
+        return None, None
+
+    def apply(
+        self, operations: List[dict]
+    ) -> List[Tuple[Optional[str], Optional[str]]]:
+        handlers = {
+            "createFolder": lambda operation: self.create(operation, True),
+            "createFile": lambda operation: self.create(operation, False),
+            "move": self.move,
+            "rename": self.rename,
+            "delete": self.delete,
+        }
+
+        self.load(operations)
+
+        return [
+            (
+                handlers[operation["op"]](operation)
+                if operation.get("op") in handlers
+                else (None, "Unknown operation")
+            )
+            for operation in operations
+        ]
+
+    def get_trashed_ids(self) -> Set[str]:
+        # Nodes end up in the trash when any of their final ancestors was
+        # deleted, which includes untouched descendants that are only known
+        # to the database, but not ones moved out earlier in the batch.
+        trashed = {id for id in self.nodes if self.is_deleted(id)}
+        level = [id for id in trashed if id not in self.created]
+
+        while level:
+            parent_ids, level = level, []
+            for batch in in_batches(parent_ids):
+                for id, parent_id in Node.objects.filter(
+                    parent_id__in=batch,
+                    bucket=self.bucket,
+                ).values_list("id", "parent_id"):
+                    if id in trashed or (
+                        id in self.nodes and self.nodes[id]["parent"] != parent_id
+                    ):
+                        continue
+                    trashed.add(id)
+                    level.append(id)
+
+        return trashed
+
+    def save(self) -> None:
+        trashed = self.get_trashed_ids() if self.deleted else set()
+
+        # Trashing runs first and creating last, so names freed earlier in the
+        # batch are already free when they're taken again.
+        if trashed:
+            trash_bucket = Bucket.get_trash(self.user, self.bucket.id)
+            for batch in in_batches(trashed - set(self.created)):
+                Node.objects.filter(id__in=batch).update(bucket=trash_bucket)
+            for id in trashed & set(self.created):
+                self.created[id].bucket = trash_bucket
+
+        updated = [
+            id
+            for id in self.updated - set(self.created)
+            if (self.nodes[id]["parent"], self.nodes[id]["name"]) != self.original[id]
+        ]
+        targets = {(self.nodes[id]["parent"], self.nodes[id]["name"]) for id in updated}
+
+        # Swapped names would collide halfway through a single update, so in
+        # that case every updated node first steps aside under its own id.
+        if any(self.original[id] in targets for id in updated):
+            Node.objects.bulk_update(
+                [Node(id=id, name=id[:256]) for id in updated],
+                ["name"],
+                batch_size=QUERY_BATCH_SIZE,
+            )
+
+        updated_at = timezone.now()
+        Node.objects.bulk_update(
+            [
+                Node(
+                    id=id,
+                    parent_id=self.nodes[id]["parent"],
+                    name=self.nodes[id]["name"],
+                    updated_at=updated_at,
+                )
+                for id in updated
+            ],
+            ["parent", "name", "updated_at"],
+            batch_size=QUERY_BATCH_SIZE,
+        )
+        Node.objects.bulk_create(self.created.values(), batch_size=QUERY_BATCH_SIZE)
+        Chunk.objects.bulk_create(self.chunks, batch_size=QUERY_BATCH_SIZE)
+
+    def get_representations(self, ids: Iterable[str]) -> Dict[str, dict]:
+        representations = {}
+        for batch in in_batches(set(ids)):
+            for representation in Node.representations(
+                Node.objects.filter(id__in=batch, bucket=self.bucket)
+            ):
+                representations[representation["id"]] = representation
+
+        return representations
@@ -0,0 +1,57 @@
+import math
+from django.conf import settings
+from django.db.models import F
+from buckets.connectors import AVAILABLE_CONNECTORS
+from buckets.models import ConnectorThroughput
+
+
+def get_chunk_size(connector: str, file_size: int) -> int:
+    max_chunk_size = settings.CONNECTOR_CHUNK_SIZES[connector]
+
+    if not settings.ADAPTIVE_CHUNK_SIZE or file_size <= max_chunk_size:
+        return max_chunk_size
+
+    chunk_size = max_chunk_size
+    bytes_per_second = (
+        ConnectorThroughput.objects.filter(connector=connector)
+        .values_list("bytes_per_second", flat=True)
+        .first()
+    )
+
+    # Slow upstreams get smaller chunks so a single retry re-sends less data,
+    # and big files are split at least once per account so they upload in
+    # parallel across the whole pool.
+    if bytes_per_second:
+        chunk_size = min(
+            chunk_size,
+            int(bytes_per_second * settings.ADAPTIVE_CHUNK_TARGET_SECONDS),
+        )
+
+    parallelism = settings.UPLOAD_CONNECTOR_CONCURRENCY.get(connector, 1) * len(
+        AVAILABLE_CONNECTORS[connector]["cls"].pool or [None]
+    )
+    chunk_size = min(chunk_size, math.ceil(file_size / parallelism))
+    chunk_size = max(chunk_size, settings.ADAPTIVE_CHUNK_MIN_SIZE)
+    chunk_size = math.ceil(chunk_size / (64 * 1024)) * 64 * 1024
+
+    return min(chunk_size, max_chunk_size)
+
+
+def record_throughput(connector: str, size: int, elapsed: float) -> None:
+    if not size or elapsed <= 0:
+        return
+
+    alpha = settings.ADAPTIVE_CHUNK_THROUGHPUT_ALPHA
+    bytes_per_second = size / elapsed
+
+    updated = ConnectorThroughput.objects.filter(connector=connector).update(
+        bytes_per_second=alpha * bytes_per_second + (1 - alpha) * F("bytes_per_second")
+    )
+
+    if not updated:
+        ConnectorThroughput.objects.get_or_create(
+            connector=connector,
+            defaults={
+                "bytes_per_second": bytes_per_second,
+            },
+        )
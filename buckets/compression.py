@@ -0,0 +1,85 @@
+import lzma
+import zlib
+from typing import Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SAMPLE_SIZE = 64 * 1024
+
+PIECE_SIZE = 256 * 1024
+
+AVAILABLE_CODECS = {
+    "zlib": {
+        "compress": lambda data: zlib.compress(data, 6),
+        "decompressor": zlib.decompressobj,
+    },
+    "lzma": {
+        "compress": lambda data: lzma.compress(data, preset=1),
+        "decompressor": lzma.LZMADecompressor,
+    },
+}
+
+if zstandard is not None:
+    AVAILABLE_CODECS["zstd"] = {
+        "compress": lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        "decompressor": lambda: zstandard.ZstdDecompressor().decompressobj(),
+    }
+
+
+def encode_chunk(data: bytes, codec: Optional[str]) -> Tuple[Optional[str], bytes]:
+    if not codec or not data:
+        return None, data
+
+    compress = AVAILABLE_CODECS[codec]["compress"]
+
+    # Media and archives don't shrink, so a small sample decides whether the
+    # whole chunk is worth the CPU time.
+    sample = data[:SAMPLE_SIZE]
+    if len(compress(sample)) > len(sample) * 0.9:
+        return None, data
+
+    compressed = compress(data)
+    if len(compressed) >= len(data):
+        return None, data
+
+    return codec, compressed
+
+
+def decode_chunk(payload: bytes, codec: Optional[str]) -> Iterator[bytes]:
+    if not codec:
+        yield payload
+        return
+
+    decompressor = AVAILABLE_CODECS[codec]["decompressor"]()
+    for offset in range(0, len(payload), PIECE_SIZE):
+        piece = decompressor.decompress(payload[offset : offset + PIECE_SIZE])
+        if piece:
+            yield piece
+
+    if hasattr(decompressor, "flush"):
+        piece = decompressor.flush()
+        if piece:
+            yield piece
+
+
+def slice_pieces(
+    pieces: Iterator[bytes],
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[bytes]:
+    offset = 0
+
+    for piece in pieces:
+        piece_end = offset + len(piece)
+
+        if piece_end > start and (end is None or offset < end):
+            yield piece[max(start - offset, 0) : None if end is None else end - offset]
+
+        offset = piece_end
+
+        if end is not None and offset >= end:
+            break
@@ -1,18 +1,140 @@
 import abc
+import contextlib
+import itertools
+import json
 import os
-from typing import Dict, List, Literal, Union
-import requests
+import threading
+import time
+from typing import Dict, List, Literal, Optional, Union
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.conf import settings
-from fileship.utils import auto_retry
+from django.core.cache import cache
+from fileship.metrics import CACHE_REQUESTS, CHUNK_UPLOAD_BYTES, CHUNK_UPLOAD_SECONDS
+from fileship.profiling import record_span
+from fileship.retry import RetryBudget, RetryPolicy
 from django.conf import settings
 
+from buckets.health import CircuitOpenError, get_health
+from buckets.scheduler import scheduler
 from buckets.utils import generate_random_uuid
 
+# Upload jobs are retried durably by the queue, so in-process retries only
+# smooth over short blips instead of re-sending a whole chunk ten times.
+TELEGRAM_UPLOAD_RETRY_POLICY = RetryPolicy(
+    "telegram_upload",
+    max_attempts=3,
+    base_delay=1,
+    max_delay=10,
+    deadline=10 * 60,
+    budget=RetryBudget(),
+)
+
+TELEGRAM_FILE_PATH_RETRY_POLICY = RetryPolicy(
+    "telegram_file_path",
+    max_attempts=5,
+    base_delay=0.5,
+    max_delay=5,
+    deadline=30,
+    budget=RetryBudget(),
+)
+
+DISCORD_UPLOAD_RETRY_POLICY = RetryPolicy(
+    "discord_upload",
+    max_attempts=3,
+    base_delay=1,
+    max_delay=10,
+    deadline=10 * 60,
+    budget=RetryBudget(),
+)
+
+
+class ConnectorPool:
+    def __init__(self, limit: str, accounts: List[Dict[str, str]]) -> None:
+        self.limit = limit
+        self.accounts = accounts
+        self.lock = threading.Lock()
+        self.in_flight = {account["id"]: 0 for account in accounts}
+        self.cursor = itertools.count()
+
+    @classmethod
+    def from_env(
+        cls,
+        limit: str,
+        tokens: Optional[str],
+        targets: Optional[str],
+        get_account_id=lambda token, target: target,
+    ) -> "ConnectorPool":
+        tokens_list = [token.strip() for token in (tokens or "").split(",")]
+        targets_list = [target.strip() for target in (targets or "").split(",")]
+
+        if len(targets_list) == 1:
+            targets_list = targets_list * len(tokens_list)
+        if len(tokens_list) == 1:
+            tokens_list = tokens_list * len(targets_list)
+
+        accounts = []
+        for token, target in zip(tokens_list, targets_list):
+            account_id = get_account_id(token, target)
+            accounts.append(
+                {
+                    "id": account_id,
+                    "token": token,
+                    "target": target,
+                    "key": f"{limit}:{account_id}",
+                }
+            )
+
+        return cls(limit, accounts)
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        waits = scheduler.get_waits(
+            self.limit,
+            [account["key"] for account in self.accounts],
+        )
+
+        with self.lock:
+            available = [
+                account
+                for account in self.accounts
+                if get_health(account["key"]).is_available()
+            ]
+
+            if not available:
+                raise CircuitOpenError(f"Every {self.limit} account is unavailable")
+
+            offset = next(self.cursor) % len(available)
+            rotated = available[offset:] + available[:offset]
+            account = min(
+                rotated,
+                key=lambda account: (
+                    waits.get(account["key"], 0),
+                    self.in_flight[account["id"]],
+                ),
+            )
+            self.in_flight[account["id"]] += 1
+
+        try:
+            yield account
+        finally:
+            with self.lock:
+                self.in_flight[account["id"]] -= 1
+
 
 class AbstractConnector(abc.ABC):
 
     name: str
+    remote: bool = True
+    pool: Optional[ConnectorPool] = None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return cls.pool is None or any(
+            get_health(account["key"]).is_available() for account in cls.pool.accounts
+        )
 
     @classmethod
     @abc.abstractmethod
@@ -23,28 +145,50 @@ class AbstractConnector(abc.ABC):
 
 
 class TelegramConnector(AbstractConnector):
-    TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    TELEGRAM_ADMIN_CHAT_ID = os.getenv("TELEGRAM_ADMIN_CHAT_ID")
+    pool = ConnectorPool.from_env(
+        "telegram",
+        os.getenv("TELEGRAM_BOT_TOKEN"),
+        os.getenv("TELEGRAM_ADMIN_CHAT_ID"),
+        get_account_id=lambda token, target: f"{token.split(':')[0]}:{target}",
+    )
 
     name = "Telegram Connector"
 
+    @classmethod
+    def get_bot_token(cls, bot_id: Optional[str] = None) -> str:
+        for account in cls.pool.accounts:
+            if account["token"].split(":")[0] == bot_id:
+                return account["token"]
+
+        return cls.pool.accounts[0]["token"]
+
     @classmethod
     def upload(
         cls, uploaded_file: InMemoryUploadedFile
     ) -> List[Dict[Union[Literal["name"], Literal["url"]], str]]:
         chunk_name = generate_random_uuid()
-        url = f"https://api.telegram.org/bot{cls.TELEGRAM_BOT_TOKEN}/sendDocument"
         files = {"document": (chunk_name, uploaded_file.read())}
-        data = {"chat_id": cls.TELEGRAM_ADMIN_CHAT_ID}
 
-        @auto_retry
-        def get_send_document_response():
-            response = requests.get(url, files=files, data=data)
-            response.raise_for_status()
+        with cls.pool.acquire() as account:
+            url = f"{settings.TELEGRAM_API_URL}/bot{account['token']}/sendDocument"
+            data = {"chat_id": account["target"]}
 
-            return response.json()
+            @TELEGRAM_UPLOAD_RETRY_POLICY
+            def get_send_document_response():
+                response = scheduler.request(
+                    "telegram",
+                    account["key"],
+                    "GET",
+                    url,
+                    files=files,
+                    data=data,
+                    timeout=settings.CONNECTOR_UPLOAD_TIMEOUT,
+                )
+                response.raise_for_status()
+
+                return response.json()
 
-        result = get_send_document_response()
+            result = get_send_document_response()
 
         if not result["ok"]:
             raise Exception(f"Failed to upload file: {result['description']}")
@@ -57,16 +201,39 @@ class TelegramConnector(AbstractConnector):
 
         return {
             "telegram_file_id": file_id,
+            "telegram_bot_id": account["token"].split(":")[0],
         }
 
     @classmethod
-    def get_file_path(cls, file_id):
-        url = f"https://api.telegram.org/bot{cls.TELEGRAM_BOT_TOKEN}/getFile"
+    def get_file_path(cls, file_id, bot_id: Optional[str] = None):
+        # Telegram keeps download links valid for at least an hour, so repeated
+        # reads of the same chunk don't need another getFile round trip.
+        cache_key = f"telegram_file_path:{file_id}"
+        file_path = cache.get(cache_key)
+        CACHE_REQUESTS.inc("telegram_file_path", "miss" if file_path is None else "hit")
+
+        if file_path is None:
+            file_path = cls.request_file_path(file_id, bot_id)
+            cache.set(cache_key, file_path, settings.TELEGRAM_FILE_PATH_CACHE_TIMEOUT)
+
+        return file_path
+
+    @classmethod
+    def request_file_path(cls, file_id, bot_id: Optional[str] = None):
+        bot_token = cls.get_bot_token(bot_id)
+        url = f"{settings.TELEGRAM_API_URL}/bot{bot_token}/getFile"
         params = {"file_id": file_id}
 
-        @auto_retry
+        @TELEGRAM_FILE_PATH_RETRY_POLICY
         def get_file_path_response():
-            response = requests.get(url, params=params)
+            response = scheduler.request(
+                "telegram_files",
+                f"telegram:{bot_token.split(':')[0]}",
+                "GET",
+                url,
+                params=params,
+                timeout=settings.CONNECTOR_API_TIMEOUT,
+            )
             response.raise_for_status()
 
             return response.json()
@@ -79,12 +246,13 @@ class TelegramConnector(AbstractConnector):
             raise Exception(f"Failed to get file path: {result['description']}")
 
     @classmethod
-    def get_file_url(cls, file_id: str):
-        return f"https://api.telegram.org/file/bot{cls.TELEGRAM_BOT_TOKEN}/{cls.get_file_path(file_id)}"
+    def get_file_url(cls, file_id: str, bot_id: Optional[str] = None):
+        return f"{settings.TELEGRAM_API_URL}/file/bot{cls.get_bot_token(bot_id)}/{cls.get_file_path(file_id, bot_id)}"
 
 
 class LocalConnector(AbstractConnector):
     name = "Local Connector"
+    remote = False
 
     @classmethod
     def upload(cls, uploaded_file: InMemoryUploadedFile):
@@ -98,25 +266,82 @@ class LocalConnector(AbstractConnector):
         }
 
 
+def delete_chunk_file(data: Optional[str]) -> None:
+    url: str = data and json.loads(data).get("url")
+
+    if url and not url.startswith("http://") and not url.startswith("https://"):
+        try:
+            os.remove(os.path.join(settings.BASE_DIR, url))
+        except FileNotFoundError:
+            pass
+
+
 class DiscordConnector(AbstractConnector):
+    pool = ConnectorPool.from_env(
+        "discord",
+        os.getenv("DISCORD_BOT_TOKEN"),
+        os.getenv("DISCORD_CHANNEL_ID"),
+        get_account_id=lambda token, target: f"{token.split('.')[0]}:{target}",
+    )
+
     name = "Discord Connector"
 
     @classmethod
     def upload(cls, uploaded_file: InMemoryUploadedFile):
         chunk_name = generate_random_uuid()
-        api_url = f"https://discord.com/api/v10/channels/{os.getenv('DISCORD_CHANNEL_ID')}/messages"
-        headers = {"Authorization": f"Bot {os.getenv('DISCORD_BOT_TOKEN')}"}
         files = {"file": (chunk_name, uploaded_file.read())}
 
-        @auto_retry
-        def get_file_url_response():
-            response = requests.post(api_url, headers=headers, files=files)
-            response.raise_for_status()
-
-            return response.json()["attachments"][0]["url"]
-
-        url = get_file_url_response()
+        with cls.pool.acquire() as account:
+            api_url = (
+                f"{settings.DISCORD_API_URL}/channels/{account['target']}/messages"
+            )
+            headers = {"Authorization": f"Bot {account['token']}"}
+
+            @DISCORD_UPLOAD_RETRY_POLICY
+            def get_file_url_response():
+                response = scheduler.request(
+                    "discord",
+                    account["key"],
+                    "POST",
+                    api_url,
+                    headers=headers,
+                    files=files,
+                    timeout=settings.CONNECTOR_UPLOAD_TIMEOUT,
+                )
+                response.raise_for_status()
+
+                return response.json()["attachments"][0]["url"]
+
+            url = get_file_url_response()
 
         return {
             "url": url,
+            "discord_channel_id": account["target"],
         }
+
+
+AVAILABLE_CONNECTORS = {
+    "telegram": {
+        "name": TelegramConnector.name,
+        "cls": TelegramConnector,
+    },
+    "local": {
+        "name": LocalConnector.name,
+        "cls": LocalConnector,
+    },
+    "discord": {
+        "name": DiscordConnector.name,
+        "cls": DiscordConnector,
+    },
+}
+
+
+def upload_chunk(connector: str, uploaded_file: InMemoryUploadedFile):
+    started_at = time.perf_counter()
+    uploaded_chunk = AVAILABLE_CONNECTORS[connector]["cls"].upload(uploaded_file)
+    elapsed = time.perf_counter() - started_at
+    CHUNK_UPLOAD_SECONDS.observe(elapsed, connector)
+    record_span(f"{connector}-upload", elapsed)
+    CHUNK_UPLOAD_BYTES.inc(connector, amount=uploaded_file.size)
+
+    return uploaded_chunk
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import json
+import os
+from typing import Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+NONCE_SIZE = 12
+
+KEY_SIZE = 32
+
+
+def get_master_key() -> bytes:
+    # There's deliberately no fallback: SECRET_KEY ships with a public
+    # default, and a key derived from it would protect nothing.
+    if not settings.FILESHIP_MASTER_KEY:
+        raise Exception("FILESHIP_MASTER_KEY must be set to encrypt chunks")
+
+    master_key = base64.b64decode(settings.FILESHIP_MASTER_KEY)
+    if len(master_key) != KEY_SIZE:
+        raise Exception(f"FILESHIP_MASTER_KEY must be {KEY_SIZE} bytes long")
+
+    return master_key
+
+
+def get_master_key_id(master_key: bytes) -> str:
+    return hashlib.sha256(master_key).hexdigest()[:16]
+
+
+def encrypt_chunk(chunk_id: str, payload: bytes) -> Tuple[str, bytes]:
+    master_key = get_master_key()
+    data_key = AESGCM.generate_key(bit_length=KEY_SIZE * 8)
+    key_nonce = os.urandom(NONCE_SIZE)
+    nonce = os.urandom(NONCE_SIZE)
+
+    # Every chunk gets its own data key, so only the small wrapped key has to
+    # be re-encrypted if the master key is ever rotated. The chunk id is bound
+    # as associated data so ciphertexts can't be swapped between chunks.
+    wrapped_key = AESGCM(master_key).encrypt(key_nonce, data_key, chunk_id.encode())
+    ciphertext = AESGCM(data_key).encrypt(nonce, payload, chunk_id.encode())
+
+    encryption = {
+        "algorithm": "AES-256-GCM",
+        "master_key_id": get_master_key_id(master_key),
+        "key": base64.b64encode(key_nonce + wrapped_key).decode(),
+        "nonce": base64.b64encode(nonce).decode(),
+    }
+
+    return json.dumps(encryption), ciphertext
+
+
+def decrypt_chunk(chunk_id: str, ciphertext: bytes, encryption: str) -> bytes:
+    encryption_dict: dict = json.loads(encryption)
+    master_key = get_master_key()
+
+    if encryption_dict["master_key_id"] != get_master_key_id(master_key):
+        raise Exception(f"Chunk {chunk_id} was encrypted with another master key")
+
+    wrapped_key = base64.b64decode(encryption_dict["key"])
+    data_key = AESGCM(master_key).decrypt(
+        wrapped_key[:NONCE_SIZE],
+        wrapped_key[NONCE_SIZE:],
+        chunk_id.encode(),
+    )
+
+    return AESGCM(data_key).decrypt(
+        base64.b64decode(encryption_dict["nonce"]),
+        ciphertext,
+        chunk_id.encode(),
+    )
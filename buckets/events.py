@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import weakref
+from typing import Dict, List, Optional, Set, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from buckets.models import ChangeEvent
+
+logger = logging.getLogger("buckets.events")
+
+EVENTS_TABLE = "buckets_changeevent"
+
+
+def insert_event(bucket_id: str, node_id: str, type: str, data: str) -> str:
+    return f"""
+        INSERT INTO {EVENTS_TABLE} (bucket_id, node_id, type, data)
+        VALUES ({bucket_id}, {node_id}, '{type}', {data});
+    """
+
+
+def node_uploaded(node_id: str) -> str:
+    return f"""
+        (
+            SELECT COUNT(*) FROM buckets_chunk
+            WHERE node_id = {node_id} AND data IS NOT NULL AND data != ''
+        ) * 100.0 / (
+            SELECT COUNT(*) FROM buckets_chunk WHERE node_id = {node_id}
+        )
+    """
+
+
+NODE_DATA = (
+    "json_object('id', {row}.id, 'name', {row}.name, "
+    "'parentId', {row}.parent_id, 'size', {row}.size)"
+)
+
+EVENT_TRIGGERS = {
+    "buckets_events_node_insert": f"""
+    CREATE TRIGGER buckets_events_node_insert AFTER INSERT ON buckets_node BEGIN
+        {insert_event("new.bucket_id", "new.id", "created", NODE_DATA.format(row="new"))}
+    END
+    """,
+    "buckets_events_node_delete": f"""
+    CREATE TRIGGER buckets_events_node_delete AFTER DELETE ON buckets_node BEGIN
+        {insert_event("old.bucket_id", "old.id", "deleted", "json_object('id', old.id)")}
+    END
+    """,
+    "buckets_events_node_rename": f"""
+    CREATE TRIGGER buckets_events_node_rename AFTER UPDATE OF name ON buckets_node
+    WHEN old.name IS NOT new.name AND old.bucket_id IS new.bucket_id
+    BEGIN
+        {insert_event(
+            "new.bucket_id",
+            "new.id",
+            "renamed",
+            "json_object('id', new.id, 'name', new.name)",
+        )}
+    END
+    """,
+    "buckets_events_node_move": f"""
+    CREATE TRIGGER buckets_events_node_move AFTER UPDATE OF parent_id ON buckets_node
+    WHEN old.parent_id IS NOT new.parent_id AND old.bucket_id IS new.bucket_id
+    BEGIN
+        {insert_event(
+            "new.bucket_id",
+            "new.id",
+            "moved",
+            "json_object('id', new.id, 'parentId', new.parent_id)",
+        )}
+    END
+    """,
+    # Trashing moves nodes to another bucket, which its listeners see as the
+    # node being created there.
+    "buckets_events_node_trash": f"""
+    CREATE TRIGGER buckets_events_node_trash AFTER UPDATE OF bucket_id ON buckets_node
+    WHEN old.bucket_id IS NOT new.bucket_id
+    BEGIN
+        {insert_event("old.bucket_id", "old.id", "trashed", "json_object('id', old.id)")}
+        {insert_event("new.bucket_id", "new.id", "created", NODE_DATA.format(row="new"))}
+    END
+    """,
+    # Packs hold whole nodes, so a pack finishing uploads every node in it.
+    "buckets_events_chunk_upload": f"""
+    CREATE TRIGGER buckets_events_chunk_upload AFTER UPDATE OF data ON buckets_chunk
+    WHEN (old.data IS NULL OR old.data = '')
+        AND new.data IS NOT NULL AND new.data != ''
+    BEGIN
+        INSERT INTO {EVENTS_TABLE} (bucket_id, node_id, type, data)
+        SELECT bucket_id, id, 'chunk-uploaded', json_object(
+            'id', id,
+            'index', new."index",
+            'connector', new.connector,
+            'uploaded', {node_uploaded("new.node_id")}
+        )
+        FROM buckets_node WHERE id = new.node_id;
+        INSERT INTO {EVENTS_TABLE} (bucket_id, node_id, type, data)
+        SELECT bucket_id, id, 'chunk-uploaded', json_object(
+            'id', id,
+            'index', 0,
+            'connector', new.connector,
+            'uploaded', 100
+        )
+        FROM buckets_node WHERE new.node_id IS NULL AND pack_id = new.id;
+    END
+    """,
+}
+
+
+def install_event_triggers(connection) -> bool:
+    if connection.vendor != "sqlite":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            ["buckets_events_%"],
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+
+        for name, sql in EVENT_TRIGGERS.items():
+            if name not in existing:
+                cursor.execute(sql)
+
+    return True
+
+
+def drop_event_triggers(connection) -> None:
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for name in EVENT_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+Event = Tuple[int, str, str, str]
+
+
+def format_event(event: Event) -> str:
+    id, _, type, data = event
+
+    return f"id: {id}\nevent: {type}\ndata: {data}\n\n"
+
+
+RESET_EVENT = "event: reset\ndata: {}\n\n"
+
+
+def get_user_from_token(key: str) -> Optional[User]:
+    try:
+        user = Token.objects.select_related("user").get(key=key).user
+    except Token.DoesNotExist:
+        authentication = JWTAuthentication()
+        try:
+            user = authentication.get_user(authentication.get_validated_token(key))
+        except (AuthenticationFailed, InvalidToken, TokenError):
+            return None
+
+    return user if user.is_active else None
+
+
+def get_missed_events(bucket_id: str, last_event_id: int) -> Optional[List[Event]]:
+    events = list(
+        ChangeEvent.objects.filter(bucket_id=bucket_id, id__gt=last_event_id)
+        .order_by("id")
+        .values_list("id", "bucket_id", "type", "data")[
+            : settings.EVENTS_MAX_REPLAY + 1
+        ]
+    )
+
+    # A client that fell this far behind is better off reloading the tree.
+    if len(events) > settings.EVENTS_MAX_REPLAY:
+        return None
+
+    return events
+
+
+class EventBroadcaster:
+    # One poller per process reads new events for every bucket anyone is
+    # listening to, so the database sees one cheap query per interval no
+    # matter how many streams are open.
+    def __init__(self) -> None:
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.last_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, bucket_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(bucket_id, set()).add(queue)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.poll())
+
+        return queue
+
+    def unsubscribe(self, bucket_id: str, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(bucket_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(bucket_id, None)
+
+    def fetch(self, bucket_ids: List[str]) -> List[Event]:
+        if self.last_id is None:
+            self.last_id = (
+                ChangeEvent.objects.order_by("-id").values_list("id", flat=True).first()
+                or 0
+            )
+
+        # SQLite has a single writer, so ids become visible in order and an
+        # id is never committed behind one that was already read.
+        events = list(
+            ChangeEvent.objects.filter(id__gt=self.last_id, bucket_id__in=bucket_ids)
+            .order_by("id")
+            .values_list("id", "bucket_id", "type", "data")[:1000]
+        )
+        if events:
+            self.last_id = events[-1][0]
+
+        return events
+
+    def dispatch(self, event: Event) -> None:
+        for queue in self.subscribers.get(event[1], set()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow readers are told to start over rather than holding
+                # events in memory without bound.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def poll(self) -> None:
+        while self.subscribers:
+            try:
+                events = await sync_to_async(self.fetch, thread_sensitive=False)(
+                    list(self.subscribers)
+                )
+            except Exception:
+                logger.exception("Failed to fetch change events")
+                events = []
+
+            for event in events:
+                self.dispatch(event)
+
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+
+        # Whoever subscribes next starts from the newest event, not from
+        # wherever the last listener left off.
+        self.last_id = None
+
+
+broadcasters: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EventBroadcaster]"
+) = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster() -> EventBroadcaster:
+    loop = asyncio.get_running_loop()
+    if loop not in broadcasters:
+        broadcasters[loop] = EventBroadcaster()
+
+    return broadcasters[loop]
+
+
+async def stream_events(bucket_id: str, last_event_id: Optional[int]):
+    broadcaster = get_broadcaster()
+    queue = broadcaster.subscribe(bucket_id)
+
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MILLISECONDS}\n\n"
+
+        # Subscribing first and replaying second means nothing written in
+        # between is lost; the overlap is skipped by id.
+        if last_event_id is not None:
+            events = await sync_to_async(get_missed_events, thread_sensitive=False)(
+                bucket_id, last_event_id
+            )
+            if events is None:
+                yield RESET_EVENT
+                return
+            for event in events:
+                yield format_event(event)
+                last_event_id = event[0]
+
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(), settings.EVENTS_KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if event is None:
+                yield RESET_EVENT
+                return
+
+            if last_event_id is not None and event[0] <= last_event_id:
+                continue
+
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(bucket_id, queue)
@@ -0,0 +1,250 @@
+import tarfile
+import zipfile
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Exists, OuterRef
+from buckets.chunking import get_chunk_size
+from buckets.models import Bucket, Chunk, Node
+from buckets.packing import Packer
+from buckets.storage import store_chunks
+from buckets.utils import generate_random_uuid
+
+NODE_BATCH_SIZE = 1000
+
+CHUNK_BATCH_SIZE = 4
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+def get_member_parts(name: str) -> Optional[Tuple[str, ...]]:
+    parts = tuple(
+        part for part in name.replace("\\", "/").split("/") if part not in ("", ".")
+    )
+
+    if not parts or ".." in parts or any(len(part) > 256 for part in parts):
+        return None
+
+    return parts
+
+
+def iter_members(file: IO[bytes]) -> Iterator[Tuple[str, bool, int, IO[bytes]]]:
+    # Members are read one at a time straight from the upload, so only the
+    # file being extracted is ever held in memory.
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    yield info.filename, True, 0, None
+                    continue
+                with archive.open(info) as member_file:
+                    yield info.filename, False, info.file_size, member_file
+        return
+
+    file.seek(0)
+    with tarfile.open(fileobj=file, mode="r:*") as archive:
+        for member in archive:
+            if member.isdir():
+                yield member.name, True, 0, None
+            elif member.isreg():
+                yield member.name, False, member.size, archive.extractfile(member)
+
+
+class NodeImporter:
+    def __init__(
+        self,
+        bucket: Bucket,
+        parent_id: Optional[str],
+        connector: str,
+    ) -> None:
+        self.bucket = bucket
+        self.parent_id = parent_id
+        self.connector = connector
+        self.packer = Packer(bucket, connector)
+        self.folder_ids: Dict[Tuple[str, ...], Optional[str]] = {(): parent_id}
+        self.children: Dict[Optional[str], Dict[str, Tuple[str, bool]]] = {}
+        self.new_folders: Dict[str, Node] = {}
+        self.pending: List[Node] = []
+        self.files = 0
+        self.skipped: List[str] = []
+        # Archives are checked against what they expand to, member by member,
+        # since their compressed size says nothing about it.
+        self.available_bytes = bucket.get_available_bytes()
+
+    def get_children(self, parent_id: Optional[str]) -> Dict[str, Tuple[str, bool]]:
+        # Only folders that existed before the extraction are looked up; the
+        # ones created by it start out empty.
+        if parent_id not in self.children:
+            self.children[parent_id] = {
+                name: (id, not pack_id and not has_chunks)
+                for name, id, pack_id, has_chunks in Node.objects.filter(
+                    parent_id=parent_id,
+                    bucket=self.bucket,
+                )
+                .annotate(has_chunks=Exists(Chunk.objects.filter(node=OuterRef("pk"))))
+                .values_list("name", "id", "pack_id", "has_chunks")
+            }
+
+        return self.children[parent_id]
+
+    def get_folder(self, parts: Tuple[str, ...]) -> Tuple[bool, Optional[str]]:
+        for index in range(1, len(parts) + 1):
+            if parts[:index] in self.folder_ids:
+                continue
+
+            parent_id = self.folder_ids[parts[: index - 1]]
+            children = self.get_children(parent_id)
+            name = parts[index - 1]
+
+            if name in children:
+                id, is_folder = children[name]
+                if not is_folder:
+                    return False, None
+                self.folder_ids[parts[:index]] = id
+                continue
+
+            node = Node(
+                id=generate_random_uuid(),
+                name=name,
+                parent_id=parent_id,
+                bucket=self.bucket,
+                size=0,
+            )
+            self.add_node(node)
+            self.new_folders[node.id] = node
+            self.children[node.id] = {}
+            children[name] = (node.id, True)
+            self.folder_ids[parts[:index]] = node.id
+
+        return True, self.folder_ids[parts]
+
+    def add_node(self, node: Node) -> None:
+        self.pending.append(node)
+
+        if len(self.pending) >= NODE_BATCH_SIZE:
+            self.flush_nodes()
+
+    def flush_nodes(self) -> None:
+        Node.objects.bulk_create(self.pending, batch_size=NODE_BATCH_SIZE)
+        self.pending = []
+
+    def add_file(
+        self,
+        parts: Tuple[str, ...],
+        size: int,
+        file: IO[bytes],
+    ) -> Optional[str]:
+        found, parent_id = self.get_folder(parts[:-1])
+        children = self.get_children(parent_id) if found else {}
+
+        if not found or parts[-1] in children:
+            self.skipped.append("/".join(parts))
+            return None
+
+        if self.available_bytes is not None:
+            self.available_bytes -= size
+            if self.available_bytes < 0:
+                raise QuotaExceededError()
+
+        node = Node(
+            id=generate_random_uuid(),
+            name=parts[-1],
+            parent_id=parent_id,
+            bucket=self.bucket,
+            size=size,
+        )
+        children[node.name] = (node.id, False)
+        self.files += 1
+
+        for index in range(1, len(parts)):
+            folder = self.new_folders.get(self.folder_ids[parts[:index]])
+            if folder:
+                folder.size += size
+
+        if size <= settings.PACK_MAX_FILE_SIZE:
+            self.packer.add(node, file.read())
+            self.add_node(node)
+            if self.packer.is_full():
+                self.flush_nodes()
+                self.packer.flush()
+            return node.id
+
+        node.chunk_size = get_chunk_size(self.connector, size)
+        self.add_node(node)
+        self.flush_nodes()
+
+        index, chunks, chunk_datas = 0, [], []
+        while True:
+            chunk_data = file.read(node.chunk_size)
+            if chunk_data:
+                chunks.append(
+                    Chunk(
+                        id=generate_random_uuid(),
+                        node=node,
+                        index=index,
+                    )
+                )
+                chunk_datas.append(chunk_data)
+                index += 1
+
+            if len(chunks) >= CHUNK_BATCH_SIZE or (chunks and not chunk_data):
+                Chunk.objects.bulk_create(chunks)
+                store_chunks(chunks, chunk_datas, self.connector, self.bucket)
+                chunks, chunk_datas = [], []
+
+            if not chunk_data:
+                break
+
+        return node.id
+
+    def finish(self) -> None:
+        self.flush_nodes()
+        self.packer.flush()
+        Node.objects.bulk_update(
+            self.new_folders.values(),
+            ["size"],
+            batch_size=NODE_BATCH_SIZE,
+        )
+
+    def add_files(self, files: List[UploadedFile]) -> List[str]:
+        # Small files uploaded in the same request end up in the same packs.
+        node_ids = []
+        for file in files:
+            parts = get_member_parts(file.name)
+            if parts is None:
+                self.skipped.append(file.name)
+                continue
+
+            node_id = self.add_file(parts[-1:], file.size, file)
+            if node_id:
+                node_ids.append(node_id)
+
+        self.finish()
+
+        return node_ids
+
+    def extract(self, file: IO[bytes]) -> dict:
+        for name, is_dir, size, member_file in iter_members(file):
+            parts = get_member_parts(name)
+
+            if parts is None:
+                self.skipped.append(name)
+            elif is_dir:
+                found, _ = self.get_folder(parts)
+                if not found:
+                    self.skipped.append(name)
+            else:
+                self.add_file(parts, size, member_file)
+
+        self.finish()
+
+        return {
+            "folders": len(self.new_folders),
+            "files": self.files,
+            "packs": self.packer.packs,
+            "skipped": self.skipped,
+        }
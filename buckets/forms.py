@@ -1,35 +1,47 @@
-import uuid
-import json
 from django import forms
-from buckets import connectors
-from buckets.models import Bucket, Chunk, Node
+from django.conf import settings
+from buckets.compression import AVAILABLE_CODECS
+from buckets.connectors import AVAILABLE_CONNECTORS, delete_chunk_file
+from buckets.models import Bucket, Chunk, Node, UploadJob
+from buckets.jobs import delete_spool_file
+from buckets.storage import store_chunks
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
 
-AVAILABLE_CONNECTORS = {
-    "telegram": {
-        "name": connectors.TelegramConnector.name,
-        "cls": connectors.TelegramConnector,
-    },
-    "local": {
-        "name": connectors.LocalConnector.name,
-        "cls": connectors.LocalConnector,
-    },
-    "discord": {
-        "name": connectors.DiscordConnector.name,
-        "cls": connectors.DiscordConnector,
-    },
-}
-
-
 class BucketForm(forms.ModelForm):
     class Meta:
         model = Bucket
         fields = [
             "id",
             "name",
+            "compression",
+            "encrypted",
         ]
 
+    def clean_compression(self):
+        compression = self.cleaned_data["compression"] or None
+
+        if compression and compression not in AVAILABLE_CODECS:
+            raise forms.ValidationError("Compression codec not available")
+
+        return compression
+
+    def clean_encrypted(self):
+        encrypted = self.cleaned_data["encrypted"]
+
+        # Buckets already encrypted stay editable, their uploads are refused
+        # until the key is back.
+        if (
+            encrypted
+            and not self.instance.encrypted
+            and not settings.FILESHIP_MASTER_KEY
+        ):
+            raise forms.ValidationError(
+                "Encrypted buckets need FILESHIP_MASTER_KEY to be set"
+            )
+
+        return encrypted
+
 
 class NodeForm(forms.ModelForm):
     class Meta:
@@ -39,6 +51,7 @@ class NodeForm(forms.ModelForm):
             "name",
             "parent",
             "size",
+            "chunk_size",
             "bucket",
         ]
 
@@ -61,7 +74,6 @@ class ChunkForm(forms.ModelForm):
     class Meta:
         model = Chunk
         fields = [
-            "connector",
             "file",
         ]
 
@@ -69,13 +81,22 @@ class ChunkForm(forms.ModelForm):
         instance: Chunk = super().save(commit)
 
         file: InMemoryUploadedFile = self.cleaned_data["file"]
-        connector: connectors.AbstractConnector = AVAILABLE_CONNECTORS.get(
-            self.cleaned_data["connector"], {}
-        ).get("cls")
 
         if file:
-            instance.size = file.size
-            chunk = connector.upload(file)
-            instance.data = json.dumps(chunk)
+            # Whatever the chunk held, or was still waiting to upload, is
+            # replaced, so its files go once the new data is in place.
+            superseded_data = instance.data
+            superseded_jobs = UploadJob.objects.filter(chunk=instance)
+            superseded_paths = list(superseded_jobs.values_list("path", flat=True))
+            superseded_jobs.delete()
+            store_chunks(
+                [instance],
+                [file.read()],
+                self.cleaned_data["connector"],
+                instance.node.bucket,
+            )
+            delete_chunk_file(superseded_data)
+            for path in superseded_paths:
+                delete_spool_file(path)
 
         return instance
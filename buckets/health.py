@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Dict
+from django.conf import settings
+
+
+class CircuitOpenError(Exception):
+    retryable = False
+
+
+class ConnectorHealth:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.error_rate = 0.0
+        self.latency = 0.0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def is_available(self) -> bool:
+        return (
+            self.state == self.CLOSED
+            or self.state == self.OPEN
+            and time.monotonic() - self.opened_at
+            >= settings.CIRCUIT_BREAKER["cooldown"]
+        )
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            # After the cooldown a single request is let through as a probe;
+            # everybody else keeps failing fast until it reports back.
+            if self.state == self.OPEN and self.is_available():
+                self.state = self.HALF_OPEN
+                self.probing = False
+
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+
+            return False
+
+    def cancel(self) -> None:
+        # A probe that never reached the upstream says nothing about it, so
+        # the next request gets to probe instead.
+        with self.lock:
+            self.probing = False
+
+    def record(self, ok: bool, latency: float) -> None:
+        alpha = settings.CIRCUIT_BREAKER["ewma_alpha"]
+
+        with self.lock:
+            self.error_rate = alpha * (0 if ok else 1) + (1 - alpha) * self.error_rate
+            self.latency = alpha * latency + (1 - alpha) * self.latency
+            self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                self.state = self.CLOSED if ok else self.OPEN
+                self.opened_at = time.monotonic()
+            elif not ok and (
+                self.consecutive_failures
+                >= settings.CIRCUIT_BREAKER["failure_threshold"]
+                or self.error_rate >= settings.CIRCUIT_BREAKER["error_rate_threshold"]
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def representation(self):
+        return {
+            "state": self.state,
+            "errorRate": self.error_rate,
+            "latency": self.latency,
+            "consecutiveFailures": self.consecutive_failures,
+        }
+
+
+health_lock = threading.Lock()
+health_registry: Dict[str, ConnectorHealth] = {}
+
+
+def get_health(key: str) -> ConnectorHealth:
+    with health_lock:
+        if key not in health_registry:
+            health_registry[key] = ConnectorHealth(key)
+
+        return health_registry[key]
+
+
+def get_health_stats():
+    with health_lock:
+        return {key: health.representation() for key, health in health_registry.items()}
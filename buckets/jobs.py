@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from buckets.chunking import record_throughput
+from buckets.connectors import AVAILABLE_CONNECTORS, delete_chunk_file, upload_chunk
+from buckets.health import CircuitOpenError
+from buckets.models import Chunk, UploadJob
+from buckets.scheduler import owned_by
+from buckets.utils import generate_random_uuid
+from fileship.logs import logging_context
+from fileship.metrics import start_exporter
+
+logger = logging.getLogger("buckets.jobs")
+
+
+def enqueue_chunk_upload(chunk: Chunk, connector: str, data: bytes) -> UploadJob:
+    os.makedirs(settings.UPLOAD_SPOOL_ROOT, exist_ok=True)
+    spool_name = generate_random_uuid()
+    with open(os.path.join(settings.UPLOAD_SPOOL_ROOT, spool_name), "wb") as f:
+        f.write(data)
+
+    return UploadJob(
+        chunk=chunk,
+        connector=connector,
+        path=os.path.join(os.path.basename(settings.UPLOAD_SPOOL_ROOT), spool_name),
+    )
+
+
+def delete_spool_file(path: str) -> None:
+    try:
+        os.remove(os.path.join(settings.BASE_DIR, path))
+    except FileNotFoundError:
+        pass
+
+
+def get_backoff_delay(attempts: int) -> float:
+    delay = min(
+        settings.UPLOAD_JOB_BACKOFF_CAP,
+        settings.UPLOAD_JOB_BACKOFF_BASE * 2 ** max(attempts - 1, 0),
+    )
+
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def requeue_stale_jobs() -> int:
+    return UploadJob.objects.filter(
+        status=UploadJob.STATUS_RUNNING,
+        locked_at__lt=timezone.now()
+        - timedelta(seconds=settings.UPLOAD_JOB_LOCK_TIMEOUT),
+    ).update(
+        status=UploadJob.STATUS_PENDING,
+        locked_at=None,
+        available_at=timezone.now(),
+    )
+
+
+def claim_job() -> Optional[UploadJob]:
+    now = timezone.now()
+    pending = UploadJob.objects.filter(
+        status=UploadJob.STATUS_PENDING,
+        available_at__lte=now,
+    ).order_by("available_at", "id")
+    running_buckets = (
+        UploadJob.objects.filter(
+            status=UploadJob.STATUS_RUNNING,
+        )
+        .annotate(bucket_id=Coalesce("chunk__node__bucket_id", "chunk__bucket_id"))
+        .values("bucket_id")
+    )
+
+    # Buckets that already have an upload in flight go to the back of the line
+    # so one huge upload doesn't hold every worker hostage.
+    candidates = list(
+        pending.alias(bucket_id=Coalesce("chunk__node__bucket_id", "chunk__bucket_id"))
+        .exclude(bucket_id__in=running_buckets)
+        .values_list("id", "connector")[:16]
+    ) or list(pending.values_list("id", "connector")[:16])
+
+    for job_id, connector in candidates:
+        running = (
+            UploadJob.objects.filter(
+                connector=OuterRef("connector"),
+                status=UploadJob.STATUS_RUNNING,
+            )
+            .values("connector")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        limit = settings.UPLOAD_CONNECTOR_CONCURRENCY.get(connector, 1) * len(
+            AVAILABLE_CONNECTORS[connector]["cls"].pool or [None]
+        )
+
+        # Claiming and checking the connector concurrency happen in the same
+        # statement so that workers racing for the last slot can't overshoot.
+        claimed = (
+            UploadJob.objects.filter(
+                id=job_id,
+                status=UploadJob.STATUS_PENDING,
+            )
+            .alias(running=Coalesce(Subquery(running), Value(0)))
+            .filter(running__lt=limit)
+            .update(
+                status=UploadJob.STATUS_RUNNING,
+                locked_at=now,
+                attempts=F("attempts") + 1,
+            )
+        )
+
+        if claimed:
+            return UploadJob.objects.select_related("chunk__node").get(id=job_id)
+
+    return None
+
+
+def process_job(job: UploadJob) -> None:
+    fallback = settings.CONNECTOR_FALLBACKS.get(job.connector)
+    spool_path = os.path.join(settings.BASE_DIR, job.path)
+    connector = job.connector
+    preferred_connector = None
+
+    try:
+        with open(spool_path, "rb") as f:
+            data = f.read()
+
+        bucket_id = job.chunk.node.bucket_id if job.chunk.node else job.chunk.bucket_id
+        with owned_by(bucket_id):
+            try:
+                started_at = time.monotonic()
+                uploaded_chunk = upload_chunk(
+                    job.connector,
+                    ContentFile(data, name=os.path.basename(spool_path)),
+                )
+                record_throughput(
+                    job.connector,
+                    len(data),
+                    time.monotonic() - started_at,
+                )
+            except CircuitOpenError:
+                if not fallback:
+                    raise
+
+                # The chunk remembers where it belongs so rebalancechunks can
+                # move it back once the upstream recovers.
+                uploaded_chunk = upload_chunk(
+                    fallback,
+                    ContentFile(data, name=os.path.basename(spool_path)),
+                )
+                connector = fallback
+                preferred_connector = job.connector
+    except Exception as e:
+        attempts = job.attempts - (1 if isinstance(e, CircuitOpenError) else 0)
+        failed = attempts >= settings.UPLOAD_JOB_MAX_ATTEMPTS
+        logger.warning(
+            "Upload to %s failed after %s attempts",
+            job.connector,
+            attempts,
+            exc_info=e,
+            extra={"fields": {"failed": failed}},
+        )
+        UploadJob.objects.filter(id=job.id).update(
+            status=UploadJob.STATUS_FAILED if failed else UploadJob.STATUS_PENDING,
+            attempts=attempts,
+            locked_at=None,
+            available_at=timezone.now()
+            + timedelta(seconds=get_backoff_delay(attempts)),
+            last_error="".join(traceback.format_exception_only(e)).strip(),
+            updated_at=timezone.now(),
+        )
+        return
+
+    # A job that's gone was superseded by a newer upload of its chunk, which
+    # this one must not overwrite.
+    with transaction.atomic():
+        superseded = not UploadJob.objects.filter(id=job.id).delete()[0]
+        if not superseded:
+            Chunk.objects.filter(id=job.chunk_id).update(
+                data=json.dumps(uploaded_chunk),
+                connector=connector,
+                preferred_connector=preferred_connector,
+                updated_at=timezone.now(),
+            )
+
+    if superseded:
+        delete_chunk_file(json.dumps(uploaded_chunk))
+
+    delete_spool_file(job.path)
+
+
+def run_worker(stop_event: threading.Event, poll_interval: float) -> None:
+    start_exporter()
+
+    while not stop_event.is_set():
+        # Errors like SQLite's "database is locked" are usually gone by the
+        # next poll, and a worker that died on one would shrink the pool.
+        try:
+            job = claim_job()
+
+            if job is None:
+                requeue_stale_jobs()
+                stop_event.wait(poll_interval)
+                continue
+
+            with logging_context(
+                node=job.chunk.node_id, chunk=job.chunk_id, job=job.id
+            ):
+                process_job(job)
+        except Exception:
+            logger.exception("Upload worker failed")
+            connections.close_all()
+            stop_event.wait(poll_interval)
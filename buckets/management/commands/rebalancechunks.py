@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from buckets.connectors import AVAILABLE_CONNECTORS
+from buckets.health import CircuitOpenError
+from buckets.models import Chunk
+from buckets.storage import move_chunk
+
+
+class Command(BaseCommand):
+    help = "Moves chunks that failed over to a fallback connector back to their preferred connector"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between passes, runs a single pass when 0",
+        )
+
+    def rebalance(self, batch_size: int) -> int:
+        moved = 0
+        chunks = Chunk.objects.filter(preferred_connector__isnull=False).order_by(
+            "updated_at"
+        )[:batch_size]
+
+        for chunk in chunks.iterator():
+            connector_cls = AVAILABLE_CONNECTORS[chunk.preferred_connector]["cls"]
+            if not connector_cls.is_available():
+                continue
+
+            try:
+                moved += move_chunk(chunk, chunk.preferred_connector)
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                self.stderr.write(f"Failed to move chunk {chunk.id}: {e}")
+
+        return moved
+
+    def handle(self, *args, batch_size: int, interval: float, **options):
+        while True:
+            moved = self.rebalance(batch_size)
+            self.stdout.write(f"Moved {moved} chunks back to their preferred connector")
+
+            if not interval:
+                break
+
+            time.sleep(interval)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from buckets.models import Bucket
+from buckets.usage import install_usage_triggers, recompute_usage
+
+
+class Command(BaseCommand):
+    help = "Recomputes bucket and user usage counters from the nodes and chunks they count"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            install_usage_triggers(connection)
+            recompute_usage(connection)
+
+        self.stdout.write(f"Recomputed usage of {Bucket.objects.count()} buckets")
@@ -0,0 +1,229 @@
+import json
+import os
+import re
+from datetime import timedelta
+from itertools import islice
+from typing import Iterable, Iterator, List
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from buckets.models import ChangeEvent, Chunk, Node, UploadJob
+
+MEDIA_DIRECTORY = "media"
+
+# media/ also holds files that ship with the repo, so only names connectors
+# generate (see generate_random_uuid) are ever considered.
+CHUNK_FILE_NAME = re.compile(r"[0-9a-f]{64}")
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def paginate(queryset, fields: List[str], size: int) -> Iterator[List]:
+    # Keyset pages rather than one long-lived cursor, since SQLite doesn't
+    # isolate a cursor from writes the same connection makes while it's open.
+    last_id = None
+    while True:
+        page = queryset.order_by("pk")
+        if last_id is not None:
+            page = page.filter(pk__gt=last_id)
+
+        rows = list(page.values_list("pk", *fields)[:size])
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1][0]
+
+
+def get_local_url(data: str) -> str:
+    url = json.loads(data).get("url") or ""
+    if url.startswith("http://") or url.startswith("https://"):
+        return ""
+
+    return url
+
+
+class Command(BaseCommand):
+    help = "Removes media files no chunk points at, uploads that never finished and chunks whose file is gone"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Reports what would be removed without removing it",
+        )
+
+    def scan_media(self, expires_at: float) -> Iterator[str]:
+        directory = os.path.join(settings.BASE_DIR, MEDIA_DIRECTORY)
+        if not os.path.isdir(directory):
+            return
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Connectors write the file before the chunk row is saved, so
+                # recent files may still be on their way into the database.
+                if (
+                    CHUNK_FILE_NAME.fullmatch(entry.name)
+                    and entry.is_file()
+                    and entry.stat().st_mtime < expires_at
+                ):
+                    yield entry.name
+
+    def remove_orphaned_files(self, batch_size: int, dry_run: bool) -> int:
+        expires_at = (
+            timezone.now() - timedelta(hours=settings.RECONCILE_UPLOAD_TTL_HOURS)
+        ).timestamp()
+        removed = 0
+
+        for names in batched(self.scan_media(expires_at), batch_size):
+            urls = {
+                json.dumps({"url": os.path.join(MEDIA_DIRECTORY, name)}): name
+                for name in names
+            }
+            referenced = set(
+                Chunk.objects.filter(data__in=list(urls)).values_list("data", flat=True)
+            )
+
+            for data, name in urls.items():
+                if data in referenced:
+                    continue
+
+                self.stdout.write(f"Orphaned file {MEDIA_DIRECTORY}/{name}")
+                removed += 1
+                if not dry_run:
+                    try:
+                        os.remove(
+                            os.path.join(settings.BASE_DIR, MEDIA_DIRECTORY, name)
+                        )
+                    except FileNotFoundError:
+                        pass
+
+        return removed
+
+    def get_stale_nodes(self):
+        expired_at = timezone.now() - timedelta(
+            hours=settings.RECONCILE_UPLOAD_TTL_HOURS
+        )
+
+        # An upload is stale once nothing about it moved for a whole TTL and
+        # no worker still holds a job that could finish it.
+        return (
+            Node.objects.filter(created_at__lt=expired_at)
+            .filter(
+                Q(Exists(Chunk.objects.filter(node=OuterRef("pk"), data__isnull=True)))
+                | Q(pack__data__isnull=True, pack__updated_at__lt=expired_at)
+            )
+            .exclude(
+                Exists(
+                    Chunk.objects.filter(
+                        node=OuterRef("pk"), updated_at__gte=expired_at
+                    )
+                )
+            )
+            .exclude(
+                Exists(
+                    UploadJob.objects.filter(
+                        chunk__node=OuterRef("pk"),
+                    ).exclude(status=UploadJob.STATUS_FAILED)
+                )
+            )
+        )
+
+    def remove_stale_uploads(self, batch_size: int, dry_run: bool) -> int:
+        removed = 0
+
+        for nodes in paginate(
+            self.get_stale_nodes(), ["bucket_id", "name"], batch_size
+        ):
+            for id, bucket_id, name in nodes:
+                self.stdout.write(f"Stale upload {bucket_id}/{id} ({name})")
+            removed += len(nodes)
+
+            if not dry_run:
+                with transaction.atomic():
+                    Node.objects.filter(id__in=[id for id, _, _ in nodes]).delete()
+
+        return removed
+
+    def reset_dangling_chunks(self, batch_size: int, dry_run: bool) -> int:
+        reset = 0
+
+        for batch in paginate(
+            Chunk.objects.filter(connector="local", data__isnull=False),
+            ["data"],
+            batch_size,
+        ):
+            dangling = {
+                id: data
+                for id, data in batch
+                if get_local_url(data)
+                and not os.path.exists(
+                    os.path.join(settings.BASE_DIR, get_local_url(data))
+                )
+            }
+            for id in dangling:
+                self.stdout.write(f"Dangling chunk {id}")
+            reset += len(dangling)
+
+            # Chunks go back to waiting for an upload, which a client can
+            # retry; left alone past the TTL they're collected as stale.
+            if dangling and not dry_run:
+                Chunk.objects.filter(
+                    id__in=list(dangling), data__in=list(dangling.values())
+                ).update(
+                    data=None,
+                    connector=None,
+                    stored_size=None,
+                    codec=None,
+                    encryption=None,
+                    updated_at=timezone.now(),
+                )
+
+        return reset
+
+    def prune_events(self, batch_size: int, dry_run: bool) -> int:
+        expired_at = timezone.now() - timedelta(days=settings.EVENTS_RETENTION_DAYS)
+        last_id = (
+            ChangeEvent.objects.filter(created_at__lt=expired_at)
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if last_id is None:
+            return 0
+
+        if dry_run:
+            return ChangeEvent.objects.filter(id__lte=last_id).count()
+
+        pruned = 0
+        first_id = ChangeEvent.objects.order_by("id").values_list("id", flat=True)[0]
+        for start in range(first_id, last_id + 1, batch_size):
+            deleted, _ = ChangeEvent.objects.filter(
+                id__gte=start, id__lte=min(start + batch_size - 1, last_id)
+            ).delete()
+            pruned += deleted
+
+        return pruned
+
+    def handle(self, *args, batch_size: int, dry_run: bool, **options):
+        reset = self.reset_dangling_chunks(batch_size, dry_run)
+        stale = self.remove_stale_uploads(batch_size, dry_run)
+        orphaned = self.remove_orphaned_files(batch_size, dry_run)
+        pruned = self.prune_events(batch_size, dry_run)
+
+        action = "Would remove" if dry_run else "Removed"
+        self.stdout.write(
+            f"{action} {orphaned} orphaned files, {stale} stale uploads, "
+            f"{reset} dangling chunks and {pruned} change events"
+        )
@@ -0,0 +1,79 @@
+import multiprocessing
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from buckets.jobs import run_worker
+
+
+def run_worker_process(poll_interval: float) -> None:
+    # Each worker stops on its own signal rather than a shared event, which
+    # a worker killed while waiting on it would leave unusable for the rest.
+    stop_event = threading.Event()
+
+    def stop(*_):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    run_worker(stop_event, poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Runs a pool of worker processes that push spooled chunks to connectors"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.UPLOAD_WORKERS,
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+        )
+
+    def handle(self, *args, workers: int, poll_interval: float, **options):
+        context = multiprocessing.get_context("fork")
+        stop_event = threading.Event()
+
+        def stop(*_):
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        def start_worker():
+            process = context.Process(
+                target=run_worker_process,
+                args=(poll_interval,),
+                daemon=True,
+            )
+            process.start()
+
+            return process
+
+        connections.close_all()
+        processes = [start_worker() for _ in range(workers)]
+
+        self.stdout.write(f"Started {workers} upload workers")
+
+        # Workers that die anyway, say killed for running out of memory, are
+        # replaced so the pool keeps its size.
+        while not stop_event.wait(poll_interval):
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write(
+                        f"Upload worker {process.pid} exited with "
+                        f"{process.exitcode}, restarting it"
+                    )
+                    processes[index] = start_worker()
+
+        for process in processes:
+            process.terminate()
+
+        for process in processes:
+            process.join()
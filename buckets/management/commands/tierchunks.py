@@ -0,0 +1,115 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+from buckets.health import CircuitOpenError
+from buckets.models import Chunk
+from buckets.storage import move_chunk
+
+
+class Command(BaseCommand):
+    help = "Promotes frequently read chunks to local disk and demotes cold ones to a remote connector"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+        )
+        parser.add_argument(
+            "--max-bytes-per-second",
+            type=int,
+            default=10 * 1024 * 1024,
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between passes, runs a single pass when 0",
+        )
+
+    def get_hot_chunks(self, batch_size: int):
+        return (
+            Chunk.objects.filter(
+                data__isnull=False,
+                preferred_connector__isnull=True,
+                access_count__gte=settings.TIERING_HOT_ACCESS_COUNT,
+            )
+            .exclude(connector="local")
+            .order_by("-access_count")[:batch_size]
+        )
+
+    def get_cold_chunks(self, batch_size: int):
+        cold_before = timezone.now() - timedelta(days=settings.TIERING_COLD_AFTER_DAYS)
+
+        return (
+            Chunk.objects.filter(
+                connector="local",
+                preferred_connector__isnull=True,
+                access_count__lt=settings.TIERING_HOT_ACCESS_COUNT,
+            )
+            .filter(
+                Q(accessed_at__lt=cold_before)
+                | Q(accessed_at__isnull=True, created_at__lt=cold_before)
+            )
+            .order_by(F("accessed_at").asc(nulls_first=True))[:batch_size]
+        )
+
+    def move(self, chunks, connector: str, max_bytes_per_second: int) -> int:
+        moved = 0
+
+        for chunk in chunks.iterator():
+            started_at = time.monotonic()
+
+            try:
+                moved += move_chunk(chunk, connector)
+            except CircuitOpenError:
+                break
+            except Exception as e:
+                self.stderr.write(f"Failed to move chunk {chunk.id}: {e}")
+
+            elapsed = time.monotonic() - started_at
+            time.sleep(max((chunk.size or 0) / max_bytes_per_second - elapsed, 0))
+
+        return moved
+
+    def handle(
+        self,
+        *args,
+        batch_size: int,
+        max_bytes_per_second: int,
+        interval: float,
+        **options,
+    ):
+        while True:
+            promoted = self.move(
+                self.get_hot_chunks(batch_size),
+                "local",
+                max_bytes_per_second,
+            )
+            demoted = (
+                self.move(
+                    self.get_cold_chunks(batch_size),
+                    settings.TIERING_COLD_CONNECTOR,
+                    max_bytes_per_second,
+                )
+                if settings.TIERING_COLD_CONNECTOR
+                else 0
+            )
+
+            # Halving the counters every pass turns them into a decaying
+            # measure of recent reads instead of an all-time total.
+            Chunk.objects.filter(access_count__gt=0).update(
+                access_count=F("access_count") / 2
+            )
+
+            self.stdout.write(
+                f"Promoted {promoted} chunks and demoted {demoted} chunks"
+            )
+
+            if not interval:
+                break
+
+            time.sleep(interval)
@@ -0,0 +1,92 @@
+from django.db.models import Count
+from buckets.health import ConnectorHealth, get_health_stats
+from buckets.models import UploadJob
+from buckets.scheduler import scheduler
+from fileship.metrics import Counter, Gauge, register, register_collector
+
+UPLOAD_JOBS = register(
+    Gauge(
+        "fileship_upload_jobs",
+        "Upload jobs waiting in the queue by connector and status.",
+        ("connector", "status"),
+    )
+)
+
+UPSTREAM_QUEUE_DEPTH = register(
+    Gauge(
+        "fileship_upstream_queue_depth",
+        "Requests waiting for a rate limit token.",
+        ("key",),
+        aggregate="sum",
+    )
+)
+
+UPSTREAM_THROTTLED = register(
+    Counter(
+        "fileship_upstream_throttled_total",
+        "Responses rejected with 429 by an upstream.",
+        ("key",),
+    )
+)
+
+UPSTREAM_WAIT_SECONDS = register(
+    Counter(
+        "fileship_upstream_wait_seconds_total",
+        "Time spent waiting for rate limit tokens.",
+        ("key",),
+    )
+)
+
+CONNECTOR_CIRCUIT_OPEN = register(
+    Gauge(
+        "fileship_connector_circuit_open",
+        "Whether the circuit breaker of an account is not closed in any process.",
+        ("key",),
+    )
+)
+
+CONNECTOR_ERROR_RATE = register(
+    Gauge(
+        "fileship_connector_error_rate",
+        "Highest moving average of failed requests to an account across processes.",
+        ("key",),
+    )
+)
+
+
+@register_collector
+def collect_upload_jobs():
+    UPLOAD_JOBS.set_all(
+        {
+            (connector, status): total
+            for connector, status, total in UploadJob.objects.values_list(
+                "connector", "status"
+            )
+            .annotate(total=Count("id"))
+            .order_by()
+        }
+    )
+
+
+@register_collector
+def collect_scheduler():
+    stats = scheduler.stats()
+    UPSTREAM_QUEUE_DEPTH.set_all({(key,): s["queueDepth"] for key, s in stats.items()})
+    UPSTREAM_THROTTLED.set_all({(key,): s["throttled"] for key, s in stats.items()})
+    UPSTREAM_WAIT_SECONDS.set_all(
+        {(key,): s["waitTimeTotal"] for key, s in stats.items()}
+    )
+
+
+@register_collector
+def collect_health():
+    stats = get_health_stats()
+    CONNECTOR_CIRCUIT_OPEN.set_all(
+        {
+            (key,): int(health["state"] != ConnectorHealth.CLOSED)
+            for key, health in stats.items()
+        }
+    )
+    CONNECTOR_ERROR_RATE.set_all(
+        {(key,): health["errorRate"] for key, health in stats.items()}
+    )
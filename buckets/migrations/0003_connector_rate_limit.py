@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0002_upload_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConnectorRateLimit",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=256, primary_key=True, serialize=False),
+                ),
+                ("tokens", models.FloatField()),
+                ("updated_at", models.FloatField()),
+                ("blocked_until", models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0003_connector_rate_limit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chunk",
+            name="preferred_connector",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:08
+
+from django.db import migrations, models
+
+
+def backfill_connector(apps, schema_editor):
+    Chunk = apps.get_model("buckets", "Chunk")
+
+    Chunk.objects.filter(data__contains="telegram").update(connector="telegram")
+    Chunk.objects.filter(connector__isnull=True, data__contains="https://").update(
+        connector="discord"
+    )
+    Chunk.objects.filter(connector__isnull=True, data__isnull=False).update(
+        connector="local"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0004_chunk_preferred_connector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chunk",
+            name="access_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chunk",
+            name="accessed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chunk",
+            name="connector",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="chunk",
+            index=models.Index(
+                fields=["connector", "accessed_at"], name="chunk_connector_accessed"
+            ),
+        ),
+        migrations.RunPython(backfill_connector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0005_chunk_connector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConnectorThroughput",
+            fields=[
+                (
+                    "connector",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                ("bytes_per_second", models.FloatField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="chunk_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0006_chunk_sizes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bucket",
+            name="compression",
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name="chunk",
+            name="codec",
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name="chunk",
+            name="stored_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
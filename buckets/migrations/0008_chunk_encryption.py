@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0007_chunk_compression"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bucket",
+            name="encrypted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="chunk",
+            name="encryption",
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0008_chunk_encryption"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chunk",
+            name="bucket",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="packs",
+                to="buckets.bucket",
+            ),
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="pack",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="packed_nodes",
+                to="buckets.chunk",
+            ),
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="pack_length",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="pack_offset",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="chunk",
+            name="node",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="buckets.node",
+            ),
+        ),
+    ]
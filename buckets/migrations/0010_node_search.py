@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:38
+
+from django.db import migrations
+from buckets.search import drop_search_index, install_search_index
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0009_chunk_packs"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
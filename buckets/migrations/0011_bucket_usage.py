@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from buckets.usage import drop_usage_triggers, install_usage_triggers, recompute_usage
+
+
+def backfill_usage(apps, schema_editor):
+    Bucket = apps.get_model("buckets", "Bucket")
+
+    # Buckets used to have no owner, so whoever they were first shared with
+    # is taken to be it.
+    Bucket.objects.filter(owner=None).exclude(id="global-trash-bucket").update(
+        owner_id=Subquery(
+            Bucket.users.through.objects.filter(bucket_id=OuterRef("id"))
+            .order_by("id")
+            .values("user_id")[:1]
+        )
+    )
+
+    if not install_usage_triggers(schema_editor.connection):
+        recompute_usage(schema_editor.connection)
+
+
+def remove_usage_triggers(apps, schema_editor):
+    drop_usage_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0010_node_search"),
+        ("core", "0002_user_quota"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bucket",
+            name="chunk_count",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="bucket",
+            name="node_count",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="bucket",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="owned_buckets",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="bucket",
+            name="size",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="ConnectorUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("connector", models.CharField(max_length=32)),
+                ("size", models.BigIntegerField(default=0)),
+                ("chunk_count", models.BigIntegerField(default=0)),
+                (
+                    "bucket",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="usages",
+                        to="buckets.bucket",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("bucket", "connector"),
+                        name="unique_bucket_connector_usage",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_usage, remove_usage_triggers),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:49
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+from buckets.events import drop_event_triggers, install_event_triggers
+
+
+def create_event_triggers(apps, schema_editor):
+    install_event_triggers(schema_editor.connection)
+
+
+def remove_event_triggers(apps, schema_editor):
+    drop_event_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0011_bucket_usage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket_id", models.TextField()),
+                ("node_id", models.TextField(blank=True, null=True)),
+                ("type", models.CharField(max_length=32)),
+                ("data", models.TextField()),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_default=django.db.models.functions.datetime.Now()
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["bucket_id", "id"], name="change_event_bucket_id"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_event_triggers, remove_event_triggers),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+from buckets.usage import install_usage_triggers
+
+
+def reinstall_node_delete_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    # Dropping the trigger makes install_usage_triggers recreate it from the
+    # current SQL and recompute whatever the old one got wrong.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER IF EXISTS buckets_usage_node_delete")
+    install_usage_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0012_change_events"),
+    ]
+
+    operations = [
+        migrations.RunPython(reinstall_node_delete_trigger, migrations.RunPython.noop),
+    ]
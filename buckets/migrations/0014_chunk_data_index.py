@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0013_usage_node_delete"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chunk",
+            index=models.Index(fields=["data"], name="chunk_data"),
+        ),
+    ]
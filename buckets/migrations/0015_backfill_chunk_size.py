@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from buckets.usage import install_usage_triggers, recompute_usage
+
+
+def backfill_chunk_size(apps, schema_editor):
+    Chunk = apps.get_model("buckets", "Chunk")
+    Node = apps.get_model("buckets", "Node")
+
+    # Files uploaded before chunk sizes were recorded only count towards
+    # usage once they have one, so they get the even split new uploads of
+    # a known chunk count get.
+    chunk_count = Subquery(
+        Chunk.objects.filter(node=OuterRef("pk"))
+        .order_by()
+        .values("node")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Node.objects.filter(chunk_size=None, pack=None).filter(
+        Exists(Chunk.objects.filter(node=OuterRef("pk")))
+    ).update(chunk_size=(F("size") + chunk_count - 1) / chunk_count)
+
+    # The usage triggers pick the new sizes up; without them the counters
+    # are recomputed.
+    if not install_usage_triggers(schema_editor.connection):
+        recompute_usage(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("buckets", "0014_chunk_data_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_chunk_size, migrations.RunPython.noop),
+    ]
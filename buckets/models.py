@@ -1,32 +1,196 @@
 import os
 from typing import List, Literal, Optional
-import shutil
-import json
 from django.contrib.auth.models import User
 from django.db import models
 from django.conf import settings
+from django.db.models.functions import Now
 from django.db.models.manager import BaseManager
+from django.utils import timezone
+from core.models import FileshipUser
+
+USAGE_FIELDS = ("size", "node_count", "chunk_count")
 
 
 class Bucket(models.Model):
     id = models.TextField(primary_key=True)
     name = models.CharField(max_length=256)
     users = models.ManyToManyField("auth.User", related_name="buckets")
+    owner = models.ForeignKey(
+        "auth.User",
+        related_name="owned_buckets",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    compression = models.CharField(
+        max_length=16,
+        null=True,
+        blank=True,
+    )
+    encrypted = models.BooleanField(default=False)
+    # Usage counters are maintained by database triggers on every node and
+    # chunk write (see buckets.usage), never by the application.
+    size = models.BigIntegerField(default=0)
+    node_count = models.BigIntegerField(default=0)
+    chunk_count = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return self.name
 
+    def save(self, *args, **kwargs):
+        # A loaded instance holds the counters as they were when it was read,
+        # so writing the whole row back would undo every change since.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in USAGE_FIELDS
+            ]
+
+        super().save(*args, **kwargs)
+
     def representation(self):
         return {
             "id": self.id,
             "name": self.name,
+            "owner": self.owner.username if self.owner else None,
             "users": [user.username for user in self.users.all()],
+            "compression": self.compression,
+            "encrypted": self.encrypted,
+            "size": self.size,
+            "nodeCount": self.node_count,
+            "chunkCount": self.chunk_count,
+            "connectors": {
+                usage.connector: {
+                    "size": usage.size,
+                    "chunkCount": usage.chunk_count,
+                }
+                for usage in self.usages.all()
+            },
             "createdAt": self.created_at.isoformat(),
             "updatedAt": self.updated_at.isoformat(),
         }
 
+    @classmethod
+    def representations(cls, buckets: models.QuerySet) -> List[dict]:
+        # Same output as representation(), built from plain tuples with one
+        # query each for users and connector usage like Node.representations.
+        rows = list(
+            buckets.values_list(
+                "id",
+                "name",
+                "owner__username",
+                "compression",
+                "encrypted",
+                "size",
+                "node_count",
+                "chunk_count",
+                "created_at",
+                "updated_at",
+            )
+        )
+        bucket_ids = [row[0] for row in rows]
+
+        users = {}
+        for bucket_id, username in (
+            cls.users.through.objects.filter(bucket_id__in=bucket_ids)
+            .order_by("id")
+            .values_list("bucket_id", "user__username")
+        ):
+            users.setdefault(bucket_id, []).append(username)
+
+        connectors = {}
+        for bucket_id, connector, size, chunk_count in ConnectorUsage.objects.filter(
+            bucket_id__in=bucket_ids
+        ).values_list("bucket_id", "connector", "size", "chunk_count"):
+            connectors.setdefault(bucket_id, {})[connector] = {
+                "size": size,
+                "chunkCount": chunk_count,
+            }
+
+        return [
+            {
+                "id": id,
+                "name": name,
+                "owner": owner,
+                "users": users.get(id, []),
+                "compression": compression,
+                "encrypted": encrypted,
+                "size": size,
+                "nodeCount": node_count,
+                "chunkCount": chunk_count,
+                "connectors": connectors.get(id, {}),
+                "createdAt": created_at.isoformat(),
+                "updatedAt": updated_at.isoformat(),
+            }
+            for (
+                id,
+                name,
+                owner,
+                compression,
+                encrypted,
+                size,
+                node_count,
+                chunk_count,
+                created_at,
+                updated_at,
+            ) in rows
+        ]
+
+    def get_available_bytes(self) -> Optional[int]:
+        if not self.owner_id:
+            return None
+
+        usage = (
+            FileshipUser.objects.filter(user_id=self.owner_id)
+            .values_list("quota", "used_bytes")
+            .first()
+        )
+        if usage is None:
+            return None
+
+        quota, used_bytes = usage
+        if quota is None:
+            quota = settings.DEFAULT_USER_QUOTA
+
+        return None if quota is None else quota - used_bytes
+
+    def exceeds_quota(self, size: int) -> bool:
+        if size <= 0:
+            return False
+
+        available_bytes = self.get_available_bytes()
+
+        return available_bytes is not None and size > available_bytes
+
+    def lacks_master_key(self) -> bool:
+        return self.encrypted and not settings.FILESHIP_MASTER_KEY
+
+    @classmethod
+    def get_trash(cls, user: User, bucket_id: str) -> "Bucket":
+        user_trash_bucket_id = f"{user.id}-trash-bucket"
+        if bucket_id == user_trash_bucket_id:
+            trash_bucket, _ = cls.objects.get_or_create(
+                id="global-trash-bucket",
+                defaults={
+                    "name": ".Trash",
+                },
+            )
+        else:
+            trash_bucket, new = cls.objects.get_or_create(
+                id=user_trash_bucket_id,
+                defaults={
+                    "name": ".Trash",
+                    "owner": user,
+                },
+            )
+            if new:
+                trash_bucket.users.add(user)
+
+        return trash_bucket
+
     def tree(
         self,
         parent_node_id=None,
@@ -35,15 +199,12 @@ class Bucket(models.Model):
         if order_by is None:
             order_by = ["name"]
 
-        children = [
-            node.representation(order_by=order_by)
-            for node in Node.objects.filter(
+        children = Node.representations(
+            Node.objects.filter(
                 parent=parent_node_id,
                 bucket_id=self.id,
-            )
-            .prefetch_related("chunks")
-            .order_by(*order_by)
-        ]
+            ).order_by(*order_by)
+        )
 
         pathname = (
             Node.objects.get(id=parent_node_id).get_filepath()
@@ -71,11 +232,30 @@ class Node(models.Model):
     )
     name = models.CharField(max_length=256)
     size = models.BigIntegerField()
+    chunk_size = models.BigIntegerField(
+        null=True,
+        blank=True,
+    )
     bucket = models.ForeignKey(
         "buckets.Bucket",
         related_name="nodes",
         on_delete=models.CASCADE,
     )
+    pack = models.ForeignKey(
+        "buckets.Chunk",
+        related_name="packed_nodes",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+    )
+    pack_offset = models.BigIntegerField(
+        null=True,
+        blank=True,
+    )
+    pack_length = models.BigIntegerField(
+        null=True,
+        blank=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -95,7 +275,7 @@ class Node(models.Model):
         self.save()
 
     def get_size(self):
-        if self.chunks.exists():
+        if self.pack_id or self.chunks.exists():
             return self.size
 
         size = self.children.aggregate(total_size=models.Sum("size"))["total_size"] or 0
@@ -112,12 +292,17 @@ class Node(models.Model):
         if order_by is None:
             order_by = ["name"]
 
-        has_chunks = self.chunks.exists()
-        chunks = [chunk.representation() for chunk in self.chunks.all()]
+        if self.pack_id:
+            has_chunks = True
+            chunks = [self.pack.representation()]
+        else:
+            has_chunks = self.chunks.exists()
+            chunks = [chunk.representation() for chunk in self.chunks.all()]
         base_node = {
             "id": self.id,
             "name": self.name,
             "size": self.get_size(),
+            "chunkSize": self.chunk_size,
             "chunks": chunks,
             "uploaded": (
                 len([chunk["connector"] for chunk in chunks if chunk["connector"]])
@@ -145,9 +330,123 @@ class Node(models.Model):
         else:
             del base_node["url"]
             del base_node["chunks"]
+            del base_node["chunkSize"]
 
         return base_node
 
+    @classmethod
+    def representations(cls, nodes: models.QuerySet) -> List[dict]:
+        # Listings can hold tens of thousands of nodes, so rows are built from
+        # plain tuples with one query for all chunks and one for folder sizes
+        # instead of per-instance representation() calls.
+        rows = list(
+            nodes.values_list(
+                "id",
+                "name",
+                "size",
+                "chunk_size",
+                "bucket_id",
+                "pack_id",
+                "created_at",
+                "updated_at",
+            )
+        )
+        chunks, packs = {}, {}
+        for node_id, chunk_id, connector in (
+            Chunk.objects.filter(
+                models.Q(node_id__in=nodes.values("id"))
+                | models.Q(id__in=nodes.exclude(pack=None).values("pack_id"))
+            )
+            .annotate(
+                uploaded_connector=models.Case(
+                    models.When(
+                        ~models.Q(data=None) & ~models.Q(data=""),
+                        then=models.F("connector"),
+                    ),
+                )
+            )
+            .order_by("node_id", "index")
+            .values_list("node_id", "id", "uploaded_connector")
+            .iterator(chunk_size=2000)
+        ):
+            chunk = {
+                "id": chunk_id,
+                "connector": connector,
+            }
+            if node_id is None:
+                packs[chunk_id] = chunk
+            else:
+                chunks.setdefault(node_id, []).append(chunk)
+
+        folder_sizes = dict(
+            Node.objects.filter(parent_id__in=nodes.values("id"))
+            .values("parent_id")
+            .annotate(total_size=models.Sum("size"))
+            .values_list("parent_id", "total_size")
+        )
+
+        representations = []
+        for (
+            id,
+            name,
+            size,
+            chunk_size,
+            bucket_id,
+            pack_id,
+            created_at,
+            updated_at,
+        ) in rows:
+            node_chunks = [packs[pack_id]] if pack_id else chunks.get(id)
+
+            if node_chunks:
+                representations.append(
+                    {
+                        "id": id,
+                        "name": name,
+                        "size": size,
+                        "chunkSize": chunk_size,
+                        "chunks": node_chunks,
+                        "uploaded": (
+                            len([chunk for chunk in node_chunks if chunk["connector"]])
+                            / len(node_chunks)
+                            * 100
+                        ),
+                        "url": os.path.join(
+                            "api",
+                            "buckets",
+                            str(bucket_id),
+                            "nodes",
+                            str(id),
+                            "download",
+                        ),
+                        "createdAt": created_at.isoformat(),
+                        "updatedAt": updated_at.isoformat(),
+                    }
+                )
+                continue
+
+            folder_size = folder_sizes.get(id) or 0
+            if folder_size != size:
+                updated_at = timezone.now()
+                Node.objects.filter(id=id).update(
+                    size=folder_size,
+                    updated_at=updated_at,
+                )
+
+            representations.append(
+                {
+                    "id": id,
+                    "name": name,
+                    "size": folder_size,
+                    "uploaded": 0.0,
+                    "children": [],
+                    "createdAt": created_at.isoformat(),
+                    "updatedAt": updated_at.isoformat(),
+                }
+            )
+
+        return representations
+
     def get_filepath(self, property: Literal["name", "id"] = "name") -> str:
         path_chunks: List[str] = [self.name if property == "name" else self.id]
         parent_node: Node = self.parent
@@ -176,8 +475,19 @@ class Chunk(models.Model):
     node: Node = models.ForeignKey(
         "buckets.Node",
         related_name="chunks",
+        null=True,
+        blank=True,
         on_delete=models.CASCADE,
     )
+    # Packs are chunks shared by several small nodes (see Node.pack), so they
+    # belong to no node and only keep the bucket they were uploaded for.
+    bucket = models.ForeignKey(
+        "buckets.Bucket",
+        related_name="packs",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
     index = models.IntegerField()
     data = models.TextField(
         null=True,
@@ -187,6 +497,34 @@ class Chunk(models.Model):
         null=True,
         blank=True,
     )
+    stored_size = models.BigIntegerField(
+        null=True,
+        blank=True,
+    )
+    codec = models.CharField(
+        max_length=16,
+        null=True,
+        blank=True,
+    )
+    encryption = models.TextField(
+        null=True,
+        blank=True,
+    )
+    connector = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+    )
+    preferred_connector = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+    )
+    access_count = models.IntegerField(default=0)
+    accessed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -194,37 +532,145 @@ class Chunk(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["node", "index"], name="unique_node_chunk")
         ]
+        indexes = [
+            models.Index(
+                fields=["connector", "accessed_at"],
+                name="chunk_connector_accessed",
+            ),
+            models.Index(
+                fields=["data"],
+                name="chunk_data",
+            ),
+        ]
 
     def representation(self):
-        connector = (
-            None
-            if not self.data
-            else (
-                "telegram"
-                if "telegram" in self.data
-                else "discord" if "https://" in self.data else "local"
-            )
-        )
         return {
             "id": self.id,
-            "connector": connector,
+            "connector": self.connector if self.data else None,
         }
 
     def get_name(self) -> str:
+        if self.node_id is None:
+            return f"pack:{self.id}"
+
         return f"{self.node.name}:{self.index}"
 
     def get_filepath(self, property: Literal["name", "id"] = "name") -> str:
+        if self.node_id is None:
+            return f"pack:{self.id}"
+
         return f"{self.node.get_filepath(property)}:{self.index}"
 
-    def delete(self, using=None, keep_parents=False):
-        result = super().delete(using, keep_parents)
+    def __str__(self) -> str:
+        return self.get_filepath()
 
-        data = self.data and json.loads(self.data)
-        url: str = data and data.get("url")
-        if url and not url.startswith("http://") and not url.startswith("https://"):
-            shutil.rmtree(os.path.join(settings.BASE_DIR, url))
 
-        return result
+class UploadJob(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_FAILED = "failed"
+
+    chunk: Chunk = models.OneToOneField(
+        "buckets.Chunk",
+        related_name="upload_job",
+        on_delete=models.CASCADE,
+    )
+    connector = models.CharField(max_length=32)
+    path = models.TextField()
+    status = models.CharField(
+        max_length=16,
+        default=STATUS_PENDING,
+        choices=[
+            (STATUS_PENDING, "Pending"),
+            (STATUS_RUNNING, "Running"),
+            (STATUS_FAILED, "Failed"),
+        ],
+    )
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
+    last_error = models.TextField(
+        null=True,
+        blank=True,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "available_at"],
+                name="upload_job_status_available",
+            ),
+        ]
 
     def __str__(self) -> str:
-        return self.get_filepath()
+        return f"{self.connector}:{self.chunk_id}"
+
+
+class ConnectorUsage(models.Model):
+    bucket = models.ForeignKey(
+        "buckets.Bucket",
+        related_name="usages",
+        on_delete=models.CASCADE,
+    )
+    connector = models.CharField(max_length=32)
+    size = models.BigIntegerField(default=0)
+    chunk_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "connector"],
+                name="unique_bucket_connector_usage",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.bucket_id}:{self.connector}"
+
+
+class ChangeEvent(models.Model):
+    # Rows are written by database triggers (see buckets.events) and outlive
+    # the buckets and nodes they describe, so neither is a foreign key.
+    bucket_id = models.TextField()
+    node_id = models.TextField(
+        null=True,
+        blank=True,
+    )
+    type = models.CharField(max_length=32)
+    data = models.TextField()
+    created_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["bucket_id", "id"],
+                name="change_event_bucket_id",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.bucket_id}:{self.type}:{self.id}"
+
+
+class ConnectorRateLimit(models.Model):
+    key = models.CharField(max_length=256, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField()
+    blocked_until = models.FloatField(default=0)
+
+    def __str__(self) -> str:
+        return self.key
+
+
+class ConnectorThroughput(models.Model):
+    connector = models.CharField(max_length=32, primary_key=True)
+    bytes_per_second = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.connector
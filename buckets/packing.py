@@ -0,0 +1,49 @@
+from typing import List, Optional
+from django.conf import settings
+from buckets.models import Bucket, Chunk, Node
+from buckets.storage import store_chunks
+from buckets.utils import generate_random_uuid
+
+
+class Packer:
+    def __init__(self, bucket: Bucket, connector: str) -> None:
+        self.bucket = bucket
+        self.connector = connector
+        self.pack_size = min(
+            settings.PACK_SIZE,
+            settings.CONNECTOR_CHUNK_SIZES[connector],
+        )
+        self.pack: Optional[Chunk] = None
+        self.datas: List[bytes] = []
+        self.size = 0
+        self.packs = 0
+
+    def add(self, node: Node, data: bytes) -> None:
+        # The pack row exists before any node points at it, so nodes can be
+        # bulk created at any time; its contents are only stored on flush.
+        if self.pack is None:
+            self.pack = Chunk.objects.create(
+                id=generate_random_uuid(),
+                bucket=self.bucket,
+                index=0,
+            )
+
+        node.pack = self.pack
+        node.pack_offset = self.size
+        node.pack_length = len(data)
+        node.chunk_size = None
+        self.datas.append(data)
+        self.size += len(data)
+
+    def is_full(self) -> bool:
+        return self.size >= self.pack_size
+
+    def flush(self) -> None:
+        if self.pack is None:
+            return
+
+        store_chunks([self.pack], [b"".join(self.datas)], self.connector, self.bucket)
+        self.pack = None
+        self.datas = []
+        self.size = 0
+        self.packs += 1
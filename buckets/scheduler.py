@@ -0,0 +1,255 @@
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+import requests
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+from buckets.health import CircuitOpenError, get_health
+from buckets.models import ConnectorRateLimit
+from fileship.profiling import record_span
+
+current_owner: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_owner", default="anonymous"
+)
+
+
+@contextlib.contextmanager
+def owned_by(owner: str):
+    token = current_owner.set(owner)
+    try:
+        yield
+    finally:
+        current_owner.reset(token)
+
+
+class UpstreamQueue:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.tickets: Dict[str, Deque[object]] = {}
+        self.rotation: Deque[str] = deque()
+        self.depth = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def enqueue(self, owner: str, ticket: object) -> None:
+        if owner not in self.tickets:
+            self.tickets[owner] = deque()
+            self.rotation.append(owner)
+        self.tickets[owner].append(ticket)
+        self.depth += 1
+
+    def head(self) -> object:
+        return self.tickets[self.rotation[0]][0]
+
+    def discard(self, owner: str, ticket: object) -> None:
+        owner_tickets = self.tickets[owner]
+        is_turn = self.rotation[0] == owner and owner_tickets[0] is ticket
+        owner_tickets.remove(ticket)
+        self.depth -= 1
+
+        # Owners take turns, so whoever just got a slot moves to the back of
+        # the rotation and a single busy user can't starve everybody else.
+        if is_turn:
+            self.rotation.popleft()
+            if owner_tickets:
+                self.rotation.append(owner)
+
+        if not owner_tickets:
+            if owner in self.rotation:
+                self.rotation.remove(owner)
+            del self.tickets[owner]
+
+
+class ConnectorScheduler:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.queues: Dict[str, UpstreamQueue] = {}
+        self.known_keys = set()
+
+    def get_queue(self, key: str) -> UpstreamQueue:
+        with self.lock:
+            if key not in self.queues:
+                self.queues[key] = UpstreamQueue()
+
+            return self.queues[key]
+
+    def get_limits(self, limit: str) -> Dict[str, float]:
+        return settings.CONNECTOR_RATE_LIMITS[limit]
+
+    def reserve(self, limit: str, key: str) -> float:
+        limits = self.get_limits(limit)
+        rate, burst = limits["rate"], limits["burst"]
+        now = time.time()
+
+        if key not in self.known_keys:
+            ConnectorRateLimit.objects.get_or_create(
+                key=key,
+                defaults={
+                    "tokens": burst,
+                    "updated_at": now,
+                },
+            )
+            self.known_keys.add(key)
+
+        # The bucket lives in the database so every gunicorn and upload worker
+        # process draws from the same budget for a given bot or channel.
+        refilled = Least(
+            Value(float(burst)),
+            F("tokens") + (Value(now) - F("updated_at")) * Value(float(rate)),
+        )
+        reserved = (
+            ConnectorRateLimit.objects.filter(
+                key=key,
+                blocked_until__lte=now,
+            )
+            .alias(refilled=refilled)
+            .filter(refilled__gte=1)
+            .update(
+                tokens=refilled - 1,
+                updated_at=now,
+            )
+        )
+
+        if reserved:
+            return 0
+
+        tokens, updated_at, blocked_until = ConnectorRateLimit.objects.values_list(
+            "tokens", "updated_at", "blocked_until"
+        ).get(key=key)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+
+        return max(blocked_until - now, (1 - tokens) / rate, 0.01)
+
+    def get_waits(self, limit: str, keys: List[str]) -> Dict[str, float]:
+        rate, burst = self.get_limits(limit)["rate"], self.get_limits(limit)["burst"]
+        now = time.time()
+        waits = {}
+
+        for key, tokens, updated_at, blocked_until in ConnectorRateLimit.objects.filter(
+            key__in=keys
+        ).values_list("key", "tokens", "updated_at", "blocked_until"):
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            waits[key] = max(blocked_until - now, (1 - tokens) / rate, 0)
+
+        return waits
+
+    def acquire(self, limit: str, key: str) -> None:
+        queue = self.get_queue(key)
+        owner = current_owner.get()
+        ticket = object()
+        started_at = time.monotonic()
+
+        with queue.condition:
+            queue.enqueue(owner, ticket)
+            try:
+                while True:
+                    if queue.head() is ticket:
+                        wait = self.reserve(limit, key)
+                        if wait <= 0:
+                            break
+                        queue.condition.wait(wait)
+                    else:
+                        queue.condition.wait()
+            finally:
+                queue.discard(owner, ticket)
+                queue.condition.notify_all()
+
+            waited = time.monotonic() - started_at
+            queue.acquired += 1
+            queue.wait_time += waited
+            queue.max_wait_time = max(queue.max_wait_time, waited)
+
+    def block(self, key: str, seconds: float) -> None:
+        until = time.time() + seconds
+        ConnectorRateLimit.objects.filter(key=key).update(
+            tokens=0,
+            blocked_until=Greatest(F("blocked_until"), Value(until)),
+        )
+
+    def get_retry_after(self, response: requests.Response) -> Optional[float]:
+        if response.status_code == 429:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+
+            retry_after = body.get("parameters", {}).get("retry_after") or body.get(
+                "retry_after"
+            )
+            retry_after = retry_after or response.headers.get("Retry-After")
+
+            return float(retry_after or 1)
+
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            return float(response.headers.get("X-RateLimit-Reset-After") or 1)
+
+        return None
+
+    def observe(self, key: str, response: requests.Response) -> None:
+        retry_after = self.get_retry_after(response)
+
+        if retry_after is None:
+            return
+
+        if response.status_code == 429:
+            self.get_queue(key).throttled += 1
+
+        self.block(key, retry_after)
+
+    def request(
+        self,
+        limit: str,
+        key: str,
+        method: str,
+        url: str,
+        **kwargs,
+    ) -> requests.Response:
+        health = get_health(key)
+        if not health.allow():
+            raise CircuitOpenError(f"Circuit for {key} is open")
+
+        try:
+            self.acquire(limit, key)
+        except BaseException:
+            health.cancel()
+            raise
+
+        started_at = time.monotonic()
+        try:
+            response = requests.request(method, url, **kwargs)
+        except BaseException:
+            health.record(False, time.monotonic() - started_at)
+            raise
+
+        elapsed = time.monotonic() - started_at
+        health.record(
+            response.status_code < 500 and response.status_code != 429, elapsed
+        )
+        record_span(limit, elapsed)
+        self.observe(key, response)
+
+        return response
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            queues = dict(self.queues)
+
+        return {
+            key: {
+                "queueDepth": queue.depth,
+                "acquired": queue.acquired,
+                "throttled": queue.throttled,
+                "waitTimeTotal": queue.wait_time,
+                "waitTimeMax": queue.max_wait_time,
+            }
+            for key, queue in queues.items()
+        }
+
+
+scheduler = ConnectorScheduler()
@@ -0,0 +1,280 @@
+import base64
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+from buckets.models import Node
+
+SEARCH_TABLE = "buckets_node_search"
+
+SEARCH_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+    name,
+    content='buckets_node',
+    content_rowid='rowid',
+    tokenize='trigram'
+)
+"""
+
+SEARCH_TRIGGERS = {
+    f"{SEARCH_TABLE}_insert": f"""
+    CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON buckets_node BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (new.rowid, new.name);
+    END
+    """,
+    f"{SEARCH_TABLE}_delete": f"""
+    CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON buckets_node BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name)
+        VALUES ('delete', old.rowid, old.name);
+    END
+    """,
+    f"{SEARCH_TABLE}_update": f"""
+    CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF name ON buckets_node BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name)
+        VALUES ('delete', old.rowid, old.name);
+        INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (new.rowid, new.name);
+    END
+    """,
+}
+
+MIN_TRIGRAM_LENGTH = 3
+
+SEARCH_PAGE_SIZE = 50
+
+SEARCH_MAX_PAGE_SIZE = 200
+
+SEARCH_MAX_WINDOW = 2000
+
+search_index_available: Dict[str, bool] = {}
+
+
+def install_search_index(connection) -> bool:
+    # The trigram tokenizer needs SQLite 3.34 built with FTS5; anywhere else
+    # search falls back to plain LIKE filters.
+    if connection.vendor != "sqlite":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name LIKE %s",
+            [f"{SEARCH_TABLE}%"],
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+
+        if SEARCH_TABLE not in existing:
+            try:
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute(SEARCH_TABLE_SQL)
+            except DatabaseError:
+                return False
+
+        # SQLite rebuilds the whole table for some schema changes, dropping
+        # its triggers and renumbering rows, so missing triggers also mean
+        # the index has to be rebuilt.
+        missing = [sql for name, sql in SEARCH_TRIGGERS.items() if name not in existing]
+        for sql in missing:
+            cursor.execute(sql)
+        if missing:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"
+            )
+
+    search_index_available[connection.alias] = True
+
+    return True
+
+
+def drop_search_index(connection) -> None:
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for name in SEARCH_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    search_index_available[connection.alias] = False
+
+
+def has_search_index(connection) -> bool:
+    if connection.alias not in search_index_available:
+        search_index_available[connection.alias] = (
+            SEARCH_TABLE in connection.introspection.table_names()
+        )
+
+    return search_index_available[connection.alias]
+
+
+def encode_cursor(rowid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rowid]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[int]:
+    try:
+        (rowid,) = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(rowid, int) or isinstance(rowid, bool):
+        return None
+
+    return rowid
+
+
+def get_paths(nodes: Iterable[Tuple[str, Optional[str], str]]) -> Dict[str, str]:
+    # Ancestors are fetched one level at a time for the whole page, so a page
+    # costs as many queries as its deepest result is deep.
+    parents = {id: (parent_id, name) for id, parent_id, name in nodes}
+    ids = {parent_id for parent_id, _ in parents.values() if parent_id}
+    queried = set()
+    while ids:
+        queried |= ids
+        for id, parent_id, name in Node.objects.filter(id__in=ids).values_list(
+            "id", "parent_id", "name"
+        ):
+            parents[id] = (parent_id, name)
+        ids = {
+            parent_id
+            for parent_id, _ in parents.values()
+            if parent_id and parent_id not in parents
+        } - queried
+
+    paths = {}
+    for id, _, _ in nodes:
+        names = []
+        ancestor_id = id
+        while ancestor_id in parents:
+            ancestor_id, name = parents[ancestor_id]
+            names.append(name)
+        paths[id] = "/" + "/".join(reversed(names))
+
+    return paths
+
+
+class NodeSearch:
+    def __init__(self, connection, bucket_ids: List[str]) -> None:
+        self.connection = connection
+        self.nodes = Node.objects.filter(bucket_id__in=bucket_ids)
+        self.terms: List[str] = []
+        self.cursor: Optional[int] = None
+        self.limit = SEARCH_PAGE_SIZE
+
+    def add_term(self, term: str, filter: Q) -> None:
+        # Trigrams only narrow the candidates down, the exact filter still
+        # decides, so prefixes and suffixes are matched precisely.
+        if len(term) >= MIN_TRIGRAM_LENGTH and has_search_index(self.connection):
+            self.terms.append('"' + term.replace('"', '""') + '"')
+        self.nodes = self.nodes.filter(filter)
+
+    def parse(self, params) -> Optional[str]:
+        query = params.get("q", "")
+        mode = params.get("mode", "substring")
+        extension = params.get("ext", "").lstrip(".")
+
+        if mode not in ("substring", "prefix"):
+            return "Mode must be substring or prefix"
+
+        if query and mode == "prefix":
+            self.add_term(query, Q(name__istartswith=query))
+        elif query:
+            self.add_term(query, Q(name__icontains=query))
+
+        if extension:
+            self.add_term(f".{extension}", Q(name__iendswith=f".{extension}"))
+
+        for param, lookup in (("minSize", "size__gte"), ("maxSize", "size__lte")):
+            if params.get(param):
+                try:
+                    self.nodes = self.nodes.filter(**{lookup: int(params[param])})
+                except ValueError:
+                    return f"{param} must be an integer"
+
+        for param, lookup in (
+            ("modifiedAfter", "updated_at__gte"),
+            ("modifiedBefore", "updated_at__lt"),
+        ):
+            if params.get(param):
+                try:
+                    modified_at = parse_datetime(params[param])
+                except ValueError:
+                    modified_at = None
+                if modified_at is None:
+                    return f"{param} must be an ISO 8601 datetime"
+                self.nodes = self.nodes.filter(**{lookup: modified_at})
+
+        if params.get("cursor"):
+            self.cursor = decode_cursor(params["cursor"])
+            if self.cursor is None:
+                return "Invalid cursor"
+
+        try:
+            self.limit = min(
+                int(params.get("limit") or SEARCH_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE
+            )
+        except ValueError:
+            return "limit must be an integer"
+
+        if self.limit < 1:
+            return "limit must be positive"
+
+        return None
+
+    def get_window(self, start: int, size: int) -> List[int]:
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                "AND rowid > %s ORDER BY rowid LIMIT %s",
+                [" AND ".join(self.terms), start, size],
+            )
+
+            return [rowid for (rowid,) in cursor.fetchall()]
+
+    def get_page(self) -> Tuple[List[dict], Optional[str]]:
+        # Results come in rowid order, which both the table and the trigram
+        # index are sorted by. Matches are read from the index a window at a
+        # time, so a broad query doesn't collect every match before a page
+        # fills up; windows grow for the matches the other filters reject.
+        # A window is only filtered by its rowids, since a rowid range would
+        # make SQLite walk the bucket index from the cursor onwards instead.
+        nodes = self.nodes.annotate(rowid=RawSQL("buckets_node.rowid", []))
+        rows: List[tuple] = []
+        start, size = self.cursor or 0, self.limit + 1
+        while len(rows) <= self.limit:
+            window = []
+            if self.terms:
+                window = self.get_window(start, size)
+                page = nodes.filter(rowid__in=window)
+            else:
+                page = nodes.filter(rowid__gt=start)
+
+            rows += page.order_by("rowid").values_list(
+                "id", "parent_id", "name", "bucket_id", "rowid"
+            )[: self.limit + 1 - len(rows)]
+            if len(window) < size:
+                break
+            start, size = window[-1], min(size * 2, SEARCH_MAX_WINDOW)
+
+        cursor = None
+        if len(rows) > self.limit:
+            rows = rows[: self.limit]
+            cursor = encode_cursor(rows[-1][4])
+
+        paths = get_paths([(id, parent_id, name) for id, parent_id, name, _, _ in rows])
+        representations = {
+            representation["id"]: representation
+            for representation in Node.representations(
+                Node.objects.filter(id__in=[row[0] for row in rows])
+            )
+        }
+
+        return [
+            {
+                **representations[id],
+                "bucketId": bucket_id,
+                "parentId": parent_id,
+                "path": paths[id],
+            }
+            for id, parent_id, _, bucket_id, _ in rows
+        ], cursor
@@ -0,0 +1,41 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate
+from django.dispatch import receiver
+from buckets.events import EVENTS_TABLE, install_event_triggers
+from buckets.models import Chunk, Node
+from buckets.search import SEARCH_TABLE, install_search_index
+from buckets.storage import delete_chunk_file
+from buckets.usage import USAGE_TABLE, install_usage_triggers
+
+
+@receiver(post_delete, sender=Node)
+def release_pack(sender, instance: Node, **kwargs):
+    # A pack is shared by every node packed into it, so it's only removed
+    # together with the last node that still points at it.
+    if not instance.pack_id or Node.objects.filter(pack_id=instance.pack_id).exists():
+        return
+
+    Chunk.objects.filter(id=instance.pack_id, node=None).delete()
+
+
+@receiver(post_delete, sender=Chunk)
+def delete_file(sender, instance: Chunk, **kwargs):
+    # Runs for cascades too, unlike Chunk.delete, and waits for the commit so
+    # a rolled back delete doesn't leave its row pointing at a missing file.
+    data = instance.data
+    transaction.on_commit(lambda: delete_chunk_file(data))
+
+
+@receiver(post_migrate)
+def repair_triggers(sender, using, **kwargs):
+    if sender.name != "buckets":
+        return
+
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if SEARCH_TABLE in tables:
+        install_search_index(connection)
+    if USAGE_TABLE in tables:
+        install_usage_triggers(connection)
+    if EVENTS_TABLE in tables:
+        install_event_triggers(connection)
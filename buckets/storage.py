@@ -0,0 +1,331 @@
+import concurrent.futures
+import contextvars
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from buckets import jobs
+from buckets.compression import decode_chunk, encode_chunk, slice_pieces
+from buckets.connectors import (
+    AVAILABLE_CONNECTORS,
+    AbstractConnector,
+    TelegramConnector,
+    delete_chunk_file,
+    upload_chunk,
+)
+from buckets.encryption import decrypt_chunk, encrypt_chunk
+from buckets.models import Bucket, Chunk, Node, UploadJob
+from buckets.scheduler import current_owner
+from fileship.logs import log_context, run_with_logging_context
+from fileship.metrics import CHUNK_DOWNLOAD_BYTES, CHUNK_DOWNLOAD_SECONDS
+from fileship.profiling import record_span
+from fileship.retry import RetryBudget, RetryPolicy
+
+DOWNLOAD_RETRY_POLICY = RetryPolicy(
+    "chunk_download",
+    max_attempts=5,
+    base_delay=0.5,
+    max_delay=8,
+    deadline=2 * 60,
+    budget=RetryBudget(),
+)
+
+
+@DOWNLOAD_RETRY_POLICY
+def get_url_data_content(url: str) -> bytes:
+    if url.startswith("http://") or url.startswith("https://"):
+        response = requests.get(url, timeout=settings.CONNECTOR_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+
+        return response.content
+
+    with open(os.path.join(settings.BASE_DIR, url), "rb") as f:
+        return f.read()
+
+
+def encode_chunk_payload(
+    chunk: Chunk,
+    chunk_data: bytes,
+    bucket: Bucket,
+    connector_cls: AbstractConnector,
+) -> Tuple[Optional[str], Optional[str], bytes]:
+    codec, payload = encode_chunk(chunk_data, bucket.compression)
+    encryption = None
+
+    # Ciphertext doesn't compress, so encryption always runs last.
+    if bucket.encrypted and connector_cls.remote:
+        encryption, payload = encrypt_chunk(chunk.id, payload)
+
+    return codec, encryption, payload
+
+
+stored_files: contextvars.ContextVar[Optional[List[Callable[[], None]]]] = (
+    contextvars.ContextVar("stored_files", default=None)
+)
+
+
+def track_stored_file(remove: Callable[[], None]) -> None:
+    removals = stored_files.get()
+    if removals is not None:
+        removals.append(remove)
+
+
+@contextmanager
+def atomic_storage():
+    # Chunk files are written as soon as chunks are stored, long before the
+    # transaction commits, so the ones it wrote are removed if it rolls back.
+    removals: List[Callable[[], None]] = []
+    token = stored_files.set(removals)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        for remove in removals:
+            remove()
+        raise
+    finally:
+        stored_files.reset(token)
+
+
+def store_chunks(
+    chunks: List[Chunk],
+    chunk_datas: List[bytes],
+    connector: str,
+    bucket: Bucket,
+) -> None:
+    connector_cls: AbstractConnector = AVAILABLE_CONNECTORS[connector]["cls"]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        encoded_chunks = list(
+            executor.map(
+                lambda chunk, chunk_data: encode_chunk_payload(
+                    chunk, chunk_data, bucket, connector_cls
+                ),
+                chunks,
+                chunk_datas,
+            )
+        )
+
+    for chunk, chunk_data, (codec, encryption, payload) in zip(
+        chunks, chunk_datas, encoded_chunks
+    ):
+        chunk.size = len(chunk_data)
+        chunk.stored_size = len(payload)
+        chunk.codec = codec
+        chunk.encryption = encryption
+
+    fields = ["data", "size", "stored_size", "codec", "encryption"]
+
+    if connector_cls.remote:
+        upload_jobs = []
+        for chunk, (_, _, payload) in zip(chunks, encoded_chunks):
+            chunk.data = None
+            upload_jobs.append(jobs.enqueue_chunk_upload(chunk, connector, payload))
+            track_stored_file(partial(jobs.delete_spool_file, upload_jobs[-1].path))
+
+        with transaction.atomic():
+            Chunk.objects.bulk_update(chunks, fields)
+            UploadJob.objects.bulk_create(upload_jobs)
+
+        return
+
+    chunk_files = [
+        ContentFile(payload, name=chunk.id)
+        for chunk, (_, _, payload) in zip(chunks, encoded_chunks)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                run_with_logging_context,
+                {"node": chunk.node_id, "chunk": chunk.id},
+                upload_chunk,
+                connector,
+                chunk_file,
+            )
+            for chunk, chunk_file in zip(chunks, chunk_files)
+        ]
+
+    for future in futures:
+        if future.exception() is None:
+            track_stored_file(partial(delete_chunk_file, json.dumps(future.result())))
+    uploaded_chunks = [future.result() for future in futures]
+
+    for chunk, uploaded_chunk in zip(chunks, uploaded_chunks):
+        chunk.data = json.dumps(uploaded_chunk)
+        chunk.connector = connector
+
+    Chunk.objects.bulk_update(chunks, fields + ["connector"])
+
+
+def get_chunk_data(chunk: Chunk):
+    if chunk.data is None:
+        try:
+            spool_path = UploadJob.objects.get(chunk=chunk).path
+            with open(os.path.join(settings.BASE_DIR, spool_path), "rb") as f:
+                return f.read()
+        except (UploadJob.DoesNotExist, FileNotFoundError):
+            chunk.refresh_from_db(fields=["data"])
+
+    chunk_data_dict: dict = json.loads(chunk.data)
+    url = chunk_data_dict.get("url") or TelegramConnector.get_file_url(
+        chunk_data_dict["telegram_file_id"],
+        chunk_data_dict.get("telegram_bot_id"),
+    )
+    started_at = time.perf_counter()
+    chunk_data = get_url_data_content(url)
+    elapsed = time.perf_counter() - started_at
+    CHUNK_DOWNLOAD_SECONDS.observe(elapsed, chunk.connector)
+    record_span(f"{chunk.connector}-download", elapsed)
+    CHUNK_DOWNLOAD_BYTES.inc(chunk.connector, amount=len(chunk_data))
+
+    return chunk_data
+
+
+def get_chunk_payload(chunk: Chunk) -> bytes:
+    payload = get_chunk_data(chunk)
+
+    if chunk.encryption:
+        payload = decrypt_chunk(chunk.id, payload, chunk.encryption)
+
+    return payload
+
+
+def get_file_data_in_chunks_from_node(
+    node: Node,
+    start: int = 0,
+    end: Optional[int] = None,
+):
+    yield b""
+
+    context = contextvars.copy_context()
+    context.run(current_owner.set, node.bucket_id)
+    context.run(log_context.set, {**log_context.get(), "node": node.id})
+
+    # Chunks can have different sizes, so their offsets are worked out from
+    # the sizes of the chunks before them rather than from a fixed stride.
+    chunk_slices = []
+    chunk_offset = 0
+
+    # Packed nodes are a byte range inside a chunk shared with other nodes.
+    if node.pack_id:
+        chunk_slices.append(
+            (
+                node.pack,
+                node.pack_offset + start,
+                node.pack_offset + (node.pack_length if end is None else end),
+            )
+        )
+
+    for chunk in node.chunks.all().order_by("index"):
+        chunk_end = chunk_offset + (chunk.size or 0)
+        if chunk_end > start and (end is None or chunk_offset < end):
+            chunk_slices.append(
+                (
+                    chunk,
+                    max(start - chunk_offset, 0),
+                    None if end is None else end - chunk_offset,
+                )
+            )
+        chunk_offset = chunk_end
+
+    payloads = prefetch_chunk_payloads(
+        context,
+        [chunk for chunk, _, _ in chunk_slices],
+    )
+    for (chunk, slice_start, slice_end), payload in zip(chunk_slices, payloads):
+        yield from slice_pieces(
+            decode_chunk(payload, chunk.codec),
+            slice_start,
+            slice_end,
+        )
+
+
+def prefetch_chunk_payloads(
+    context: contextvars.Context,
+    chunks: Iterable[Chunk],
+    prefetch: int = 4,
+) -> Iterator[bytes]:
+    # At most `prefetch` payloads are downloaded ahead of the one being
+    # consumed, which bounds memory no matter how many chunks follow.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=prefetch) as executor:
+        futures = deque()
+        try:
+            for chunk in chunks:
+                futures.append(
+                    executor.submit(
+                        context.copy().run,
+                        run_with_logging_context,
+                        {"node": chunk.node_id, "chunk": chunk.id},
+                        get_chunk_payload,
+                        chunk,
+                    )
+                )
+
+                if len(futures) > prefetch:
+                    yield futures.popleft().result()
+
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_chunk_bucket(chunk: Chunk) -> Optional[Bucket]:
+    if chunk.node_id is not None:
+        return chunk.node.bucket
+
+    if chunk.bucket_id is not None:
+        return chunk.bucket
+
+    node = chunk.packed_nodes.select_related("bucket").first()
+
+    return node and node.bucket
+
+
+def move_chunk(chunk: Chunk, connector: str) -> bool:
+    chunk_data = get_chunk_data(chunk)
+    payload, encryption = chunk_data, chunk.encryption
+
+    # Local chunks of encrypted buckets are stored in plaintext, so they're
+    # sealed before they leave for a remote connector.
+    if AVAILABLE_CONNECTORS[connector]["cls"].remote and not encryption:
+        bucket = get_chunk_bucket(chunk)
+        if bucket and bucket.encrypted:
+            encryption, payload = encrypt_chunk(chunk.id, chunk_data)
+
+    uploaded_chunk = upload_chunk(connector, ContentFile(payload, name=chunk.id))
+    copy = Chunk(
+        id=chunk.id,
+        data=json.dumps(uploaded_chunk),
+        connector=connector,
+    )
+
+    if get_chunk_data(copy) != payload:
+        delete_chunk_file(copy.data)
+        raise Exception(f"Copy of chunk {chunk.id} on {connector} does not match")
+
+    moved = Chunk.objects.filter(id=chunk.id, data=chunk.data).update(
+        data=copy.data,
+        connector=connector,
+        encryption=encryption,
+        stored_size=len(payload),
+        preferred_connector=None,
+        updated_at=timezone.now(),
+    )
+
+    if moved:
+        delete_chunk_file(chunk.data)
+    else:
+        delete_chunk_file(copy.data)
+
+    return bool(moved)
@@ -1,3 +1,301 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from cryptography.exceptions import InvalidTag
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from buckets.batch import NodeBatch
+from buckets.encryption import decrypt_chunk, encrypt_chunk
+from buckets.jobs import claim_job, enqueue_chunk_upload, process_job
+from buckets.models import Bucket, Chunk, ConnectorUsage, Node, UploadJob
+from buckets.utils import generate_random_uuid
+from core.models import FileshipUser
 
-# Create your tests here.
+MASTER_KEY = base64.b64encode(b"k" * 32).decode()
+
+
+class StorageTestCase(TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        os.makedirs(os.path.join(base_dir, "media"))
+
+        settings_override = override_settings(
+            BASE_DIR=base_dir,
+            UPLOAD_SPOOL_ROOT=os.path.join(base_dir, "spool"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.base_dir = base_dir
+
+        self.fuser = FileshipUser.get_from_email("owner@example.com")
+        self.user = self.fuser.user
+        self.bucket = Bucket.objects.create(
+            id=generate_random_uuid(),
+            name="bucket",
+            owner=self.user,
+        )
+        self.bucket.users.add(self.user)
+
+    def create_node(self, name: str, parent=None, **fields) -> Node:
+        fields.setdefault("size", 0)
+
+        return Node.objects.create(
+            id=generate_random_uuid(),
+            name=name,
+            parent=parent,
+            bucket=self.bucket,
+            **fields,
+        )
+
+    def write_media(self, data: bytes) -> str:
+        name = generate_random_uuid()
+        with open(os.path.join(self.base_dir, "media", name), "wb") as f:
+            f.write(data)
+
+        return os.path.join("media", name)
+
+
+class UploadJobTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        node = self.create_node("file.bin", size=5, chunk_size=5)
+        self.chunk = Chunk.objects.create(
+            id=generate_random_uuid(),
+            node=node,
+            index=0,
+            size=5,
+        )
+        self.job = enqueue_chunk_upload(self.chunk, "telegram", b"hello")
+        self.job.save()
+        self.spool_path = os.path.join(self.base_dir, self.job.path)
+
+    def test_claim_job_locks_the_job(self):
+        job = claim_job()
+
+        self.assertEqual(job.id, self.job.id)
+        self.assertEqual(job.status, UploadJob.STATUS_RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_job())
+
+    def test_process_job_stores_the_upload(self):
+        with mock.patch(
+            "buckets.jobs.upload_chunk", return_value={"url": "https://cdn/1"}
+        ):
+            process_job(claim_job())
+
+        self.chunk.refresh_from_db()
+        self.assertEqual(json.loads(self.chunk.data), {"url": "https://cdn/1"})
+        self.assertEqual(self.chunk.connector, "telegram")
+        self.assertFalse(UploadJob.objects.exists())
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_superseded_job_leaves_the_chunk_alone(self):
+        job = claim_job()
+        UploadJob.objects.filter(id=job.id).delete()
+        url = self.write_media(b"hello")
+
+        with mock.patch("buckets.jobs.upload_chunk", return_value={"url": url}):
+            process_job(job)
+
+        self.chunk.refresh_from_db()
+        self.assertIsNone(self.chunk.data)
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, url)))
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    @override_settings(UPLOAD_JOB_MAX_ATTEMPTS=2)
+    def test_failed_upload_is_retried_until_attempts_run_out(self):
+        with mock.patch(
+            "buckets.jobs.upload_chunk", side_effect=Exception("boom")
+        ), self.assertLogs("buckets.jobs", "WARNING"):
+            process_job(claim_job())
+
+            job = UploadJob.objects.get(id=self.job.id)
+            self.assertEqual(job.status, UploadJob.STATUS_PENDING)
+            self.assertIn("boom", job.last_error)
+            self.assertGreater(job.available_at, timezone.now() - timedelta(seconds=1))
+            self.assertIsNone(job.locked_at)
+
+            UploadJob.objects.filter(id=job.id).update(available_at=timezone.now())
+            process_job(claim_job())
+
+        job = UploadJob.objects.get(id=self.job.id)
+        self.assertEqual(job.status, UploadJob.STATUS_FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(claim_job())
+        self.assertTrue(os.path.exists(self.spool_path))
+        self.chunk.refresh_from_db()
+        self.assertIsNone(self.chunk.data)
+
+
+class NodeBatchTests(StorageTestCase):
+    def apply(self, operations):
+        batch = NodeBatch(self.bucket, self.user)
+        results = batch.apply(operations)
+        if not any(error for _, error in results):
+            batch.save()
+
+        return results
+
+    def test_swapped_renames(self):
+        a = self.create_node("a")
+        b = self.create_node("b")
+
+        results = self.apply(
+            [
+                {"op": "rename", "node": a.id, "name": "tmp"},
+                {"op": "rename", "node": b.id, "name": "a"},
+                {"op": "rename", "node": a.id, "name": "b"},
+            ]
+        )
+
+        self.assertEqual(results, [(a.id, None), (b.id, None), (a.id, None)])
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.name, b.name), ("b", "a"))
+
+    def test_rename_onto_a_taken_name_fails(self):
+        a = self.create_node("a")
+        self.create_node("b")
+
+        results = self.apply([{"op": "rename", "node": a.id, "name": "b"}])
+
+        self.assertIsNotNone(results[0][1])
+        a.refresh_from_db()
+        self.assertEqual(a.name, "a")
+
+    def test_delete_then_recreate(self):
+        folder = self.create_node("a")
+        child = self.create_node("child", parent=folder)
+
+        results = self.apply(
+            [
+                {"op": "delete", "node": folder.id},
+                {"op": "createFolder", "name": "a"},
+            ]
+        )
+
+        self.assertEqual(results[0], (None, None))
+        new_id, error = results[1]
+        self.assertIsNone(error)
+        self.assertNotEqual(new_id, folder.id)
+
+        trash_id = f"{self.user.id}-trash-bucket"
+        folder.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual(folder.bucket_id, trash_id)
+        self.assertEqual(child.bucket_id, trash_id)
+        self.assertEqual(
+            list(Node.objects.filter(bucket=self.bucket).values_list("id", "name")),
+            [(new_id, "a")],
+        )
+
+    def test_move_into_own_descendant_fails(self):
+        parent = self.create_node("parent")
+        child = self.create_node("child", parent=parent)
+
+        results = self.apply([{"op": "move", "node": parent.id, "parent": child.id}])
+
+        self.assertEqual(results, [(parent.id, "A node cannot be moved into itself")])
+
+
+class UsageTests(StorageTestCase):
+    def assertUsage(self, size, node_count, chunk_count, used_bytes, connectors):
+        bucket = Bucket.objects.get(id=self.bucket.id)
+        self.assertEqual(
+            (bucket.size, bucket.node_count, bucket.chunk_count),
+            (size, node_count, chunk_count),
+        )
+        self.assertEqual(
+            FileshipUser.objects.get(id=self.fuser.id).used_bytes, used_bytes
+        )
+        self.assertEqual(
+            dict(
+                ConnectorUsage.objects.filter(bucket=self.bucket)
+                .exclude(chunk_count=0)
+                .values_list("connector", "size")
+            ),
+            connectors,
+        )
+
+    def test_counters_follow_nodes_and_chunks(self):
+        folder = self.create_node("folder")
+        node = self.create_node("file.bin", parent=folder, size=10, chunk_size=5)
+        chunks = [
+            Chunk.objects.create(id=generate_random_uuid(), node=node, index=index)
+            for index in range(2)
+        ]
+        self.assertUsage(10, 2, 2, 10, {})
+
+        for chunk in chunks:
+            Chunk.objects.filter(id=chunk.id).update(
+                data=json.dumps({"url": "media/x"}),
+                connector="local",
+                size=5,
+                stored_size=4,
+            )
+        self.assertUsage(10, 2, 2, 10, {"local": 8})
+
+        Chunk.objects.filter(id=chunks[0].id).update(connector="telegram")
+        self.assertUsage(10, 2, 2, 10, {"local": 4, "telegram": 4})
+
+        Node.objects.filter(id=folder.id).delete()
+        self.assertUsage(0, 0, 0, 0, {})
+
+    def test_moving_a_node_to_another_bucket_moves_its_usage(self):
+        other = Bucket.objects.create(
+            id=generate_random_uuid(),
+            name="other",
+            owner=self.user,
+        )
+        node = self.create_node("file.bin", size=10, chunk_size=10)
+        Chunk.objects.create(id=generate_random_uuid(), node=node, index=0)
+
+        Node.objects.filter(id=node.id).update(bucket=other)
+
+        self.assertUsage(0, 0, 0, 10, {})
+        other.refresh_from_db()
+        self.assertEqual((other.size, other.node_count, other.chunk_count), (10, 1, 1))
+
+
+class EncryptionTests(SimpleTestCase):
+    @override_settings(FILESHIP_MASTER_KEY=MASTER_KEY)
+    def test_round_trip(self):
+        encryption, ciphertext = encrypt_chunk("chunk", b"payload")
+
+        self.assertNotIn(b"payload", ciphertext)
+        self.assertEqual(decrypt_chunk("chunk", ciphertext, encryption), b"payload")
+
+    @override_settings(FILESHIP_MASTER_KEY=MASTER_KEY)
+    def test_ciphertext_is_bound_to_its_chunk(self):
+        encryption, ciphertext = encrypt_chunk("chunk", b"payload")
+
+        with self.assertRaises(InvalidTag):
+            decrypt_chunk("other", ciphertext, encryption)
+
+    @override_settings(FILESHIP_MASTER_KEY=MASTER_KEY)
+    def test_tampered_ciphertext_is_rejected(self):
+        encryption, ciphertext = encrypt_chunk("chunk", b"payload")
+        tampered = bytes([ciphertext[0] ^ 1]) + ciphertext[1:]
+
+        with self.assertRaises(InvalidTag):
+            decrypt_chunk("chunk", tampered, encryption)
+
+    def test_other_master_key_is_rejected(self):
+        with override_settings(FILESHIP_MASTER_KEY=MASTER_KEY):
+            encryption, ciphertext = encrypt_chunk("chunk", b"payload")
+
+        with override_settings(
+            FILESHIP_MASTER_KEY=base64.b64encode(b"o" * 32).decode()
+        ):
+            with self.assertRaisesMessage(Exception, "another master key"):
+                decrypt_chunk("chunk", ciphertext, encryption)
+
+    @override_settings(FILESHIP_MASTER_KEY=None)
+    def test_missing_master_key_is_an_error(self):
+        with self.assertRaisesMessage(Exception, "FILESHIP_MASTER_KEY must be set"):
+            encrypt_chunk("chunk", b"payload")
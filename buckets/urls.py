@@ -3,6 +3,11 @@ from buckets.views import (
     BucketShareView,
     BucketView,
     ChunksView,
+    NodesArchiveView,
+    NodesBatchView,
+    NodesEventsView,
+    NodesExtractView,
+    NodesSearchView,
     NodesView,
     NodesDownloadView,
 )
@@ -12,6 +17,10 @@ urlpatterns = [
         "",
         BucketView.as_view(),
     ),
+    path(
+        "search/",
+        NodesSearchView.as_view(),
+    ),
     path(
         "<str:bucket_id>/",
         BucketView.as_view(),
@@ -20,6 +29,22 @@ urlpatterns = [
         "<str:bucket_id>/share/",
         BucketShareView.as_view(),
     ),
+    path(
+        "<str:bucket_id>/archive/",
+        NodesArchiveView.as_view(),
+    ),
+    path(
+        "<str:bucket_id>/batch/",
+        NodesBatchView.as_view(),
+    ),
+    path(
+        "<str:bucket_id>/events/",
+        NodesEventsView.as_view(),
+    ),
+    path(
+        "<str:bucket_id>/extract/",
+        NodesExtractView.as_view(),
+    ),
     path(
         "<str:bucket_id>/nodes/",
         NodesView.as_view(),
@@ -0,0 +1,275 @@
+USAGE_TABLE = "buckets_connectorusage"
+
+
+def node_bytes(row: str) -> str:
+    return (
+        f"CASE WHEN {row}.chunk_size IS NOT NULL OR {row}.pack_id IS NOT NULL "
+        f"THEN {row}.size ELSE 0 END"
+    )
+
+
+def chunk_bucket(row: str) -> str:
+    return (
+        f"COALESCE({row}.bucket_id, "
+        f"(SELECT bucket_id FROM buckets_node WHERE id = {row}.node_id))"
+    )
+
+
+def chunk_uploaded(row: str) -> str:
+    return (
+        f"{row}.connector IS NOT NULL "
+        f"AND {row}.data IS NOT NULL AND {row}.data != ''"
+    )
+
+
+def chunk_bytes(row: str) -> str:
+    return f"COALESCE({row}.stored_size, {row}.size, 0)"
+
+
+def add_chunk_usage(row: str) -> str:
+    # Rows only ever get created on the way up; decrements update in place,
+    # so a cascade that already removed a bucket's rows can't bring them back.
+    return f"""
+        INSERT INTO {USAGE_TABLE} (bucket_id, connector, size, chunk_count)
+        SELECT {chunk_bucket(row)}, {row}.connector, {chunk_bytes(row)}, 1
+        WHERE {chunk_uploaded(row)} AND {chunk_bucket(row)} IS NOT NULL
+        ON CONFLICT (bucket_id, connector) DO UPDATE SET
+            size = size + excluded.size,
+            chunk_count = chunk_count + 1;
+    """
+
+
+def remove_chunk_usage(row: str) -> str:
+    return f"""
+        UPDATE {USAGE_TABLE} SET
+            size = size - {chunk_bytes(row)},
+            chunk_count = chunk_count - 1
+        WHERE {chunk_uploaded(row)}
+            AND bucket_id = {chunk_bucket(row)}
+            AND connector = {row}.connector;
+    """
+
+
+def remove_node_chunks(row: str) -> str:
+    # Node chunks only find their bucket through the node, and Django may
+    # delete a node before its chunks since the foreign key is nullable, so
+    # they're taken out of the counts together with the node.
+    return f"""
+        UPDATE buckets_bucket SET
+            chunk_count = chunk_count - (
+                SELECT COUNT(*) FROM buckets_chunk
+                WHERE node_id = {row}.id AND bucket_id IS NULL
+            )
+        WHERE id = {row}.bucket_id;
+        UPDATE {USAGE_TABLE} SET
+            size = size - (
+                SELECT COALESCE(SUM({chunk_bytes("chunk")}), 0)
+                FROM buckets_chunk AS chunk
+                WHERE chunk.node_id = {row}.id
+                    AND chunk.bucket_id IS NULL
+                    AND chunk.connector = {USAGE_TABLE}.connector
+                    AND {chunk_uploaded("chunk")}
+            ),
+            chunk_count = chunk_count - (
+                SELECT COUNT(*)
+                FROM buckets_chunk AS chunk
+                WHERE chunk.node_id = {row}.id
+                    AND chunk.bucket_id IS NULL
+                    AND chunk.connector = {USAGE_TABLE}.connector
+                    AND {chunk_uploaded("chunk")}
+            )
+        WHERE bucket_id = {row}.bucket_id;
+    """
+
+
+USAGE_TRIGGERS = {
+    "buckets_usage_node_insert": f"""
+    CREATE TRIGGER buckets_usage_node_insert AFTER INSERT ON buckets_node BEGIN
+        UPDATE buckets_bucket SET
+            size = size + {node_bytes("new")},
+            node_count = node_count + 1
+        WHERE id = new.bucket_id;
+    END
+    """,
+    "buckets_usage_node_delete": f"""
+    CREATE TRIGGER buckets_usage_node_delete AFTER DELETE ON buckets_node BEGIN
+        UPDATE buckets_bucket SET
+            size = size - {node_bytes("old")},
+            node_count = node_count - 1
+        WHERE id = old.bucket_id;
+        {remove_node_chunks("old")}
+    END
+    """,
+    "buckets_usage_node_update": f"""
+    CREATE TRIGGER buckets_usage_node_update AFTER UPDATE ON buckets_node
+    WHEN old.bucket_id IS NOT new.bucket_id
+        OR old.size IS NOT new.size
+        OR old.chunk_size IS NOT new.chunk_size
+        OR old.pack_id IS NOT new.pack_id
+    BEGIN
+        UPDATE buckets_bucket SET
+            size = size - {node_bytes("old")},
+            node_count = node_count - 1
+        WHERE id = old.bucket_id;
+        UPDATE buckets_bucket SET
+            size = size + {node_bytes("new")},
+            node_count = node_count + 1
+        WHERE id = new.bucket_id;
+    END
+    """,
+    # Chunks follow their node when it's moved to another bucket, like into
+    # the trash, so their counts and bytes are moved along with it.
+    "buckets_usage_node_move": f"""
+    CREATE TRIGGER buckets_usage_node_move AFTER UPDATE OF bucket_id ON buckets_node
+    WHEN old.bucket_id IS NOT new.bucket_id
+    BEGIN
+        {remove_node_chunks("old")}
+        UPDATE buckets_bucket SET
+            chunk_count = chunk_count + (
+                SELECT COUNT(*) FROM buckets_chunk
+                WHERE node_id = new.id AND bucket_id IS NULL
+            )
+        WHERE id = new.bucket_id;
+        INSERT INTO {USAGE_TABLE} (bucket_id, connector, size, chunk_count)
+        SELECT new.bucket_id, chunk.connector, SUM({chunk_bytes("chunk")}), COUNT(*)
+        FROM buckets_chunk AS chunk
+        WHERE chunk.node_id = new.id
+            AND chunk.bucket_id IS NULL
+            AND {chunk_uploaded("chunk")}
+        GROUP BY chunk.connector
+        ON CONFLICT (bucket_id, connector) DO UPDATE SET
+            size = size + excluded.size,
+            chunk_count = chunk_count + excluded.chunk_count;
+    END
+    """,
+    "buckets_usage_chunk_insert": f"""
+    CREATE TRIGGER buckets_usage_chunk_insert AFTER INSERT ON buckets_chunk BEGIN
+        UPDATE buckets_bucket SET chunk_count = chunk_count + 1
+        WHERE id = {chunk_bucket("new")};
+        {add_chunk_usage("new")}
+    END
+    """,
+    "buckets_usage_chunk_delete": f"""
+    CREATE TRIGGER buckets_usage_chunk_delete AFTER DELETE ON buckets_chunk BEGIN
+        UPDATE buckets_bucket SET chunk_count = chunk_count - 1
+        WHERE id = {chunk_bucket("old")};
+        {remove_chunk_usage("old")}
+    END
+    """,
+    "buckets_usage_chunk_update": f"""
+    CREATE TRIGGER buckets_usage_chunk_update AFTER UPDATE ON buckets_chunk
+    WHEN old.node_id IS NOT new.node_id
+        OR old.bucket_id IS NOT new.bucket_id
+        OR old.connector IS NOT new.connector
+        OR old.data IS NOT new.data
+        OR old.size IS NOT new.size
+        OR old.stored_size IS NOT new.stored_size
+    BEGIN
+        UPDATE buckets_bucket SET chunk_count = chunk_count - 1
+        WHERE id = {chunk_bucket("old")};
+        UPDATE buckets_bucket SET chunk_count = chunk_count + 1
+        WHERE id = {chunk_bucket("new")};
+        {remove_chunk_usage("old")}
+        {add_chunk_usage("new")}
+    END
+    """,
+    "buckets_usage_bucket_size": """
+    CREATE TRIGGER buckets_usage_bucket_size AFTER UPDATE OF size ON buckets_bucket
+    WHEN old.size != new.size AND new.owner_id IS NOT NULL
+    BEGIN
+        UPDATE core_fileshipuser SET used_bytes = used_bytes + new.size - old.size
+        WHERE user_id = new.owner_id;
+    END
+    """,
+    "buckets_usage_bucket_owner": """
+    CREATE TRIGGER buckets_usage_bucket_owner AFTER UPDATE OF owner_id ON buckets_bucket
+    WHEN old.owner_id IS NOT new.owner_id
+    BEGIN
+        UPDATE core_fileshipuser SET used_bytes = used_bytes - old.size
+        WHERE user_id = old.owner_id;
+        UPDATE core_fileshipuser SET used_bytes = used_bytes + new.size
+        WHERE user_id = new.owner_id;
+    END
+    """,
+}
+
+RECOMPUTE_USAGE_SQL = [
+    """
+    UPDATE buckets_bucket SET
+        size = COALESCE((
+            SELECT SUM(size) FROM buckets_node
+            WHERE bucket_id = buckets_bucket.id
+                AND (chunk_size IS NOT NULL OR pack_id IS NOT NULL)
+        ), 0),
+        node_count = (
+            SELECT COUNT(*) FROM buckets_node WHERE bucket_id = buckets_bucket.id
+        ),
+        chunk_count = (
+            SELECT COUNT(*) FROM buckets_chunk WHERE bucket_id = buckets_bucket.id
+        ) + (
+            SELECT COUNT(*) FROM buckets_chunk
+            JOIN buckets_node ON buckets_node.id = buckets_chunk.node_id
+            WHERE buckets_node.bucket_id = buckets_bucket.id
+                AND buckets_chunk.bucket_id IS NULL
+        )
+    """,
+    f"DELETE FROM {USAGE_TABLE}",
+    f"""
+    INSERT INTO {USAGE_TABLE} (bucket_id, connector, size, chunk_count)
+    SELECT bucket_id, connector, SUM(size), COUNT(*) FROM (
+        SELECT
+            {chunk_bucket("buckets_chunk")} AS bucket_id,
+            buckets_chunk.connector AS connector,
+            {chunk_bytes("buckets_chunk")} AS size
+        FROM buckets_chunk
+        WHERE {chunk_uploaded("buckets_chunk")}
+    ) AS chunks
+    WHERE bucket_id IS NOT NULL
+    GROUP BY bucket_id, connector
+    """,
+    """
+    UPDATE core_fileshipuser SET used_bytes = COALESCE((
+        SELECT SUM(size) FROM buckets_bucket
+        WHERE owner_id = core_fileshipuser.user_id
+    ), 0)
+    """,
+]
+
+
+def recompute_usage(connection) -> None:
+    with connection.cursor() as cursor:
+        for sql in RECOMPUTE_USAGE_SQL:
+            cursor.execute(sql)
+
+
+def install_usage_triggers(connection) -> bool:
+    # Triggers catch every write, bulk inserts, queryset updates and
+    # cascades included, which signals can't. They're SQLite specific, so
+    # elsewhere the counters are only as fresh as the last recomputeusage.
+    if connection.vendor != "sqlite":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            ["buckets_usage_%"],
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+
+        missing = [sql for name, sql in USAGE_TRIGGERS.items() if name not in existing]
+        for sql in missing:
+            cursor.execute(sql)
+
+    if missing:
+        recompute_usage(connection)
+
+    return True
+
+
+def drop_usage_triggers(connection) -> None:
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for name in USAGE_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
@@ -1,24 +1,46 @@
 from typing import List, Optional
 from rest_framework import views
-import requests
-import json
-import os
-import concurrent.futures
+from asgiref.sync import sync_to_async
+from django import views as django_views
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, JsonResponse
+import math
+import re
+import tarfile
+import zipfile
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from rest_framework.request import Request
 from core.models import FileshipUser
 from django.core.files.uploadedfile import UploadedFile
-from django.core.files.base import ContentFile
-from buckets.connectors import TelegramConnector
+from buckets.archives import (
+    AVAILABLE_ARCHIVE_FORMATS,
+    EntryPayloads,
+    collect_entries,
+    mark_entries_accessed,
+)
+from buckets.batch import NodeBatch
+from buckets.chunking import get_chunk_size
+from buckets.events import get_user_from_token, stream_events
+from buckets.connectors import AVAILABLE_CONNECTORS
+from buckets.extraction import NodeImporter, QuotaExceededError
 from buckets.forms import BucketForm, ChunkForm, NodeForm
 from buckets.models import Bucket, Chunk, Node
+from buckets.search import NodeSearch
+from buckets.storage import (
+    atomic_storage,
+    get_file_data_in_chunks_from_node,
+    store_chunks,
+)
 from rest_framework.permissions import AllowAny
 from rest_framework.views import Response
-from django.http.response import StreamingHttpResponse
-from fileship.utils import auto_retry
+from django.http.response import HttpResponse, StreamingHttpResponse
 import mimetypes
 
 from buckets.utils import generate_random_uuid
+from fileship.renderers import FastJSONRenderer, FirstRendererNegotiation
 
 
 browser_mime_types = set(
@@ -52,51 +74,18 @@ browser_mime_types = set(
 )
 
 
-@auto_retry
-def get_url_data_content(url: str) -> bytes:
-    if url.startswith("http://") or url.startswith("https://"):
-        response = requests.get(url)
-        response.raise_for_status()
-
-        return response.content
-
-    with open(os.path.join(settings.BASE_DIR, url), "rb") as f:
-        return f.read()
-
-
-def get_chunk_data(chunk: Chunk):
-    chunk_data_dict: dict = json.loads(chunk.data)
-    url = chunk_data_dict.get("url") or TelegramConnector.get_file_url(
-        chunk_data_dict["telegram_file_id"]
-    )
-    chunk_data = get_url_data_content(url)
-
-    return chunk_data
-
-
-def get_file_data_in_chunks_from_node(node: Node):
-    yield b""
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        futures: List[concurrent.futures.Future[bytes]] = []
-        for chunk in node.chunks.all().order_by("index"):
-            future = executor.submit(get_chunk_data, chunk)
-            futures.append(future)
-
-        for future in futures:
-            yield future.result()
-
-
 class BucketView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
     def get(self, request: Request):
         return Response(
             {
-                "result": [
-                    bucket.representation()
-                    for bucket in Bucket.objects.filter(
+                "result": Bucket.representations(
+                    Bucket.objects.filter(
                         users__in=[request.user],
                     ).order_by("name")
-                ],
+                ),
             }
         )
 
@@ -106,9 +95,19 @@ class BucketView(views.APIView):
             data={
                 "id": generate_random_uuid(),
                 "name": name,
+                "compression": request.data.get("compression"),
+                "encrypted": request.data.get("encrypted", False),
             }
         )
+        if not bucket_form.is_valid():
+            return Response(
+                {
+                    "detail": bucket_form.errors,
+                },
+                400,
+            )
         bucket = bucket_form.save(commit=False)
+        bucket.owner = request.user
         bucket.save()
         bucket.users.add(request.user)
 
@@ -136,8 +135,23 @@ class BucketView(views.APIView):
             id=bucket_id,
             users__in=[request.user],
         )
-        bucket.name = request.data["name"]
-        bucket.save()
+        bucket_form = BucketForm(
+            data={
+                "id": bucket.id,
+                "name": request.data.get("name", bucket.name),
+                "compression": request.data.get("compression", bucket.compression),
+                "encrypted": request.data.get("encrypted", bucket.encrypted),
+            },
+            instance=bucket,
+        )
+        if not bucket_form.is_valid():
+            return Response(
+                {
+                    "detail": bucket_form.errors,
+                },
+                400,
+            )
+        bucket_form.save()
 
         return Response(
             {
@@ -163,6 +177,9 @@ class BucketShareView(views.APIView):
 
 
 class NodesView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
     def get(
         self,
         request: Request,
@@ -205,6 +222,10 @@ class NodesView(views.APIView):
         bucket_id: str,
         *args,
     ) -> Response:
+        files = request.FILES.getlist("files")
+        if files:
+            return self.post_files(request, bucket_id, files)
+
         file = request.FILES.get("file")
         connector = request.POST.get("connector")
 
@@ -230,21 +251,61 @@ class NodesView(views.APIView):
         except Node.DoesNotExist:
             pass
 
-        chunk_data_files: List[ContentFile] = []
+        if connector and connector not in AVAILABLE_CONNECTORS:
+            return Response(
+                {
+                    "detail": "Connector not found",
+                },
+                400,
+            )
+
+        try:
+            bucket = Bucket.objects.get(
+                id=bucket_id,
+                users__in=[request.user],
+            )
+        except Bucket.DoesNotExist:
+            return Response(
+                {
+                    "detail": "Bucket not found",
+                },
+                404,
+            )
+
+        if bucket.lacks_master_key():
+            return Response(
+                {
+                    "detail": "Encrypted buckets need FILESHIP_MASTER_KEY to be set",
+                },
+                503,
+            )
+
+        if bucket.exceeds_quota(file.size if file else size):
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
+
+        chunk_size = None
+        chunk_datas: List[bytes] = []
         if file and connector:
             file: UploadedFile = file
             data = file.read()
-            chunk_size = 20 * 1024 * 1024
+            chunk_size = get_chunk_size(connector, file.size)
 
-            for part_index, data_offset in enumerate(range(0, len(data), chunk_size)):
-                chunk_data = data[data_offset : data_offset + chunk_size]
-                chunk_file = ContentFile(chunk_data)
-                chunk_file.name = f"{file.name}.part{part_index + 1}"
-                chunk_data_files.append(chunk_file)
+            for data_offset in range(0, len(data), chunk_size):
+                chunk_datas.append(data[data_offset : data_offset + chunk_size])
 
             id = id or generate_random_uuid()
             size = file.size
-            chunks = len(chunk_data_files)
+            chunks = len(chunk_datas)
+        elif connector and size and not chunks:
+            chunk_size = get_chunk_size(connector, size)
+            chunks = math.ceil(size / chunk_size)
+        elif chunks:
+            chunk_size = math.ceil(size / chunks)
 
         if len(id) < 64:
             raise ValueError("NodeId must have at least 64 characters")
@@ -255,50 +316,98 @@ class NodesView(views.APIView):
             "parent": parent_id,
             "bucket": bucket_id,
             "size": size,
+            "chunk_size": chunk_size,
         }
 
         node_form = NodeForm(data=new_node_data)
         instance: Node = node_form.save(commit=False)
-        instance.save()
-
-        def save_chunk(index: int) -> None:
-            chunk_id = generate_random_uuid()
-            chunk, _ = Chunk.objects.get_or_create(
-                index=index,
+        chunk_instances = [
+            Chunk(
+                id=generate_random_uuid(),
                 node=instance,
-                defaults={
-                    "id": chunk_id,
+                index=index,
+            )
+            for index in range(chunks)
+        ]
+
+        with transaction.atomic():
+            instance.save()
+            Chunk.objects.bulk_create(chunk_instances)
+
+        if chunk_datas:
+            store_chunks(chunk_instances, chunk_datas, connector, bucket)
+
+        return Response(
+            {
+                "result": instance.representation(),
+            }
+        )
+
+    def post_files(
+        self,
+        request: Request,
+        bucket_id: str,
+        files: List[UploadedFile],
+    ) -> Response:
+        connector = request.POST.get("connector")
+
+        if connector not in AVAILABLE_CONNECTORS:
+            return Response(
+                {
+                    "detail": "Connector not found",
                 },
+                400,
             )
-            if chunk_data_files and chunk.data is None:
-                chunk_data_file = chunk_data_files[index]
-                chunk_form = ChunkForm(
-                    data={
-                        "id": chunk_id,
-                        "node": instance.id,
-                        "index": index,
-                        "connector": connector,
-                    },
-                    files={
-                        "file": chunk_data_file,
-                    },
-                    instance=chunk,
-                )
-                chunk_form.save(commit=False).save()
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures: List[concurrent.futures.Future[None]] = []
+        try:
+            bucket = Bucket.objects.get(
+                id=bucket_id,
+                users__in=[request.user],
+            )
+        except Bucket.DoesNotExist:
+            return Response(
+                {
+                    "detail": "Bucket not found",
+                },
+                404,
+            )
 
-            for index in range(chunks):
-                future = executor.submit(save_chunk, index)
-                futures.append(future)
+        if bucket.lacks_master_key():
+            return Response(
+                {
+                    "detail": "Encrypted buckets need FILESHIP_MASTER_KEY to be set",
+                },
+                503,
+            )
+
+        if bucket.exceeds_quota(sum(file.size for file in files)):
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
 
-            for future in futures:
-                future.result()
+        try:
+            with atomic_storage():
+                node_ids = NodeImporter(
+                    bucket,
+                    request.POST.get("parent") or None,
+                    connector,
+                ).add_files(files)
+        except QuotaExceededError:
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
 
         return Response(
             {
-                "result": instance.representation(),
+                "result": Node.representations(
+                    Node.objects.filter(id__in=node_ids).order_by("name")
+                ),
             }
         )
 
@@ -334,23 +443,7 @@ class NodesView(views.APIView):
             bucket_id=bucket_id,
             bucket__users__in=[request.user],
         )
-        user_trash_bucket_id = f"{self.request.user.id}-trash-bucket"
-        if node.bucket.id == user_trash_bucket_id:
-            trash_bucket, _ = Bucket.objects.get_or_create(
-                id="global-trash-bucket",
-                defaults={
-                    "name": ".Trash",
-                },
-            )
-        else:
-            trash_bucket, new = Bucket.objects.get_or_create(
-                id=user_trash_bucket_id,
-                defaults={
-                    "name": ".Trash",
-                },
-            )
-            if new:
-                trash_bucket.users.add(self.request.user)
+        trash_bucket = Bucket.get_trash(self.request.user, node.bucket_id)
 
         node.update_bucket(trash_bucket.id)
         node.save()
@@ -363,6 +456,9 @@ class NodesView(views.APIView):
 
 
 class ChunksView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
     def get(
         self,
         request,
@@ -370,7 +466,11 @@ class ChunksView(views.APIView):
         node_id,
         chunk_index,
     ):
-        chunk = Chunk.objects.get(
+        chunk_id, connector, data = Chunk.objects.values_list(
+            "id",
+            "connector",
+            "data",
+        ).get(
             node__bucket_id=bucket_id,
             node__bucket__users__in=[request.user],
             node_id=node_id,
@@ -378,7 +478,10 @@ class ChunksView(views.APIView):
         )
         return Response(
             {
-                "result": chunk.representation(),
+                "result": {
+                    "id": chunk_id,
+                    "connector": connector if data else None,
+                },
             }
         )
 
@@ -396,14 +499,23 @@ class ChunksView(views.APIView):
             index=chunk_index,
         )
 
+        if chunk.node.bucket.lacks_master_key():
+            return Response(
+                {
+                    "detail": "Encrypted buckets need FILESHIP_MASTER_KEY to be set",
+                },
+                503,
+            )
+
         chunk_form = ChunkForm(
             data=request.POST,
             files=request.FILES,
             instance=chunk,
         )
 
+        # store_chunks saves the chunk itself; saving it again here could
+        # write data back to None after a worker already uploaded it.
         instance: Chunk = chunk_form.save(commit=False)
-        instance.save()
 
         return Response(
             {
@@ -426,10 +538,36 @@ class NodesDownloadView(views.APIView):
             id=node_id,
         )
 
+        start, end = 0, node.size
+        range_match = re.fullmatch(
+            r"bytes=(\d*)-(\d*)", request.headers.get("Range", "").strip()
+        )
+
+        if range_match and (range_match[1] or range_match[2]):
+            if range_match[1]:
+                start = int(range_match[1])
+                end = min(int(range_match[2]) + 1, node.size) if range_match[2] else end
+            else:
+                start = max(node.size - int(range_match[2]), 0)
+
+            if start >= end:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{node.size}"
+
+                return response
+
+        Chunk.objects.filter(Q(node=node) | Q(id=node.pack_id)).update(
+            access_count=F("access_count") + 1,
+            accessed_at=timezone.now(),
+        )
         response = StreamingHttpResponse(
-            get_file_data_in_chunks_from_node(node),
+            get_file_data_in_chunks_from_node(node, start, end),
+            status=206 if (start, end) != (0, node.size) else 200,
         )
 
+        if response.status_code == 206:
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{node.size}"
+
         content_type = mimetypes.guess_type(node.name)[0] or "application/octet-stream"
         inline_or_attachment = (
             "inline" if content_type in browser_mime_types else "attachment"
@@ -437,6 +575,389 @@ class NodesDownloadView(views.APIView):
         content_disposition = f'{inline_or_attachment}; filename="{node.name}"'
         response["Content-Disposition"] = content_disposition
         response["Content-Type"] = content_type
-        response["Content-Length"] = node.size
+        response["Content-Length"] = end - start
+        response["Accept-Ranges"] = "bytes"
+
+        return response
+
+
+class NodesArchiveView(views.APIView):
+    permission_classes = [AllowAny]
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
+    def get(
+        self,
+        request: Request,
+        bucket_id: str,
+    ):
+        archive_format = request.query_params.get("format", "zip")
+        node_ids = [
+            node_id
+            for value in request.query_params.getlist("nodes")
+            for node_id in value.split(",")
+            if node_id
+        ]
+
+        if archive_format not in AVAILABLE_ARCHIVE_FORMATS:
+            return Response(
+                {
+                    "detail": "Archive format not available",
+                },
+                400,
+            )
+
+        if not node_ids:
+            return Response(
+                {
+                    "detail": "No nodes selected",
+                },
+                400,
+            )
+
+        names = list(
+            Node.objects.filter(
+                bucket_id=bucket_id,
+                id__in=node_ids,
+            ).values_list("name", flat=True)[:2]
+        )
+        if not names:
+            return Response(
+                {
+                    "detail": "Node not found",
+                },
+                404,
+            )
+
+        entries = collect_entries(bucket_id, node_ids)
+        if not all(entry.uploaded for entry in entries):
+            return Response(
+                {
+                    "detail": "Some files are still being uploaded",
+                },
+                409,
+            )
+
+        mark_entries_accessed(entries)
+        archive_cls = AVAILABLE_ARCHIVE_FORMATS[archive_format]["cls"]
+        response = StreamingHttpResponse(
+            archive_cls.stream(entries, EntryPayloads(bucket_id, entries)),
+            content_type=archive_cls.content_type,
+        )
+
+        # Entries are stored uncompressed, so the exact length is known from
+        # the chunk sizes before anything is downloaded.
+        filename = names[0] if len(names) == 1 else "archive"
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}.{archive_format}"'
+        )
+        response["Content-Length"] = archive_cls.get_size(entries)
+
+        return response
+
+
+class NodesExtractView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
+    def post(
+        self,
+        request: Request,
+        bucket_id: str,
+    ) -> Response:
+        file = request.FILES.get("file")
+        connector = request.POST.get("connector")
+        parent_id = request.POST.get("parent") or None
+
+        if not file:
+            return Response(
+                {
+                    "detail": "No archive uploaded",
+                },
+                400,
+            )
+
+        if connector not in AVAILABLE_CONNECTORS:
+            return Response(
+                {
+                    "detail": "Connector not found",
+                },
+                400,
+            )
+
+        try:
+            bucket = Bucket.objects.get(
+                id=bucket_id,
+                users__in=[request.user],
+            )
+        except Bucket.DoesNotExist:
+            return Response(
+                {
+                    "detail": "Bucket not found",
+                },
+                404,
+            )
+
+        if (
+            parent_id
+            and not Node.objects.filter(
+                id=parent_id,
+                bucket=bucket,
+                pack=None,
+                chunks=None,
+            ).exists()
+        ):
+            return Response(
+                {
+                    "detail": "Node not found",
+                },
+                404,
+            )
+
+        if bucket.lacks_master_key():
+            return Response(
+                {
+                    "detail": "Encrypted buckets need FILESHIP_MASTER_KEY to be set",
+                },
+                503,
+            )
+
+        if bucket.exceeds_quota(file.size):
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
+
+        try:
+            with atomic_storage():
+                result = NodeImporter(bucket, parent_id, connector).extract(file)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError):
+            return Response(
+                {
+                    "detail": "Archive could not be read",
+                },
+                400,
+            )
+        except QuotaExceededError:
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
+
+        return Response(
+            {
+                "result": result,
+            }
+        )
+
+
+class NodesBatchView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
+    def post(
+        self,
+        request: Request,
+        bucket_id: str,
+    ) -> Response:
+        operations = (
+            request.data.get("operations") if isinstance(request.data, dict) else None
+        )
+
+        if (
+            not isinstance(operations, list)
+            or not operations
+            or not all(isinstance(operation, dict) for operation in operations)
+        ):
+            return Response(
+                {
+                    "detail": "Operations must be a list of objects",
+                },
+                400,
+            )
+
+        if len(operations) > settings.BATCH_MAX_OPERATIONS:
+            return Response(
+                {
+                    "detail": f"A batch can't have more than {settings.BATCH_MAX_OPERATIONS} operations",
+                },
+                400,
+            )
+
+        try:
+            bucket = Bucket.objects.get(
+                id=bucket_id,
+                users__in=[request.user],
+            )
+        except Bucket.DoesNotExist:
+            return Response(
+                {
+                    "detail": "Bucket not found",
+                },
+                404,
+            )
+
+        batch = NodeBatch(bucket, request.user)
+        results = batch.apply(operations)
+
+        if any(error for _, error in results):
+            return Response(
+                {
+                    "detail": "Some operations are invalid",
+                    "operations": [
+                        (
+                            {"status": "error", "detail": error}
+                            if error
+                            else {"status": "skipped"}
+                        )
+                        for _, error in results
+                    ],
+                },
+                400,
+            )
+
+        if bucket.exceeds_quota(sum(node.size for node in batch.created.values())):
+            return Response(
+                {
+                    "detail": "Storage quota exceeded",
+                },
+                507,
+            )
+
+        try:
+            with transaction.atomic():
+                batch.save()
+        except IntegrityError:
+            return Response(
+                {
+                    "detail": "Batch conflicts with concurrent changes",
+                },
+                409,
+            )
+
+        representations = batch.get_representations(
+            id for id, _ in results if id is not None
+        )
+
+        return Response(
+            {
+                "result": {
+                    "operations": [
+                        (
+                            {"status": "success", "result": representations.get(id)}
+                            if id is not None
+                            else {"status": "success"}
+                        )
+                        for id, _ in results
+                    ],
+                },
+            }
+        )
+
+
+class NodesSearchView(views.APIView):
+    renderer_classes = [FastJSONRenderer]
+    content_negotiation_class = FirstRendererNegotiation
+
+    def get(self, request: Request) -> Response:
+        bucket_ids = list(
+            Bucket.objects.filter(
+                users__in=[request.user],
+            ).values_list("id", flat=True)
+        )
+
+        bucket_id = request.query_params.get("bucket")
+        if bucket_id:
+            if bucket_id not in bucket_ids:
+                return Response(
+                    {
+                        "detail": "Bucket not found",
+                    },
+                    404,
+                )
+            bucket_ids = [bucket_id]
+        else:
+            # Trashed nodes only turn up when the trash is searched on its own.
+            bucket_ids = [id for id in bucket_ids if not id.endswith("-trash-bucket")]
+
+        search = NodeSearch(connection, bucket_ids)
+        error = search.parse(request.query_params)
+        if error:
+            return Response(
+                {
+                    "detail": error,
+                },
+                400,
+            )
+
+        nodes, cursor = search.get_page()
+
+        return Response(
+            {
+                "result": nodes,
+                "cursor": cursor,
+            }
+        )
+
+
+class NodesEventsView(django_views.View):
+    # EventSource can't send headers, so the token may also come as a query
+    # parameter, and DRF views can't stream asynchronously, hence a plain view.
+    async def get(self, request: HttpRequest, bucket_id: str):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse(
+                {
+                    "detail": "Event streams are served by the ASGI application",
+                },
+                status=501,
+            )
+
+        key = request.GET.get("token", "")
+        authorization = request.headers.get("Authorization", "").split()
+        if len(authorization) == 2 and authorization[0] in ("Token", "Bearer"):
+            key = authorization[1]
+
+        user = await sync_to_async(get_user_from_token)(key) if key else None
+        if user is None:
+            return JsonResponse(
+                {
+                    "detail": "Authentication credentials were not provided.",
+                },
+                status=401,
+            )
+
+        if not await Bucket.objects.filter(id=bucket_id, users=user).aexists():
+            return JsonResponse(
+                {
+                    "detail": "Bucket not found",
+                },
+                status=404,
+            )
+
+        last_event_id = None
+        last_event = request.headers.get("Last-Event-ID") or request.GET.get(
+            "lastEventId"
+        )
+        if last_event:
+            try:
+                last_event_id = int(last_event)
+            except ValueError:
+                return JsonResponse(
+                    {
+                        "detail": "Last-Event-ID must be an integer",
+                    },
+                    status=400,
+                )
+
+        response = StreamingHttpResponse(
+            stream_events(bucket_id, last_event_id),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
 
         return response
@@ -1,8 +1,20 @@
 import os
+from typing import Optional
 import requests
+from fileship.retry import RetryBudget, RetryPolicy
 
+EMAIL_RETRY_POLICY = RetryPolicy(
+    "send_email",
+    max_attempts=3,
+    base_delay=1,
+    max_delay=4,
+    deadline=15,
+    budget=RetryBudget(),
+)
 
-def send_email(to: str, body: str):
+
+@EMAIL_RETRY_POLICY
+def send_email(to: str, body: str, session: Optional[requests.Session] = None):
     mailjet_url = "https://api.mailjet.com/v3.1/send"
 
     auth = (os.environ.get("MJ_APIKEY_PUBLIC"), os.environ.get("MJ_APIKEY_PRIVATE"))
@@ -25,4 +37,5 @@ def send_email(to: str, body: str):
         ]
     }
 
-    requests.post(mailjet_url, auth=auth, json=data)
+    response = (session or requests).post(mailjet_url, auth=auth, json=data, timeout=10)
+    response.raise_for_status()
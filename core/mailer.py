@@ -0,0 +1,84 @@
+import logging
+import os
+import queue
+import threading
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from core.communication import send_email
+from fileship.metrics import Counter, Gauge, register, register_collector
+
+logger = logging.getLogger("fileship.mailer")
+
+EMAILS = register(
+    Counter(
+        "fileship_emails_total",
+        "Emails handed to the mailer by result.",
+        ("result",),
+    )
+)
+
+EMAIL_QUEUE_DEPTH = register(
+    Gauge(
+        "fileship_email_queue_depth",
+        "Emails waiting to be sent in this process.",
+    )
+)
+
+
+class Mailer:
+    def __init__(self, maxsize: int, workers: int) -> None:
+        self.maxsize = maxsize
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pid: Optional[int] = None
+        self.queue: Optional[queue.Queue] = None
+
+    def start(self) -> None:
+        # Threads don't survive a fork, so a gunicorn worker that inherited a
+        # started mailer gets its own queue and threads on first use.
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.queue = queue.Queue(self.maxsize)
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_maxsize=self.workers))
+
+            for _ in range(self.workers):
+                threading.Thread(target=self.run, args=(session,), daemon=True).start()
+
+            self.pid = os.getpid()
+
+    def send(self, to: str, body: str) -> bool:
+        self.start()
+
+        try:
+            self.queue.put_nowait((to, body))
+        except queue.Full:
+            EMAILS.inc("dropped")
+            logger.error("Email queue is full, dropping email")
+            return False
+
+        return True
+
+    def run(self, session: requests.Session) -> None:
+        while True:
+            to, body = self.queue.get()
+            try:
+                send_email(to=to, body=body, session=session)
+                EMAILS.inc("sent")
+            except Exception:
+                EMAILS.inc("failed")
+                logger.exception("Failed to send email")
+            finally:
+                self.queue.task_done()
+
+
+mailer = Mailer(settings.MAILER_QUEUE_SIZE, settings.MAILER_WORKERS)
+
+
+@register_collector
+def collect_mailer():
+    EMAIL_QUEUE_DEPTH.set_all({(): mailer.queue.qsize() if mailer.queue else 0})
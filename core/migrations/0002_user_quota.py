@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileshipuser",
+            name="quota",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="fileshipuser",
+            name="used_bytes",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -3,13 +3,16 @@ from django.contrib.auth.models import User
 from datetime import datetime
 import random
 from rest_framework.authtoken.models import Token
-from core.communication import send_email
+from core.mailer import mailer
 
 
 class FileshipUser(models.Model):
     user: User = models.OneToOneField("auth.User", on_delete=models.CASCADE)
     otp = models.CharField(null=True, blank=True, max_length=6)
     otp_at = models.DateTimeField(null=True, blank=True)
+    quota = models.BigIntegerField(null=True, blank=True)
+    # Kept up to date by triggers on the sizes of the buckets the user owns.
+    used_bytes = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -29,17 +32,26 @@ class FileshipUser(models.Model):
 
         return fuser
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "used_bytes"
+            ]
+
+        super().save(*args, **kwargs)
+
     def send_otp(self):
         self.otp = "".join([str(random.randint(0, 9)) for _ in range(6)])
+        self.otp_at = datetime.now()
+        self.save()
 
-        send_email(
+        mailer.send(
             to=self.user.email,
             body=f"<p>Your OTP code is <strong>{self.otp}</strong></p>",
         )
 
-        self.otp_at = datetime.now()
-        self.save()
-
     def clear_otp(self):
         self.otp = None
         self.otp_at = None
@@ -52,6 +64,8 @@ class FileshipUser(models.Model):
             "email": self.user.email,
             "firstName": self.user.first_name,
             "lastName": self.user.last_name,
+            "quota": self.quota,
+            "usedBytes": self.used_bytes,
             "createdAt": self.created_at,
             "updatedAt": self.updated_at,
             "apiKey": token.key,
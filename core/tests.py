@@ -1,3 +1,46 @@
-from django.test import TestCase
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from core.models import FileshipUser
 
-# Create your tests here.
+OTP_REQUEST_URL = "/srv/api/users/otp/request/"
+
+
+@override_settings(OTP_EMAIL_RATE=(2, 600), OTP_IP_RATE=(4, 3600))
+class OTPRequestThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        send_otp = mock.patch.object(FileshipUser, "send_otp")
+        self.send_otp = send_otp.start()
+        self.addCleanup(send_otp.stop)
+
+    def request_otp(self, email: str, ip: str = "10.0.0.1"):
+        return self.client.post(
+            OTP_REQUEST_URL,
+            {"email": email},
+            content_type="application/json",
+            REMOTE_ADDR=ip,
+        )
+
+    def test_email_limit(self):
+        statuses = [self.request_otp("a@example.com").status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(self.send_otp.call_count, 2)
+
+    def test_email_limit_ignores_case_and_whitespace(self):
+        self.request_otp("a@example.com")
+        self.request_otp(" A@Example.com ")
+
+        self.assertEqual(self.request_otp("a@example.com").status_code, 429)
+
+    def test_requests_rejected_by_the_email_limit_count_towards_the_ip(self):
+        for _ in range(4):
+            self.request_otp("a@example.com")
+
+        self.assertEqual(self.request_otp("b@example.com").status_code, 429)
+        self.assertEqual(
+            self.request_otp("b@example.com", ip="10.0.0.2").status_code, 200
+        )
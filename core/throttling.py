@@ -0,0 +1,30 @@
+from typing import Tuple
+from django.core.cache import cache
+from django.conf import settings
+from rest_framework.request import Request
+
+
+def get_client_ip(request: Request) -> str:
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+
+    # Only the addresses appended by our own proxies can be trusted; anything
+    # further left was sent by the client.
+    if forwarded_for and settings.NUM_PROXIES:
+        addresses = [address.strip() for address in forwarded_for.split(",")]
+        return addresses[-min(settings.NUM_PROXIES, len(addresses))]
+
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def is_throttled(key: str, rate: Tuple[int, int]) -> bool:
+    limit, window = rate
+    cache_key = f"throttle:{key}"
+
+    # A fixed window counter is a single atomic increment, so checking a
+    # request costs one cache round trip and no database queries.
+    cache.add(cache_key, 0, window)
+    try:
+        return cache.incr(cache_key) > limit
+    except ValueError:
+        cache.set(cache_key, 1, window)
+        return False
@@ -1,7 +1,9 @@
 from rest_framework import views
 from rest_framework.request import Request
 from rest_framework.response import Response
+from django.conf import settings
 from core.models import FileshipUser
+from core.throttling import get_client_ip, is_throttled
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from datetime import datetime, timedelta
 from rest_framework.permissions import AllowAny
@@ -24,6 +26,23 @@ class OTPRequestView(views.APIView):
     def post(self, request: Request):
         data = request.data
         email = data.get("email")
+
+        # Both counters take the request, so an address can't spread requests
+        # over many emails without running into its own limit.
+        email_throttled = is_throttled(
+            f"otp:email:{str(email).strip().lower()}", settings.OTP_EMAIL_RATE
+        )
+        ip_throttled = is_throttled(
+            f"otp:ip:{get_client_ip(request)}", settings.OTP_IP_RATE
+        )
+        if email_throttled or ip_throttled:
+            return Response(
+                {
+                    "detail": "Too many OTP requests",
+                },
+                status=429,
+            )
+
         fuser = FileshipUser.get_from_email(email)
         fuser.send_otp()
 
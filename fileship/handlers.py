@@ -0,0 +1,67 @@
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from fileship.metrics import start_exporter
+
+
+class ApiMiddlewareMixin:
+    def load_middleware(self, is_async=False):
+        # Handlers read their chain from settings.MIDDLEWARE once, at startup,
+        # so it is swapped only while this handler builds its own.
+        middleware = settings.MIDDLEWARE
+        settings.MIDDLEWARE = settings.API_MIDDLEWARE
+        try:
+            super().load_middleware(is_async)
+        finally:
+            settings.MIDDLEWARE = middleware
+
+
+class ApiWSGIHandler(ApiMiddlewareMixin, WSGIHandler):
+    pass
+
+
+class ApiASGIHandler(ApiMiddlewareMixin, ASGIHandler):
+    pass
+
+
+def is_api_path(path: str) -> bool:
+    return path.startswith(settings.API_PATH_PREFIX)
+
+
+class WSGIDispatcher:
+    def __init__(self) -> None:
+        self.handler = WSGIHandler()
+        self.api_handler = ApiWSGIHandler()
+
+    def __call__(self, environ, start_response):
+        if is_api_path(environ.get("PATH_INFO", "")):
+            return self.api_handler(environ, start_response)
+
+        return self.handler(environ, start_response)
+
+
+class ASGIDispatcher:
+    def __init__(self) -> None:
+        self.handler = ASGIHandler()
+        self.api_handler = ApiASGIHandler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and is_api_path(scope.get("path", "")):
+            return await self.api_handler(scope, receive, send)
+
+        return await self.handler(scope, receive, send)
+
+
+def get_wsgi_application() -> WSGIDispatcher:
+    django.setup(set_prefix=False)
+    start_exporter()
+
+    return WSGIDispatcher()
+
+
+def get_asgi_application() -> ASGIDispatcher:
+    django.setup(set_prefix=False)
+    start_exporter()
+
+    return ASGIDispatcher()
@@ -0,0 +1,64 @@
+import functools
+import ipaddress
+from typing import Iterable
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.http import HttpRequest
+from django.http.request import split_domain_port
+
+
+class HostMatcher:
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.exact = set()
+        self.suffixes = []
+        self.networks = []
+
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if pattern.startswith("."):
+                self.exact.add(pattern[1:])
+                self.suffixes.append(pattern)
+                continue
+            try:
+                self.networks.append(ipaddress.ip_network(pattern, strict=False))
+            except ValueError:
+                self.exact.add(pattern)
+
+        self.suffixes = tuple(self.suffixes)
+        self.is_allowed = functools.lru_cache(maxsize=1024)(self.match)
+
+    def match(self, domain: str) -> bool:
+        if domain in self.exact or domain.endswith(self.suffixes):
+            return True
+
+        try:
+            address = ipaddress.ip_address(domain.strip("[]"))
+        except ValueError:
+            return False
+
+        return any(address in network for network in self.networks)
+
+
+class HostValidationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Anything added to ALLOWED_HOSTS at runtime, like the test client's
+        # "testserver", is honoured as well.
+        self.matcher = HostMatcher(
+            [
+                *settings.FILESHIP_ALLOWED_HOSTS,
+                *[host for host in settings.ALLOWED_HOSTS if host != "*"],
+            ]
+        )
+
+    def __call__(self, request: HttpRequest):
+        # ALLOWED_HOSTS is "*" so Django's own linear scan is skipped; exact
+        # names and domain suffixes are set/tuple lookups here and private
+        # ranges are matched as networks rather than one entry per address.
+        host = request.get_host()
+        domain, _ = split_domain_port(host)
+
+        if not domain or not self.matcher.is_allowed(domain):
+            raise DisallowedHost(f"Invalid HTTP_HOST header: {host!r}.")
+
+        return self.get_response(request)
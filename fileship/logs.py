@@ -0,0 +1,141 @@
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict
+from fileship.metrics import Counter, register
+
+REDACTED_KEYS = ("token", "authorization", "password", "secret", "otp", "key")
+
+MAX_VALUE_LENGTH = 200
+
+MAX_ITEMS = 10
+
+LOG_RECORDS_DROPPED = register(
+    Counter(
+        "fileship_log_records_dropped_total",
+        "Log records dropped because the logging queue was full.",
+    )
+)
+
+log_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar(
+    "log_context", default={}
+)
+
+
+@contextlib.contextmanager
+def logging_context(**fields):
+    token = log_context.set({**log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+def run_with_logging_context(fields: Dict[str, str], func, *args, **kwargs):
+    with logging_context(**fields):
+        return func(*args, **kwargs)
+
+
+def is_redacted(key) -> bool:
+    return any(redacted in str(key).lower() for redacted in REDACTED_KEYS)
+
+
+def render_value(value, depth: int = 0):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+
+    if isinstance(value, dict) and depth < 4:
+        return {
+            str(key): "***" if is_redacted(key) else render_value(item, depth + 1)
+            for key, item in list(value.items())[:MAX_ITEMS]
+        }
+
+    if isinstance(value, (list, tuple, set)) and depth < 4:
+        items = [render_value(item, depth + 1) for item in list(value)[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append(f"<{len(value) - MAX_ITEMS} more>")
+        return items
+
+    if hasattr(value, "read") and hasattr(value, "size"):
+        return f"<{type(value).__name__} {value.size} bytes>"
+
+    text = str(value)
+    if len(text) > MAX_VALUE_LENGTH:
+        text = f"{text[:MAX_VALUE_LENGTH]}... <{len(text)} chars>"
+
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if isinstance(args, tuple):
+            args = tuple(render_value(arg) for arg in args)
+        elif isinstance(args, dict):
+            args = render_value(args)
+
+        try:
+            message = str(record.msg) % args if args else str(record.msg)
+        except (TypeError, ValueError):
+            message = f"{record.msg} {args}"
+
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+            **getattr(record, "context", {}),
+        }
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry["fields"] = render_value(fields)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, maxsize: int = 10000) -> None:
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.stream_handler = logging.StreamHandler(sys.stdout)
+        self.stream_handler.setFormatter(JsonFormatter())
+        self.start_listener()
+
+        # Upload workers are forked, and the listener thread doesn't survive
+        # the fork, so every child starts its own.
+        os.register_at_fork(after_in_child=self.start_listener)
+        atexit.register(lambda: self.listener.stop())
+
+    def start_listener(self) -> None:
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.stream_handler)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats the message here, on the thread that
+        # logged it. Only the context is captured now; rendering, truncation
+        # and the write itself all happen on the listener thread.
+        record = copy.copy(record)
+        record.context = log_context.get()
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
@@ -0,0 +1,370 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger("fileship.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames: Iterable[str], labels: Iterable[str]) -> str:
+    pairs = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(labelnames, labels)
+    ]
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set_all(self, values: Dict[Tuple[str, ...], float]) -> None:
+        with self.lock:
+            self.values = dict(values)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, values: Dict[Tuple[str, ...], float], labels, value) -> None:
+        values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        # Only the bucket the value falls in is counted here; the cumulative
+        # counts Prometheus expects are summed up at scrape time instead.
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            if labels not in self.values:
+                self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts = self.values[labels]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self.lock:
+            return {labels: list(counts) for labels, counts in self.values.items()}
+
+    def merge(self, values: Dict[Tuple[str, ...], List[float]], labels, counts) -> None:
+        if labels not in values:
+            values[labels] = [0] * len(counts)
+        values[labels] = [a + b for a, b in zip(values[labels], counts)]
+
+    def samples(self, values: Dict[Tuple[str, ...], List[float]]) -> List[str]:
+        lines = []
+        for labels, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{format_labels(self.labelnames + ('le',), labels + (bound,))}"
+                    f" {cumulative}"
+                )
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text} {counts[-1]}")
+
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        aggregate: str = "max",
+    ):
+        super().__init__(name, help, labelnames)
+        # Gauges reported by several processes are either the same reading,
+        # like a queue in the database, or a share of a total.
+        self.aggregate = aggregate
+
+    def merge(self, values: Dict[Tuple[str, ...], float], labels, value) -> None:
+        if self.aggregate == "sum" or labels not in values:
+            super().merge(values, labels, value)
+        else:
+            values[labels] = max(values[labels], value)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+
+registry_lock = threading.Lock()
+registry: List[Counter] = []
+collectors: List[Callable[[], None]] = []
+
+
+def register(metric):
+    with registry_lock:
+        registry.append(metric)
+
+    return metric
+
+
+def register_collector(collector: Callable[[], None]) -> Callable[[], None]:
+    with registry_lock:
+        collectors.append(collector)
+
+    return collector
+
+
+def collect() -> List[Counter]:
+    with registry_lock:
+        metrics, metric_collectors = list(registry), list(collectors)
+
+    for collector in metric_collectors:
+        collector()
+
+    return metrics
+
+
+def get_export_path(pid: int) -> str:
+    return os.path.join(settings.METRICS_DIR, f"{pid}.json")
+
+
+def export() -> None:
+    snapshot = {
+        metric.name: [
+            [list(labels), value] for labels, value in metric.snapshot().items()
+        ]
+        for metric in collect()
+    }
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = get_export_path(os.getpid())
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_exports() -> List[dict]:
+    # Every other process that recorded metrics, upload workers included,
+    # left its latest snapshot here. Ones that stopped refreshing theirs are
+    # gone and dropped.
+    if not os.path.isdir(settings.METRICS_DIR):
+        return []
+
+    expired_at = time.time() - 3 * settings.METRICS_EXPORT_INTERVAL
+    own_path = get_export_path(os.getpid())
+    exports = []
+    with os.scandir(settings.METRICS_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or entry.path == own_path:
+                continue
+
+            try:
+                if entry.stat().st_mtime < expired_at:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path) as f:
+                    exports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    return exports
+
+
+exporter: Optional[threading.Thread] = None
+exporter_lock = threading.Lock()
+
+
+def run_exporter() -> None:
+    while True:
+        try:
+            export()
+        except Exception:
+            logger.exception("Failed to export metrics")
+        finally:
+            connection.close()
+
+        time.sleep(settings.METRICS_EXPORT_INTERVAL)
+
+
+def start_exporter_thread() -> None:
+    global exporter
+
+    exporter = threading.Thread(target=run_exporter, daemon=True)
+    exporter.start()
+
+
+def start_exporter() -> None:
+    with exporter_lock:
+        if exporter is None:
+            start_exporter_thread()
+            # Threads don't survive a fork, and servers that load the app
+            # before forking their workers would otherwise export nothing.
+            os.register_at_fork(after_in_child=start_exporter_thread)
+
+
+def render() -> str:
+    metrics = collect()
+    exports = read_exports()
+
+    lines = []
+    for metric in metrics:
+        values = metric.snapshot()
+        for snapshot in exports:
+            for labels, value in snapshot.get(metric.name, []):
+                metric.merge(values, tuple(labels), value)
+
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples(values))
+
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = register(
+    Histogram(
+        "fileship_http_request_duration_seconds",
+        "Time until a view returned its response.",
+        ("view", "method", "status"),
+    )
+)
+
+HTTP_REQUEST_QUERIES = register(
+    Histogram(
+        "fileship_http_request_db_queries",
+        "Database queries executed while handling a request.",
+        ("view",),
+        QUERY_BUCKETS,
+    )
+)
+
+CHUNK_UPLOAD_SECONDS = register(
+    Histogram(
+        "fileship_chunk_upload_duration_seconds",
+        "Time spent uploading a chunk to a connector.",
+        ("connector",),
+    )
+)
+
+CHUNK_UPLOAD_BYTES = register(
+    Counter(
+        "fileship_chunk_upload_bytes_total",
+        "Bytes uploaded to a connector.",
+        ("connector",),
+    )
+)
+
+CHUNK_DOWNLOAD_SECONDS = register(
+    Histogram(
+        "fileship_chunk_download_duration_seconds",
+        "Time spent downloading a chunk from a connector.",
+        ("connector",),
+    )
+)
+
+CHUNK_DOWNLOAD_BYTES = register(
+    Counter(
+        "fileship_chunk_download_bytes_total",
+        "Bytes downloaded from a connector.",
+        ("connector",),
+    )
+)
+
+RETRIES = register(
+    Counter(
+        "fileship_retries_total",
+        "Retried calls by function.",
+        ("function",),
+    )
+)
+
+CACHE_REQUESTS = register(
+    Counter(
+        "fileship_cache_requests_total",
+        "Cache lookups by cache and result.",
+        ("cache", "result"),
+    )
+)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started_at
+
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.view_name if resolver_match else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            elapsed, view, request.method, str(response.status_code)
+        )
+        HTTP_REQUEST_QUERIES.observe(queries[0], view)
+
+        return response
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    if (
+        not settings.METRICS_TOKEN
+        or request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=401)
+
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4")
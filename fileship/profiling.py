@@ -0,0 +1,183 @@
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse, HttpRequest
+from rest_framework import views
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+logger = logging.getLogger("fileship.profiling")
+
+
+class RequestProfile:
+    def __init__(self, with_profiler: bool) -> None:
+        self.id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.spans: Dict[str, List[float]] = {}
+        self.profiler = cProfile.Profile() if with_profiler else None
+
+    def record_query(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started_at
+            self.queries += 1
+
+    def record_span(self, name: str, elapsed: float) -> None:
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += elapsed
+
+    def server_timing(self, total: float) -> str:
+        timings = [
+            f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        with self.lock:
+            for name, (count, elapsed) in self.spans.items():
+                timings.append(f'{name};dur={elapsed * 1000:.1f};desc="{count} calls"')
+        timings.append(f"total;dur={total * 1000:.1f}")
+
+        return ", ".join(timings)
+
+    def representation(self, request: HttpRequest, status: int, total: float):
+        resolver_match = getattr(request, "resolver_match", None)
+
+        with self.lock:
+            spans = {
+                name: {"count": count, "duration": elapsed}
+                for name, (count, elapsed) in self.spans.items()
+            }
+
+        return {
+            "id": self.id,
+            "method": request.method,
+            "path": request.path,
+            "view": resolver_match.view_name if resolver_match else None,
+            "status": status,
+            "duration": total,
+            "queries": self.queries,
+            "queryDuration": self.query_time,
+            "spans": spans,
+            "profiled": self.profiler is not None,
+        }
+
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = (
+    contextvars.ContextVar("current_profile", default=None)
+)
+
+
+def record_span(name: str, elapsed: float) -> None:
+    profile = current_profile.get()
+
+    if profile is not None:
+        profile.record_span(name, elapsed)
+
+
+def save_profile(profile: RequestProfile) -> None:
+    os.makedirs(settings.PROFILING_ROOT, exist_ok=True)
+    profile.profiler.dump_stats(os.path.join(settings.PROFILING_ROOT, profile.id))
+
+    profile_names = sorted(
+        os.scandir(settings.PROFILING_ROOT),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profile_names[: -settings.PROFILING_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def get_profile(self, request: HttpRequest) -> Optional[RequestProfile]:
+        requested = (
+            settings.PROFILING_TOKEN
+            and request.headers.get("X-Profile") == settings.PROFILING_TOKEN
+        )
+
+        # Sampled requests only count queries and connector calls; the much
+        # more expensive cProfile run has to be asked for explicitly.
+        if requested:
+            return RequestProfile(
+                with_profiler=request.headers.get("X-Profile-Mode") == "cprofile"
+            )
+
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            return RequestProfile(with_profiler=False)
+
+        return None
+
+    def __call__(self, request: HttpRequest):
+        profile = self.get_profile(request)
+
+        if profile is None:
+            return self.get_response(request)
+
+        token = current_profile.set(profile)
+        try:
+            with connection.execute_wrapper(profile.record_query):
+                if profile.profiler:
+                    profile.profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profile.profiler:
+                        profile.profiler.disable()
+        finally:
+            current_profile.reset(token)
+
+        total = time.perf_counter() - profile.started_at
+        response["Server-Timing"] = profile.server_timing(total)
+        response["X-Profile-Id"] = profile.id
+        logger.info(
+            "Profiled %s %s",
+            request.method,
+            request.path,
+            extra={
+                "fields": profile.representation(request, response.status_code, total)
+            },
+        )
+
+        if profile.profiler:
+            save_profile(profile)
+
+        return response
+
+
+class ProfileView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request, profile_id: str):
+        profile_path = os.path.join(settings.PROFILING_ROOT, profile_id)
+
+        if not profile_id.isalnum() or not os.path.exists(profile_path):
+            return Response(
+                {
+                    "detail": "Profile not found",
+                },
+                404,
+            )
+
+        return FileResponse(
+            open(profile_path, "rb"),
+            as_attachment=True,
+            filename=f"{profile_id}.prof",
+        )
@@ -0,0 +1,59 @@
+import json
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+encoder = JSONEncoder()
+
+
+def default(value):
+    # Subclasses are passed through to here because orjson would read their
+    # underlying storage directly, and Django's ErrorList keeps its items
+    # elsewhere.
+    if isinstance(value, dict):
+        return dict(value)
+
+    if isinstance(value, list):
+        return list(value)
+
+    if isinstance(value, str):
+        return str(value)
+
+    return encoder.default(value)
+
+
+class FastJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        if orjson is not None:
+            return orjson.dumps(
+                data,
+                default=default,
+                option=orjson.OPT_PASSTHROUGH_SUBCLASS,
+            )
+
+        return json.dumps(
+            data,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+
+
+class FirstRendererNegotiation(DefaultContentNegotiation):
+    def select_renderer(self, request, renderers, format_suffix=None):
+        # Views using this only ever answer in JSON, so there's nothing to
+        # negotiate and the Accept header isn't parsed.
+        return renderers[0], renderers[0].media_type
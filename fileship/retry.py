@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+import requests
+from fileship.metrics import RETRIES
+
+logger = logging.getLogger("fileship.retry")
+
+
+class RetryBudget:
+    def __init__(
+        self,
+        ratio: float = 0.2,
+        min_per_second: float = 1.0,
+        max_tokens: float = 10.0,
+    ) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, amount: float = 0) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.max_tokens,
+            self.tokens + (now - self.updated_at) * self.min_per_second + amount,
+        )
+        self.updated_at = now
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        # Every call earns a fraction of a retry, so when an upstream goes
+        # down retries stay a small share of traffic instead of multiplying it.
+        with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+
+            return True
+
+
+def get_retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_retryable(e: Exception) -> bool:
+    retryable = getattr(e, "retryable", None)
+    if retryable is not None:
+        return retryable
+
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        status_code = e.response.status_code
+        return status_code in (408, 425, 429) or status_code >= 500
+
+    if isinstance(e, requests.RequestException):
+        return True
+
+    return isinstance(e, OSError) and not isinstance(
+        e, (FileNotFoundError, PermissionError, IsADirectoryError)
+    )
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        deadline: Optional[float] = None,
+        budget: Optional[RetryBudget] = None,
+    ) -> None:
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.budget = budget
+
+    def get_delay(self, attempt: int, e: Exception) -> float:
+        delay = random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+        return max(delay, min(get_retry_after(e) or 0, self.max_delay))
+
+    def get_retry_delay(
+        self, attempt: int, started_at: float, e: Exception
+    ) -> Optional[float]:
+        if attempt >= self.max_attempts or not is_retryable(e):
+            return None
+
+        delay = self.get_delay(attempt, e)
+
+        if (
+            self.deadline is not None
+            and time.monotonic() - started_at + delay > self.deadline
+        ):
+            return None
+
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+
+        return delay
+
+    def on_retry(self, call_id: str, attempt: int, delay: float, e: Exception):
+        RETRIES.inc(self.name)
+        logger.warning(
+            "Retrying %s after %s in %.2f seconds",
+            self.name,
+            e,
+            delay,
+            extra={
+                "fields": {
+                    "call": call_id,
+                    "attempt": attempt,
+                },
+            },
+        )
+
+    def call(self, func, *args, **kwargs):
+        started_at = time.monotonic()
+        call_id = None
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self.get_retry_delay(attempt, started_at, e)
+                if delay is None:
+                    raise
+
+                call_id = call_id or uuid.uuid4().hex[:16]
+                self.on_retry(call_id, attempt, delay, e)
+                time.sleep(delay)
+                continue
+
+            if self.budget is not None:
+                self.budget.deposit()
+
+            return result
+
+    async def acall(self, func, *args, **kwargs):
+        started_at = time.monotonic()
+        call_id = None
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self.get_retry_delay(attempt, started_at, e)
+                if delay is None:
+                    raise
+
+                call_id = call_id or uuid.uuid4().hex[:16]
+                self.on_retry(call_id, attempt, delay, e)
+                await asyncio.sleep(delay)
+                continue
+
+            if self.budget is not None:
+                self.budget.deposit()
+
+            return result
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapped(*args, **kwargs):
+                return await self.acall(func, *args, **kwargs)
+
+            return async_wrapped
+
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+
+        return wrapped
@@ -32,10 +32,14 @@ SECRET_KEY = os.getenv(
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG", "true") == "true"
 
-ALLOWED_HOSTS = [
+# Hosts are validated by fileship.hosts.HostValidationMiddleware, which
+# understands CIDR ranges, instead of Django's linear ALLOWED_HOSTS scan.
+ALLOWED_HOSTS = ["*"]
+
+FILESHIP_ALLOWED_HOSTS = [
     "localhost",
     "127.0.0.1",
-    *["192.168.{}.{}".format(i, j) for i in range(256) for j in range(256)],
+    "192.168.0.0/16",
     ".zpaceway.local",
     ".zpaceway.com",
 ]
@@ -63,6 +67,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "fileship.hosts.HostValidationMiddleware",
+    "fileship.metrics.MetricsMiddleware",
+    "fileship.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -73,6 +80,20 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The API authenticates with JWT and tokens only, so its requests skip the
+# session, CSRF, auth and messages middleware (see fileship.handlers).
+API_PATH_PREFIX = "/srv/api/"
+
+API_MIDDLEWARE = [
+    "fileship.hosts.HostValidationMiddleware",
+    "fileship.metrics.MetricsMiddleware",
+    "fileship.profiling.ProfilingMiddleware",
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
@@ -155,6 +176,201 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 MEDIA_URL = "srv/media/"
 
+UPLOAD_SPOOL_ROOT = BASE_DIR / "spool"
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+# Per account, so the limit grows with the number of configured bots/channels.
+UPLOAD_CONNECTOR_CONCURRENCY = {
+    "telegram": int(os.getenv("TELEGRAM_UPLOAD_CONCURRENCY", "4")),
+    "discord": int(os.getenv("DISCORD_UPLOAD_CONCURRENCY", "4")),
+}
+
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "12"))
+
+UPLOAD_JOB_BACKOFF_BASE = 2
+
+UPLOAD_JOB_BACKOFF_CAP = 600
+
+UPLOAD_JOB_LOCK_TIMEOUT = 15 * 60
+
+CONNECTOR_CHUNK_SIZES = {
+    "telegram": int(os.getenv("TELEGRAM_CHUNK_SIZE", str(20 * 1024 * 1024))),
+    "discord": int(os.getenv("DISCORD_CHUNK_SIZE", str(8 * 1024 * 1024))),
+    "local": int(os.getenv("LOCAL_CHUNK_SIZE", str(64 * 1024 * 1024))),
+}
+
+# Files up to PACK_MAX_FILE_SIZE are stored together in shared pack chunks of
+# about PACK_SIZE instead of one connector upload each.
+PACK_SIZE = int(os.getenv("PACK_SIZE", str(4 * 1024 * 1024)))
+
+PACK_MAX_FILE_SIZE = int(os.getenv("PACK_MAX_FILE_SIZE", str(256 * 1024)))
+
+ADAPTIVE_CHUNK_SIZE = os.getenv("ADAPTIVE_CHUNK_SIZE", "false") == "true"
+
+ADAPTIVE_CHUNK_TARGET_SECONDS = 10
+
+ADAPTIVE_CHUNK_MIN_SIZE = 1024 * 1024
+
+ADAPTIVE_CHUNK_THROUGHPUT_ALPHA = 0.2
+
+CIRCUIT_BREAKER = {
+    "failure_threshold": 3,
+    "error_rate_threshold": 0.5,
+    "ewma_alpha": 0.2,
+    "cooldown": float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "30")),
+}
+
+CONNECTOR_FALLBACKS = {
+    connector: fallback
+    for connector, fallback in {
+        "telegram": os.getenv("TELEGRAM_FALLBACK_CONNECTOR"),
+        "discord": os.getenv("DISCORD_FALLBACK_CONNECTOR"),
+    }.items()
+    if fallback
+}
+
+# Rate limits like the OTP ones below count requests in this cache. Without
+# REDIS_URL each process keeps its own counts, so deployments running more
+# than one web process need Redis for the limits to hold.
+CACHES = {
+    "default": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+        if os.getenv("REDIS_URL")
+        else {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    ),
+}
+
+MAILER_QUEUE_SIZE = 1000
+
+MAILER_WORKERS = int(os.getenv("MAILER_WORKERS", "2"))
+
+# (requests, seconds) allowed per email address and per client IP, counted in
+# the default cache.
+OTP_EMAIL_RATE = (int(os.getenv("OTP_EMAIL_RATE", "3")), 10 * 60)
+
+OTP_IP_RATE = (int(os.getenv("OTP_IP_RATE", "20")), 60 * 60)
+
+# Number of reverse proxies in front of the app whose X-Forwarded-For
+# entries can be trusted.
+NUM_PROXIES = int(os.getenv("NUM_PROXIES", "0"))
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+DISCORD_API_URL = os.getenv("DISCORD_API_URL", "https://discord.com/api/v10")
+
+# (connect, read) timeouts in seconds for upstream requests.
+CONNECTOR_UPLOAD_TIMEOUT = (10, 5 * 60)
+
+CONNECTOR_API_TIMEOUT = (10, 30)
+
+CONNECTOR_DOWNLOAD_TIMEOUT = (10, 2 * 60)
+
+TELEGRAM_FILE_PATH_CACHE_TIMEOUT = 50 * 60
+
+# /metrics requires an "Authorization: Bearer <token>" header with this token,
+# and stays closed while it's unset.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Web and upload worker processes each write their metrics here every
+# METRICS_EXPORT_INTERVAL seconds, so /metrics can report all of them.
+METRICS_DIR = os.getenv("METRICS_DIR", str(BASE_DIR / "metrics"))
+
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "5"))
+
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+
+# Requests sending this value in "X-Profile" are always traced, and also run
+# under cProfile when they add "X-Profile-Mode: cprofile".
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+
+PROFILING_ROOT = BASE_DIR / "profiles"
+
+PROFILING_MAX_FILES = 100
+
+# Records are queued and written as JSON lines by a background thread, so
+# logging never formats or blocks on stdout in a request or upload thread.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "queue": {
+            "()": "fileship.logs.QueueHandler",
+        },
+    },
+    "loggers": {
+        "fileship": {
+            "handlers": ["queue"],
+            "level": os.getenv("FILESHIP_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+        "buckets": {
+            "handlers": ["queue"],
+            "level": os.getenv("FILESHIP_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# Base64 encoded 32 byte key that wraps the per-chunk keys of encrypted buckets.
+# Without it encrypted buckets can't be created or written to.
+FILESHIP_MASTER_KEY = os.getenv("FILESHIP_MASTER_KEY")
+
+ARCHIVE_PREFETCH_CHUNKS = int(os.getenv("ARCHIVE_PREFETCH_CHUNKS", "4"))
+
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "5000"))
+
+# Bytes each user may store across the buckets they own, unless their own
+# quota says otherwise. Unlimited when unset.
+DEFAULT_USER_QUOTA = (
+    int(os.getenv("DEFAULT_USER_QUOTA")) if os.getenv("DEFAULT_USER_QUOTA") else None
+)
+
+# Seconds between the change feed's checks for new events, shared by every
+# stream open in a process.
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.5"))
+
+EVENTS_KEEPALIVE_INTERVAL = float(os.getenv("EVENTS_KEEPALIVE_INTERVAL", "15"))
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+
+EVENTS_MAX_REPLAY = int(os.getenv("EVENTS_MAX_REPLAY", "1000"))
+
+EVENTS_RETRY_MILLISECONDS = int(os.getenv("EVENTS_RETRY_MILLISECONDS", "3000"))
+
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "7"))
+
+# Hours an upload may sit unfinished before reconcilestorage removes it.
+# Files in media/ younger than this are left alone as well, since connectors
+# write them before their chunk row is saved.
+RECONCILE_UPLOAD_TTL_HOURS = int(os.getenv("RECONCILE_UPLOAD_TTL_HOURS", "24"))
+
+TIERING_HOT_ACCESS_COUNT = int(os.getenv("TIERING_HOT_ACCESS_COUNT", "5"))
+
+TIERING_COLD_AFTER_DAYS = int(os.getenv("TIERING_COLD_AFTER_DAYS", "30"))
+
+TIERING_COLD_CONNECTOR = os.getenv("TIERING_COLD_CONNECTOR")
+
+CONNECTOR_RATE_LIMITS = {
+    "telegram": {
+        "rate": float(os.getenv("TELEGRAM_UPLOAD_RATE", "1")),
+        "burst": float(os.getenv("TELEGRAM_UPLOAD_BURST", "3")),
+    },
+    "telegram_files": {
+        "rate": float(os.getenv("TELEGRAM_API_RATE", "25")),
+        "burst": float(os.getenv("TELEGRAM_API_BURST", "30")),
+    },
+    "discord": {
+        "rate": float(os.getenv("DISCORD_UPLOAD_RATE", "1")),
+        "burst": float(os.getenv("DISCORD_UPLOAD_BURST", "5")),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
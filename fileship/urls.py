@@ -1,5 +1,7 @@
 from django.urls import path, include
 from core.views import OTPRequestView, OTPValidateView, UserView
+from fileship.metrics import metrics_view
+from fileship.profiling import ProfileView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 
@@ -9,4 +11,6 @@ urlpatterns = [
     path("srv/api/users/otp/validate/", OTPValidateView.as_view()),
     path("srv/api/users/token/refresh/", TokenRefreshView.as_view()),
     path("srv/api/buckets/", include("buckets.urls")),
+    path("srv/api/profiles/<str:profile_id>/", ProfileView.as_view()),
+    path("metrics", metrics_view),
 ]
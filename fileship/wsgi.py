@@ -9,8 +9,8 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
 from django.conf import settings
+from fileship.handlers import get_wsgi_application
 from whitenoise import WhiteNoise  # type: ignore
 
 